@@ -1,9 +1,12 @@
+import gc
 import os
+import weakref
 
 from hypothesis import given
 from hypothesis.strategies import integers
 
-from tm_trees import TMTree, FileSystemTree
+import tm_trees
+from tm_trees import TMTree, FileSystemTree, bulk_build
 
 # This should be the path to the "workshop" folder in the sample data.
 # You may need to modify this, depending on where you downloaded and
@@ -257,6 +260,44 @@ def test_delete_self() -> None:
     assert not gggp.delete_self()
 
 
+def test_delete_inside_deleted_subtree() -> None:
+    """Test that deleting a tree inside a subtree that was already deleted
+    only changes that subtree, whether or not the subtrees are sorted by
+    size, and that both deletes can be undone.
+    """
+    for by_size in (False, True):
+        tree = FileSystemTree(EXAMPLE_PATH)
+        _sort_subtrees(tree)
+        activities = tree._subtrees[0]
+        images = activities._subtrees[1]
+        if by_size:
+            tree.sort_subtrees_by_size()
+        activities.delete_self()
+        size = tree.data_size
+        images.delete_self()
+        assert tree.data_size == size == \
+            sum(subtree.data_size for subtree in tree._subtrees)
+        assert activities.data_size == \
+            sum(subtree.data_size for subtree in activities._subtrees)
+        assert tree.undo() and tree.undo()
+        assert tree.data_size == 151
+
+
+def test_delete_last_file_resets_rect() -> None:
+    """Test that a folder emptied by a delete is no longer drawn, even when
+    the whole tree is empty afterwards.
+    """
+    leaf = TMTree('a', [], 5)
+    folder = TMTree('f', [leaf])
+    tree = TMTree('root', [folder])
+    tree.expand_all()
+    tree.update_rectangles((0, 0, 100, 100))
+    assert leaf.delete_self()
+    assert tree.data_size == 0
+    assert folder.rect == (0, 0, 0, 0)
+    assert all(rect == (0, 0, 0, 0) for rect, _ in tree.get_rectangles())
+
+
 def test_delete_folders_with_no_files() -> None:
     """Test whether deleting a single file resulting in chained empty folders
     causes folders to be deleted and what happens in these situations
@@ -277,6 +318,431 @@ def test_delete_folders_with_no_files() -> None:
     assert new_leaf.get_parent().data_size == 0
 
 
+def test_batch_defers_rectangles() -> None:
+    """Test that a batch of deletions and resizes keeps the data sizes up to
+    date, but only updates the rectangles once the batch is closed.
+    """
+    tree = FileSystemTree(EXAMPLE_PATH)
+    _sort_subtrees(tree)
+    tree.update_rectangles((0, 0, 200, 100))
+    tree.expand_all()
+    draft = tree._subtrees[1]
+    old_rect = draft.rect
+    q2, q3 = tree._subtrees[0]._subtrees[1]._subtrees
+
+    with tree.batch() as root:
+        assert root is tree
+        assert q2.delete_self()
+        q3.change_size(1.0)
+        assert tree.data_size == 151 - 20 + 49
+        assert q3.get_parent().data_size == 98
+        assert draft.rect == old_rect
+
+    assert draft.rect != old_rect
+    assert len(tree.get_rectangles()) == 5
+
+
+def test_undo_redo() -> None:
+    """Test that deletes, moves and resizes can be undone and redone, in
+    order, restoring the structure and data sizes of the tree.
+    """
+    tree = FileSystemTree(EXAMPLE_PATH)
+    _sort_subtrees(tree)
+    tree.update_rectangles((0, 0, 200, 100))
+    activities, draft, other = tree._subtrees
+    images = activities._subtrees[1]
+    q2 = images._subtrees[0]
+    start = tree.checkpoint()
+
+    assert draft.delete_self()
+    q2.change_size(1.0)
+    q2.move(activities)
+    assert tree.data_size == 151 - 58 + 20
+    assert q2.get_parent() is activities
+    assert images.data_size == 49
+
+    assert tree.undo()
+    assert q2.get_parent() is images
+    assert images._subtrees[0] is q2
+    assert tree.undo()
+    assert q2.data_size == 20
+    assert tree.undo()
+    assert tree._subtrees == [activities, draft, other]
+    assert tree.data_size == 151
+    assert not tree.undo()
+
+    assert tree.redo()
+    assert tree.redo()
+    assert tree.data_size == 151 - 58 + 20
+    tree.undo_to(start)
+    assert tree.data_size == 151
+    assert tree.checkpoint() == start
+
+
+def test_undo_keeps_expansion() -> None:
+    """Test that undoing the delete of the last subtree of a folder puts the
+    subtree back as it was displayed, without collapsing it.
+    """
+    tree = FileSystemTree(EXAMPLE_PATH)
+    _sort_subtrees(tree)
+    activities = tree._subtrees[0]
+    tree.expand_all()
+    tree.update_rectangles((0, 0, 200, 100))
+    leaves = len(tree.get_rectangles())
+    for subtree in list(activities._subtrees):
+        subtree.delete_self()
+    assert not activities._expanded
+    while tree.undo():
+        pass
+    assert activities._expanded
+    assert all(subtree._expanded for subtree in activities._subtrees
+               if len(subtree._subtrees) > 0)
+    assert len(tree.get_rectangles()) == leaves
+
+
+def test_edit_log_limit(monkeypatch) -> None:
+    """Test that only the last UNDO_LIMIT edits are kept, and that edits in a
+    batch that is not undoable are not kept at all.
+    """
+    monkeypatch.setattr(tm_trees, 'UNDO_LIMIT', 2)
+    tree = FileSystemTree(EXAMPLE_PATH)
+    _sort_subtrees(tree)
+    tree.update_rectangles((0, 0, 200, 100))
+    draft = tree._subtrees[1]
+    start = tree.checkpoint()
+    for _ in range(3):
+        draft.change_size(1.0)
+    assert draft.data_size == 58 * 8
+    tree.undo_to(start)
+    assert draft.data_size == 58 * 2
+    assert tree.checkpoint() == start + 1
+
+    with tree.batch(undoable=False):
+        deleted = weakref.ref(tree._subtrees[0])
+        tree._subtrees[0].delete_self()
+        assert deleted() is None
+    assert not tree.undo()
+    draft.change_size(1.0)
+    assert tree.undo()
+    assert draft.data_size == 58 * 2
+
+
+def test_path_string_after_move() -> None:
+    """Test that cached path strings are recomputed after a tree is moved.
+    """
+    tree = FileSystemTree(EXAMPLE_PATH)
+    _sort_subtrees(tree)
+    activities = tree._subtrees[0]
+    q2 = activities._subtrees[1]._subtrees[0]
+    assert q2.get_path_string() == os.path.join('workshop', 'activities',
+                                                'images', 'Q2.pdf')
+    assert q2.get_parent().get_path_string() == os.path.join(
+        'workshop', 'activities', 'images')
+
+    q2.move(activities)
+    assert q2.get_path_string() == os.path.join('workshop', 'activities',
+                                                'Q2.pdf')
+    assert activities.get_path_string() == os.path.join('workshop',
+                                                        'activities')
+
+
+def test_bulk_delete_keeps_order() -> None:
+    """Test that deleting many subtrees of a folder keeps the order of the
+    rest, and that undoing the deletions restores the original order.
+    """
+    leaves = [TMTree(str(i), [], 1) for i in range(100)]
+    folder = TMTree('folder', leaves)
+    with folder.batch():
+        for leaf in leaves[:90]:
+            assert leaf.delete_self()
+    assert folder._subtrees == leaves[90:]
+    assert folder._subtrees[0] is leaves[90]
+    assert folder.data_size == 10
+
+    folder.undo_to(0)
+    assert folder._subtrees == leaves
+    assert folder.data_size == 100
+
+
+def test_index_and_undo_after_deletes() -> None:
+    """Test that the subtrees can be indexed between deletes, and that undoing
+    and redoing deletes, before and after the tombstones are compacted,
+    keeps the order of the subtrees.
+    """
+    leaves = [TMTree(str(i), [], 1) for i in range(1000)]
+    folder = TMTree('folder', leaves)
+    with folder.batch():
+        for i in range(0, 1000, 2):
+            assert leaves[i + 1].delete_self()
+            assert folder._subtrees[-1] is leaves[-1 if i < 998 else 998]
+            assert folder._subtrees[i // 2] is leaves[i]
+    kept = leaves[::2]
+    assert folder._subtrees[10:13] == kept[10:13]
+    assert folder._subtrees.index(kept[-3]) == len(kept) - 3
+    with folder.batch():
+        for i, leaf in enumerate(kept[:450]):
+            leaf.delete_self()
+            assert folder._subtrees[0] is kept[i + 1]
+        while folder.undo():
+            pass
+        assert folder._subtrees[0] is leaves[0]
+        assert folder._subtrees[-1] is leaves[-1]
+    assert folder._subtrees == leaves
+    assert len(folder._subtrees.backing()) == len(leaves)
+    assert folder.redo() and folder.redo()
+    assert folder._subtrees[0:3] == [leaves[0], leaves[2], leaves[4]]
+    folder.undo_to(0)
+    assert folder._subtrees == leaves
+
+
+def test_expand_all_then_collapse() -> None:
+    """Test that collapsing a folder after expanding everything also
+    collapses the folders inside it, and that expanding it again only
+    expands it by one depth.
+    """
+    tree = FileSystemTree(EXAMPLE_PATH)
+    _sort_subtrees(tree)
+    tree.update_rectangles((0, 0, 200, 100))
+    activities = tree._subtrees[0]
+    images = activities._subtrees[1]
+
+    tree.expand_all()
+    assert tree._expanded and activities._expanded and images._expanded
+    assert len(tree.get_rectangles()) == 6
+
+    images._subtrees[0].collapse()
+    assert not images._expanded
+    assert len(tree.get_rectangles()) == 5
+    images.collapse()
+    assert not activities._expanded and not images._expanded
+    assert activities.get_rectangles() == [(activities.rect,
+                                            activities._colour)]
+
+    activities.expand()
+    assert activities._expanded and not images._expanded
+    assert (images.rect, images._colour) in activities.get_rectangles()
+
+    tree.collapse_all()
+    assert not tree._expanded and not activities._expanded
+    assert len(tree.get_rectangles()) == 1
+
+
+def test_layout_cache_after_zoom(monkeypatch) -> None:
+    """Test that laying out a tree again after laying out one of its
+    subtrees restores its rectangles without computing them, and that they
+    are computed again, and the other layouts dropped, after an edit.
+    """
+    tree = FileSystemTree(EXAMPLE_PATH)
+    _sort_subtrees(tree)
+    tree.expand_all()
+    tree.update_rectangles((0, 0, 200, 100))
+    nodes = [tree]
+    for node in nodes:
+        nodes.extend(node._subtrees)
+    before = [node.rect for node in nodes]
+
+    activities = tree._subtrees[0]
+    activities.update_rectangles((0, 0, 200, 100))
+    assert activities.rect == (0, 0, 200, 100)
+
+    def fail(*args) -> None:
+        raise AssertionError('layout was computed')
+    with monkeypatch.context() as patch:
+        patch.setattr(TMTree, '_tm_alg', fail)
+        tree.update_rectangles((0, 0, 200, 100))
+    assert [node.rect for node in nodes] == before
+
+    draft = tree._subtrees[1]
+    draft.change_size(1.0)
+    assert draft.rect != before[nodes.index(draft)]
+    assert tree.rect == (0, 0, 200, 100)
+    # The layout of activities can no longer be restored, so it is dropped
+    # rather than keeping its trees alive.
+    assert activities._layout is None
+    assert len(TMTree._layouts) <= tm_trees.LAYOUT_CACHE_SIZE
+
+
+def test_labels() -> None:
+    """Test that only the displayed trees are labelled, and only if their
+    rectangles are big enough.
+    """
+    tree = FileSystemTree(EXAMPLE_PATH)
+    _sort_subtrees(tree)
+    tree.update_rectangles((0, 0, 200, 100))
+    assert tree.get_labels(1, 1) == [((0, 0, 200, 100), 'workshop')]
+
+    tree.expand_all()
+    labels = tree.get_labels(1, 1)
+    assert len(labels) == 6
+    assert (tree._subtrees[1].rect, 'draft.pptx') in labels
+    for rect, name in labels:
+        centre = (rect[0] + rect[2] // 2, rect[1] + rect[3] // 2)
+        assert tree.get_tree_at_position(centre)._name == name
+    assert len(tree.get_labels(30, 1)) < 6
+    assert tree.get_labels(201, 1) == []
+
+
+def _is_sorted_by_size(tree: TMTree) -> bool:
+    """Return whether the subtrees of <tree> and of all its descendants are
+    in order of data_size, largest first.
+    """
+    sizes = [subtree.data_size for subtree in tree._subtrees]
+    return sizes == sorted(sizes, reverse=True) and \
+        all(_is_sorted_by_size(subtree) for subtree in tree._subtrees)
+
+
+def test_sort_subtrees_by_size() -> None:
+    """Test that the subtrees stay sorted by size as the tree is edited, and
+    when the edits are undone.
+    """
+    tree = FileSystemTree(EXAMPLE_PATH)
+    _sort_subtrees(tree)
+    activities = tree._subtrees[0]
+    images = [t for t in activities._subtrees if t._name == 'images'][0]
+    q2, q3 = sorted(images._subtrees, key=lambda t: t._name)
+    tree.sort_subtrees_by_size()
+    assert _is_sorted_by_size(tree)
+    assert images._subtrees[0] is q3
+
+    q2.change_size(2)
+    assert images._subtrees[0] is q2
+    assert _is_sorted_by_size(tree)
+    q2.move(tree)
+    assert q2 in tree._subtrees and q2 not in images._subtrees
+    assert _is_sorted_by_size(tree)
+    tree._subtrees[0].delete_self()
+    assert len(tree._subtrees) == 3
+    assert _is_sorted_by_size(tree)
+
+    while tree.undo():
+        assert _is_sorted_by_size(tree)
+    assert list(images._subtrees) == [q3, q2]
+    assert tree.data_size == 151
+    while tree.redo():
+        assert _is_sorted_by_size(tree)
+    assert images._subtrees == [q3]
+
+
+def test_largest_leaves_and_subtrees() -> None:
+    """Test the largest leaf and subtree queries, with and without filters,
+    and after the tree is changed.
+    """
+    tree = FileSystemTree(EXAMPLE_PATH)
+    names = [t._name for t in tree.get_largest_leaves(2)]
+    assert names == ['draft.pptx', 'Q3.pdf']
+    names = [t._name for t in tree.get_largest_leaves(10, pattern='Q3*')]
+    assert names == ['Q3.pdf']
+    names = [t._name for t in tree.get_largest_leaves(1, max_depth=1)]
+    assert names == ['draft.pptx']
+    assert tree.get_largest_leaves(10, max_depth=0) == []
+
+    names = [t._name for t in tree.get_largest_subtrees(2)]
+    assert names == ['activities', 'images']
+    names = [t._name for t in tree.get_largest_subtrees(10, max_depth=1)]
+    assert 'images' not in names and names[0] == 'activities'
+
+    draft = tree.get_largest_leaves(1)[0]
+    draft.change_size(-0.9)
+    q3 = tree.get_largest_leaves(1)[0]
+    assert q3._name == 'Q3.pdf'
+    images = q3.get_parent()
+    q3.delete_self()
+    assert images.get_largest_leaves(1)[0]._name == 'Q2.pdf'
+    assert tree.get_largest_leaves(1)[0]._name != 'Q3.pdf'
+
+
+def test_largest_leaf_after_deletes(monkeypatch) -> None:
+    """Test that deleting leaves as large as the largest leaf does not search
+    the other leaves, and that the largest leaf is still found after the
+    largest leaves are deleted one by one.
+    """
+    leaves = [TMTree(str(i), [], 1 + i % 2) for i in range(1000)]
+    folder = TMTree('folder', leaves)
+    root = TMTree('root', [folder, TMTree('small', [TMTree('a', [], 1)])])
+    assert root._largest() == 2
+    counted = []
+    count_largest = TMTree._count_largest
+
+    def count(tree: TMTree, largest: int) -> None:
+        counted.append(tree)
+        count_largest(tree, largest)
+
+    monkeypatch.setattr(TMTree, '_count_largest', count)
+    with root.batch():
+        for leaf in leaves[1:998:2]:
+            leaf.delete_self()
+    assert root.get_largest_leaves(1)[0] is leaves[999]
+    assert counted == [folder]
+    monkeypatch.undo()
+    with root.batch():
+        leaves[999].delete_self()
+        assert folder._largest() == 1
+        leaves[998].change_size(3.0)
+    assert root.get_largest_leaves(1)[0] is leaves[998]
+    while root.undo():
+        pass
+    assert [leaf.data_size for leaf in root.get_largest_leaves(2)] == [2, 2]
+
+
+def test_type_breakdown() -> None:
+    """Test that the type breakdown is collected during the scan and kept up
+    to date by edits.
+    """
+    tree = FileSystemTree(EXAMPLE_PATH)
+    _sort_subtrees(tree)
+    images = tree._subtrees[0]._subtrees[1]
+    assert images.get_type_breakdown() == {'.pdf': (2, 69)}
+    pdfs = tree.get_type_breakdown()['.pdf']
+    assert tree.get_type_breakdown()['.pptx'] == (1, 58)
+
+    q2 = images._subtrees[0]
+    q2.change_size(0.1)
+    assert images.get_type_breakdown() == {'.pdf': (2, 71)}
+    q2.move(tree._subtrees[0])
+    assert images.get_type_breakdown() == {'.pdf': (1, 49)}
+    assert tree.get_type_breakdown()['.pdf'] == (pdfs[0], pdfs[1] + 2)
+    tree._subtrees[1].delete_self()
+    assert '.pptx' not in tree.get_type_breakdown()
+    tree.undo()
+    assert tree.get_type_breakdown()['.pptx'] == (1, 58)
+
+
+def test_bulk_build_frees_trees() -> None:
+    """Test that trees built in bulk_build are only frozen if asked, and
+    that trees are freed without the garbage collector once nothing but
+    their subtrees refers to them.
+    """
+    frozen = gc.get_freeze_count()
+    with bulk_build():
+        FileSystemTree(EXAMPLE_PATH)
+    assert gc.isenabled()
+    assert gc.get_freeze_count() == frozen
+    with bulk_build(freeze=True):
+        with bulk_build():
+            tree = FileSystemTree(EXAMPLE_PATH)
+        assert not gc.isenabled()
+    assert gc.isenabled()
+    assert gc.get_freeze_count() > frozen
+    gc.unfreeze()
+
+    _sort_subtrees(tree)
+    leaf = tree._subtrees[1]
+    images = tree._subtrees[0]._subtrees[1]
+    images.delete_self()
+    assert images.get_parent() is tree._subtrees[0]
+    assert all(is_valid_colour(t._colour) for t in images._subtrees)
+
+    gc.disable()
+    try:
+        folder = weakref.ref(tree)
+        del tree
+        assert folder() is None
+        assert leaf.get_parent() is None
+        assert images.get_parent() is None
+    finally:
+        gc.enable()
+
+
 ##############################################################################
 # Helpers
 ##############################################################################
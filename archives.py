@@ -0,0 +1,412 @@
+"""Assignment 2: Trees of the contents of archive files
+
+=== Module Description ===
+This module builds trees of the files and folders inside tar and zip archives,
+without extracting them.
+
+Only the index of an archive is read: the central directory of a zip file, or
+the member headers of a tar file, skipping over the data of each member. The
+size of each file is its uncompressed size, as recorded in the index. A tar
+file compressed as a whole (e.g. a .tar.gz) still has to be decompressed to
+find its headers, but nothing is written to disk.
+
+Archives inside an archive can optionally be opened too. They are shown as a
+single file, of their size in the outer archive, until they are expanded;
+then their index is read, and their size becomes the total size of their
+files.
+"""
+from __future__ import annotations
+
+import os
+import tarfile
+import zipfile
+from contextlib import ExitStack, contextmanager
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, \
+    Tuple, Union
+
+from tm_trees import TMTree, _LazySubtreeList, _add_type_counts, _file_type, \
+    convert_size
+
+Archive = Union[tarfile.TarFile, zipfile.ZipFile]
+
+# The size of the blocks of a tar archive.
+_BLOCK = 512
+# The tar header types of regular files, of the other members without data
+# (links, folders and devices), and of the headers describing the next member.
+_REGULAR_TYPES = (b'0', b'\0', b'7')
+_KNOWN_TYPES = _REGULAR_TYPES + (b'1', b'2', b'3', b'4', b'5', b'6')
+_EXTENDED_TYPES = (b'L', b'K', b'x', b'g')
+
+# The endings of the names of files that are opened as nested archives.
+ARCHIVE_SUFFIXES = ('.zip', '.jar', '.war', '.whl', '.tar', '.tgz', '.tar.gz',
+                    '.tbz2', '.tar.bz2', '.txz', '.tar.xz')
+
+
+def open_archive(filename: str, nested: bool = False) -> ArchiveTree:
+    """Return the tree of the files and folders in the tar or zip archive
+    <filename>.
+
+    If <nested> is True, the archives inside it can be expanded, and are
+    opened when they are first expanded.
+
+    Raise ValueError if <filename> is not a tar or zip archive.
+    """
+    with _open_nested(filename, ()) as archive:
+        subtrees = _build_subtrees(_read_index(archive), filename, (), nested)
+    tree = ArchiveTree(os.path.basename(filename), subtrees)
+    tree._archive = (filename, ())
+    if tree._types is None:
+        tree._types = {}
+    return tree
+
+
+def is_archive(filename: str) -> bool:
+    """Return whether <filename> is a tar or zip archive.
+    """
+    return tarfile.is_tarfile(filename) or zipfile.is_zipfile(filename)
+
+
+class ArchiveTree(TMTree):
+    """A tree of the files and folders in an archive.
+
+    The leaves represent the files in the archive, and the internal nodes
+    represent its folders, and the archives nested in it.
+
+    === Private Attributes ===
+    _archive:
+        The archive file this tree is the contents of, and the names of the
+        members of the archives nested in it leading to this tree, or None if
+        this tree is not the contents of an archive.
+
+    === Representation Invariants ===
+    - All TMTree RIs are inherited.
+    """
+
+    _archive: Optional[Tuple[str, Tuple[str, ...]]] = None
+
+    def __init__(self, name: str, subtrees: List[ArchiveTree],
+                 data_size: int = 0,
+                 archive: Optional[Tuple[str, Tuple[str, ...]]] = None) -> None:
+        """Initialize a tree with the given <name>, <subtrees> and
+        <data_size>, as in TMTree.
+
+        If <archive> is not None, this tree is the nested archive in it, of
+        size <data_size>, whose contents are read when they are first needed.
+        """
+        super().__init__(name, subtrees, data_size)
+        if archive is not None:
+            self._archive = archive
+            self._subtrees = _LazySubtreeList(self, 1)
+            self._largest_leaf = data_size
+            self._types = {_file_type(name): [1, data_size]}
+
+    def _load_subtrees(self) -> List[ArchiveTree]:
+        """Read and return the contents of the nested archive this tree is,
+        and update the sizes of this tree and its ancestors to match.
+
+        If the nested archive cannot be read, this tree becomes a leaf.
+        """
+        filename, members = self._archive
+        try:
+            with _open_nested(filename, members) as archive:
+                subtrees = _build_subtrees(_read_index(archive), filename,
+                                           members, True)
+        except (OSError, EOFError, KeyError, ValueError,
+                tarfile.TarError, zipfile.BadZipFile):
+            self._types = None
+            return []
+
+        types = {}
+        largest = 0
+        for subtree in subtrees:
+            subtree._parent_tree = self
+            _add_type_counts(types, subtree._type_counts(), 1)
+            largest = max(largest, subtree._largest())
+        old_largest, old_types = self._largest_leaf, self._types
+        self._propagate_size(sum(subtree.data_size for subtree in subtrees)
+                             - self.data_size)
+        self._largest_leaf = largest
+        self._largest_count = -1
+        self._types = types
+        if self._parent_ref() is not None:
+            self._parent_ref()._propagate_types(old_types, -1)
+            self._parent_ref()._propagate_types(types, 1)
+            self._parent_ref()._fix_largest(old_largest, largest)
+        return subtrees
+
+    def _open_nested_archives(self, recursive: bool) -> bool:
+        """Open the nested archive this tree is, if it was not opened yet,
+        and all the nested archives in it if <recursive> is True, and return
+        whether any were opened.
+        """
+        opened = False
+        stack = [self]
+        while stack:
+            tree = stack.pop()
+            if isinstance(tree._subtrees, _LazySubtreeList) and \
+                    not tree._subtrees.is_loaded():
+                opened = True
+                list(tree._subtrees)
+            if recursive:
+                stack.extend(tree._subtrees)
+        return opened
+
+    def expand(self) -> None:
+        """Expand this folder or nested archive by one depth, opening the
+        nested archive first if needed.
+        """
+        if self._open_nested_archives(False):
+            self._refresh()
+        super().expand()
+
+    def expand_all(self) -> None:
+        """Expand this tree and everything in it, opening all the nested
+        archives in it first if needed.
+        """
+        if self._open_nested_archives(True):
+            self._refresh()
+        super().expand_all()
+
+    def get_largest_leaves(self, k: int, max_depth: Optional[int] = None,
+                           pattern: Optional[str] = None) -> List[TMTree]:
+        """Return the <k> largest leaves of this tree, as in TMTree, opening
+        all the nested archives in it first, since opening one during the
+        search would change the sizes it is ordered by.
+        """
+        if self._open_nested_archives(True):
+            self._refresh()
+        return super().get_largest_leaves(k, max_depth, pattern)
+
+    def get_largest_subtrees(self, k: int, max_depth: Optional[int] = None,
+                             pattern: Optional[str] = None) -> List[TMTree]:
+        """Return the <k> largest subtrees of this tree, as in TMTree,
+        opening all the nested archives in it first, as in get_largest_leaves.
+        """
+        if self._open_nested_archives(True):
+            self._refresh()
+        return super().get_largest_subtrees(k, max_depth, pattern)
+
+    def _get_type(self) -> Optional[str]:
+        """Return the extension of this file, in lower case, or its name if
+        it is a core dump, or '' if it has neither.
+        """
+        return _file_type(self._name)
+
+    def get_separator(self) -> str:
+        """Return the separator used between names in archives.
+        """
+        return '/'
+
+    def get_suffix(self) -> str:
+        """Return the final descriptor of this tree.
+        """
+        components = []
+        if isinstance(self._subtrees, _LazySubtreeList) and \
+                not self._subtrees.is_loaded():
+            components.append('archive')
+        elif len(self._subtrees) == 0:
+            components.append('file')
+        else:
+            components.append('folder' if self._archive is None
+                              else 'archive')
+            components.append(f'{len(self._subtrees)} items')
+        components.append(convert_size(self.data_size))
+        return f' ({", ".join(components)})'
+
+
+def _build_subtrees(index: Iterable[Tuple[str, int, bool]], filename: str,
+                    members: Tuple[str, ...],
+                    nested: bool) -> List[ArchiveTree]:
+    """Return the trees of the top-level files and folders in an archive,
+    given its <index> of member names, sizes, and whether they are folders.
+
+    <filename> and <members> locate the archive, as in ArchiveTree._archive.
+    If <nested> is True, the archives in it are lazily opened.
+    """
+    root = {}
+    for path, size, is_dir in index:
+        parts = [part for part in path.split('/') if part not in ('', '.')]
+        if not parts:
+            continue
+        folder = root
+        for part in parts[:-1]:
+            child = folder.get(part)
+            if not isinstance(child, dict):
+                child = folder[part] = {}
+            folder = child
+        if isinstance(folder.get(parts[-1]), dict):
+            pass
+        elif is_dir:
+            folder[parts[-1]] = {}
+        else:
+            folder[parts[-1]] = (path, size)
+    return _make_subtrees(root, filename, members, nested)
+
+
+def _make_subtrees(folder: Dict[str, object], filename: str,
+                   members: Tuple[str, ...],
+                   nested: bool) -> List[ArchiveTree]:
+    """Return the trees of the files and folders in <folder>, which maps
+    the name of each file to its member name and size, and the name of each
+    folder to its own contents.
+
+    The other parameters are as in _build_subtrees.
+    """
+    subtrees = []
+    for name, entry in folder.items():
+        if isinstance(entry, dict):
+            tree = ArchiveTree(name, _make_subtrees(entry, filename, members,
+                                                    nested))
+            if tree._types is None:
+                tree._types = {}
+        elif nested and entry[1] > 0 and \
+                name.lower().endswith(ARCHIVE_SUFFIXES):
+            tree = ArchiveTree(name, [], entry[1],
+                               (filename, members + (entry[0],)))
+        else:
+            tree = ArchiveTree(name, [], entry[1])
+        subtrees.append(tree)
+    return subtrees
+
+
+@contextmanager
+def _open_nested(filename: str, members: Tuple[str, ...]) -> Iterator[Archive]:
+    """Open the archive that is the last of <members>, each nested in the
+    previous one, with the first nested in the archive <filename>, and yield
+    it.
+    """
+    with ExitStack() as stack:
+        archive = stack.enter_context(
+            _open_archive(stack.enter_context(open(filename, 'rb'))))
+        for member in members:
+            if isinstance(archive, zipfile.ZipFile):
+                file = archive.open(member)
+            else:
+                file = archive.extractfile(member)
+            archive = stack.enter_context(
+                _open_archive(stack.enter_context(file)))
+        yield archive
+
+
+def _open_archive(file: BinaryIO) -> Archive:
+    """Return <file> opened as a tar or zip archive.
+
+    Raise ValueError if it is neither.
+    """
+    try:
+        return tarfile.open(fileobj=file, mode='r:*')
+    except tarfile.TarError:
+        pass
+    file.seek(0)
+    try:
+        return zipfile.ZipFile(file)
+    except zipfile.BadZipFile:
+        raise ValueError('not a tar or zip archive') from None
+
+
+def _read_index(archive: Archive) -> Iterator[Tuple[str, int, bool]]:
+    """Yield the name and size of each member of <archive>, and whether it
+    is a folder, without reading the data of the members.
+
+    Members of a tar archive that are not regular files, like links, have
+    size 0.
+    """
+    if isinstance(archive, zipfile.ZipFile):
+        for info in archive.infolist():
+            yield info.filename, info.file_size, info.is_dir()
+        return
+    index = _read_tar_headers(archive.fileobj)
+    if index is not None:
+        yield from index
+        return
+    archive.fileobj.seek(0)
+    for info in archive:
+        yield info.name, info.size if info.isreg() else 0, info.isdir()
+
+
+def _read_tar_headers(file: BinaryIO) -> \
+        Optional[List[Tuple[str, int, bool]]]:
+    """Return the index of the tar archive in <file>, as in _read_index, or
+    None if it has headers that tarfile is needed for, like sparse files.
+
+    This reads only the headers of the ustar, GNU and pax formats, which is
+    several times faster than reading them with tarfile.
+    """
+    file.seek(0)
+    index = []
+    long_name = None
+    pax = {}
+    while True:
+        header = file.read(_BLOCK)
+        if len(header) < _BLOCK or header.count(0) == _BLOCK:
+            return index
+        if header[124] & 0x80 or not _valid_checksum(header):
+            return None
+        size = int(header[124:136].split(b'\0', 1)[0].strip() or b'0', 8)
+        kind = header[156:157]
+        if kind in _EXTENDED_TYPES:
+            data = file.read(size)
+            file.seek(-size % _BLOCK, 1)
+            if kind == b'L':
+                long_name = data.split(b'\0', 1)[0]
+            elif kind == b'x':
+                pax = _parse_pax(data)
+            continue
+        if kind not in _KNOWN_TYPES:
+            return None
+
+        if 'path' in pax:
+            name = pax['path']
+        else:
+            name = long_name or header[:100].split(b'\0', 1)[0]
+            prefix = header[345:500].split(b'\0', 1)[0]
+            if header[257:262] == b'ustar' and prefix and long_name is None:
+                name = prefix + b'/' + name
+            name = name.decode('utf-8', 'surrogateescape')
+        size = int(pax.get('size', size))
+        if kind == b'\0' and name.endswith('/'):
+            kind = b'5'
+        regular = kind in _REGULAR_TYPES
+        if kind == b'5':
+            name = name.rstrip('/')
+        index.append((name, size if regular else 0, kind == b'5'))
+        if regular:
+            file.seek(size + (-size % _BLOCK), 1)
+        long_name = None
+        pax = {}
+
+
+def _valid_checksum(header: bytes) -> bool:
+    """Return whether the checksum in the tar <header> is correct.
+    """
+    try:
+        checksum = int(header[148:156].split(b'\0', 1)[0].strip(), 8)
+    except ValueError:
+        return False
+    return checksum == sum(header) - sum(header[148:156]) + 8 * 32
+
+
+def _parse_pax(data: bytes) -> Dict[str, str]:
+    """Return the records of the pax extended header <data>.
+    """
+    records = {}
+    pos = 0
+    while pos < len(data) and data[pos] != 0:
+        space = data.index(b' ', pos)
+        length = int(data[pos:space])
+        key, value = data[space + 1:pos + length - 1].split(b'=', 1)
+        records[key.decode('utf-8')] = value.decode('utf-8', 'surrogateescape')
+        pos += length
+    return records
+
+
+if __name__ == '__main__':
+    import python_ta
+
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'os', 'tarfile', 'zipfile', 'contextlib',
+            '__future__', 'tm_trees'
+        ],
+        'allowed-io': ['_open_nested']
+    })
@@ -0,0 +1,366 @@
+"""Assignment 2: Benchmarks for treemap trees
+
+=== Module Description ===
+This module times the operations of TMTree that the treemap visualiser and
+the command-line tools rely on, on synthetic trees of different shapes, so
+that changes that make them slower can be noticed.
+
+A shape is a function that returns the layout of a tree with about the given
+number of nodes, as nested lists: a leaf is its data_size, and an internal
+node is the list of its subtrees. A layout can be built as a tree in memory
+(build_tree), or written to a temporary folder (write_directory) to time
+FileSystemTree.
+
+Run it to print the timings, save them, and compare them to saved ones:
+
+    python benchmarks.py --nodes 1000000 --save baseline.json
+    python benchmarks.py --nodes 1000000 --baseline baseline.json
+
+Comparing fails, with exit status 1, if any timing is slower than the
+baseline by more than the tolerance.
+"""
+from __future__ import annotations
+
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from papers import PaperTree
+from tm_trees import TMTree, FileSystemTree, bulk_build
+
+Layout = Union[int, List[Any]]
+
+# The number of folders nested in each chain of a deep tree. Trees are
+# traversed recursively, so this stays well below the recursion limit.
+DEEP_DEPTH = 200
+# The number of subtrees of each folder in a balanced tree.
+FANOUT = 10
+# The rectangle trees are laid out in, as in the visualiser.
+RECT = (0, 0, 1200, 670)
+
+
+class SyntheticTree(TMTree):
+    """A tree built from a synthetic layout.
+
+    === Representation Invariants ===
+    - All TMTree RIs are inherited.
+    """
+
+    def get_separator(self) -> str:
+        """Return the separator used in synthetic paths.
+        """
+        return '/'
+
+    def get_suffix(self) -> str:
+        """Return the final descriptor of this tree, which is empty.
+        """
+        return ''
+
+
+def wide(n: int, rng: random.Random) -> Layout:
+    """Return the layout of a folder with <n> files.
+    """
+    return [_file_size(rng) for _ in range(n)]
+
+
+def deep(n: int, rng: random.Random) -> Layout:
+    """Return the layout of a folder of chains of DEEP_DEPTH nested folders,
+    each holding one file and the next folder, with about <n> nodes in total.
+    """
+    chains = []
+    for _ in range(max(1, n // (2 * DEEP_DEPTH))):
+        chain = [_file_size(rng)]
+        for _ in range(DEEP_DEPTH - 1):
+            chain = [_file_size(rng), chain]
+        chains.append(chain)
+    return chains
+
+
+def balanced(n: int, rng: random.Random) -> Layout:
+    """Return the layout of a tree with about <n> nodes, in which every
+    folder has FANOUT subtrees, and all files are at about the same depth.
+    """
+    if n <= FANOUT:
+        return [_file_size(rng) for _ in range(max(1, n))]
+    return [balanced((n - 1) // FANOUT, rng) for _ in range(FANOUT)]
+
+
+def skewed(n: int, rng: random.Random) -> Layout:
+    """Return the layout of a tree with about <n> nodes, in which the first
+    subtree of each folder has half of its nodes, the next a quarter, and so
+    on, and file sizes have a heavy tail.
+    """
+    subtrees = []
+    remaining = n - 1
+    while remaining > 0:
+        take = max(1, remaining // 2)
+        if take == 1:
+            subtrees.append(int(rng.paretovariate(1.2) * 1000))
+        else:
+            subtrees.append(skewed(take, rng))
+        remaining -= take
+    return subtrees or [int(rng.paretovariate(1.2) * 1000)]
+
+
+SHAPES = {'wide': wide, 'deep': deep, 'balanced': balanced, 'skewed': skewed}
+
+
+def _file_size(rng: random.Random) -> int:
+    """Return a random file size.
+    """
+    return rng.randint(1, 1 << 20)
+
+
+def count_nodes(layout: Layout) -> int:
+    """Return the number of nodes in <layout>.
+    """
+    count = 0
+    stack = [layout]
+    while stack:
+        node = stack.pop()
+        count += 1
+        if isinstance(node, list):
+            stack.extend(node)
+    return count
+
+
+def build_tree(layout: Layout, name: str = 'root') -> SyntheticTree:
+    """Return a SyntheticTree with <layout>, whose root is called <name>.
+
+    The files are called f0, f1, ... and the folders d0, d1, ... in each
+    folder.
+    """
+    if not isinstance(layout, list):
+        return SyntheticTree(name, [], layout)
+    subtrees = []
+    for i, subtree in enumerate(layout):
+        prefix = 'd' if isinstance(subtree, list) else 'f'
+        subtrees.append(build_tree(subtree, f'{prefix}{i}'))
+    return SyntheticTree(name, subtrees)
+
+
+def write_directory(layout: Layout, path: str) -> None:
+    """Create the folder <path> with <layout>, named like build_tree names
+    them.
+
+    The files are sparse, so they take little disk space whatever their size.
+    """
+    os.mkdir(path)
+    for i, subtree in enumerate(layout):
+        if isinstance(subtree, list):
+            write_directory(subtree, os.path.join(path, f'd{i}'))
+        else:
+            with open(os.path.join(path, f'f{i}'), 'wb') as file:
+                file.truncate(subtree)
+
+
+def run_benchmarks(nodes: int, disk_nodes: int, repeat: int = 3,
+                   edits: int = 1000, queries: int = 20,
+                   seed: int = 148, workers: int = 1) -> Dict[str, float]:
+    """Return the best time of <repeat> runs, in seconds, of each benchmark
+    on trees of each shape with about <nodes> nodes.
+
+    FileSystemTree is timed on folders with about <disk_nodes> nodes, the
+    edits are timed with <edits> of each kind, and get_tree_at_position with
+    <queries> positions. If <workers> is more than 1, the layout is also
+    timed with that many processes.
+    """
+    results = {}
+    for shape, make in SHAPES.items():
+        rng = random.Random(seed)
+        layout = make(nodes, rng)
+        results[f'{shape}/build'] = _best(repeat, lambda: build_tree(layout))
+        results[f'{shape}/build_bulk'] = \
+            _best(repeat, lambda: _build_bulk(layout))
+        tree = build_tree(layout)
+        results[f'{shape}/collect'] = _best(repeat, gc.collect)
+        _time_tree(shape, tree, rng, repeat, (edits, queries, workers),
+                   results)
+
+        disk_layout = make(disk_nodes, rng)
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'root')
+            write_directory(disk_layout, path)
+            results[f'{shape}/scan'] = \
+                _best(repeat, lambda: FileSystemTree(path))
+
+    results['papers/load'] = _best(
+        repeat, lambda: PaperTree('CS1', [], all_papers=True, by_year=True))
+    results['papers/load_lazy'] = _best(
+        repeat, lambda: PaperTree('CS1', [], all_papers=True, by_year=True,
+                                  lazy=True))
+    return results
+
+
+def _time_tree(shape: str, tree: TMTree, rng: random.Random, repeat: int,
+               counts: Tuple[int, int, int],
+               results: Dict[str, float]) -> None:
+    """Add the times of the layout, query and edit benchmarks on <tree>, of
+    the given <shape>, to <results>, with the number of edits of each kind,
+    the number of queries and the number of layout processes in <counts>.
+    """
+    edits, queries, workers = counts
+    tree.expand_all()
+    results[f'{shape}/update_rectangles'] = \
+        _best(repeat, lambda: _relayout(tree))
+    if workers > 1:
+        results[f'{shape}/update_rectangles_parallel'] = \
+            _best(repeat, lambda: _relayout(tree, workers))
+        # Laying out in another rectangle reuses the plan of the layout.
+        sizes = iter(range(RECT[2] - 1, 0, -1))
+        results[f'{shape}/resize_parallel'] = _best(
+            repeat, lambda: tree.update_rectangles(
+                (0, 0, next(sizes), RECT[3]), workers))
+    child = max(tree._subtrees, key=lambda t: t.data_size)
+    results[f'{shape}/zoom'] = _best(
+        repeat, lambda: [child.update_rectangles(RECT),
+                         tree.update_rectangles(RECT)])
+    results[f'{shape}/get_rectangles'] = \
+        _best(repeat, tree.get_rectangles)
+
+    positions = [(rng.randrange(RECT[2]), rng.randrange(RECT[3]))
+                 for _ in range(queries)]
+    results[f'{shape}/get_tree_at_position'] = _best(
+        repeat, lambda: [tree.get_tree_at_position(p) for p in positions])
+
+    leaves, folders = [], []
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if len(node._subtrees) == 0:
+            leaves.append(node)
+        else:
+            folders.append(node)
+            stack.extend(node._subtrees)
+    resized = rng.sample(leaves, min(edits, len(leaves)))
+    moves = [(leaf, rng.choice(folders))
+             for leaf in rng.sample(leaves, min(edits, len(leaves)))]
+    deleted = rng.sample(leaves, min(edits, len(leaves)))
+
+    results[f'{shape}/change_size'] = _best_edit(
+        repeat, tree, lambda: [leaf.change_size(0.5) for leaf in resized])
+    results[f'{shape}/move'] = _best_edit(
+        repeat, tree, lambda: [leaf.move(folder) for leaf, folder in moves])
+    results[f'{shape}/delete_self'] = _best_edit(
+        repeat, tree, lambda: [leaf.delete_self() for leaf in deleted])
+    results[f'{shape}/single_change_size'] = _best_edit(
+        repeat, tree, lambda: resized[0].change_size(0.5), batch=False)
+
+
+def _build_bulk(layout: Layout) -> None:
+    """Build <layout> as a tree inside bulk_build.
+    """
+    with bulk_build():
+        build_tree(layout)
+
+
+def _relayout(tree: TMTree, workers: Optional[int] = None) -> None:
+    """Lay out <tree> in RECT, with <workers> processes, computing the layout
+    rather than restoring it from the layout cache.
+    """
+    TMTree._version += 1
+    tree.update_rectangles(RECT, workers)
+
+
+def _best(repeat: int, func: Callable[[], Any]) -> float:
+    """Return the shortest time taken by <repeat> calls to <func>.
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _best_edit(repeat: int, tree: TMTree, func: Callable[[], Any],
+               batch: bool = True) -> float:
+    """Return the shortest time taken by <repeat> calls to <func>, which
+    edits <tree>, in a batch if <batch> is True.
+
+    The edits are undone after each call, without being timed.
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        checkpoint = tree.checkpoint()
+        start = time.perf_counter()
+        if batch:
+            with tree.batch():
+                func()
+        else:
+            func()
+        best = min(best, time.perf_counter() - start)
+        tree.undo_to(checkpoint)
+    return best
+
+
+def compare(results: Dict[str, float], baseline: Dict[str, float],
+            tolerance: float) -> List[Tuple[str, float, float]]:
+    """Return the name, time and baseline time of each benchmark in both
+    <results> and <baseline> that is slower than its baseline by more than
+    the fraction <tolerance>.
+    """
+    return [(name, results[name], baseline[name])
+            for name in sorted(results) if name in baseline
+            and results[name] > baseline[name] * (1 + tolerance)]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Run the benchmarks with the command-line arguments <argv>, and return
+    the exit status.
+    """
+    parser = argparse.ArgumentParser(
+        description='Time the tree operations on synthetic trees.')
+    parser.add_argument('--nodes', type=int, default=100000,
+                        help='about how many nodes each tree has')
+    parser.add_argument('--disk-nodes', type=int, default=10000,
+                        help='about how many files and folders are scanned')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='how many times each benchmark is run')
+    parser.add_argument('--edits', type=int, default=1000,
+                        help='how many edits of each kind are timed')
+    parser.add_argument('--queries', type=int, default=20,
+                        help='how many positions get_tree_at_position is '
+                             'timed with')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='also time the layout with this many processes')
+    parser.add_argument('--save', metavar='FILE', default=None,
+                        help='save the results to this JSON file')
+    parser.add_argument('--baseline', metavar='FILE', default=None,
+                        help='compare the results to this JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='the fraction by which a benchmark may be '
+                             'slower than the baseline')
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.nodes, args.disk_nodes, args.repeat,
+                             args.edits, args.queries, workers=args.workers)
+    baseline = {}
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            baseline = json.load(file)['results']
+    for name, seconds in results.items():
+        line = f'{name:<36}{seconds * 1000:>12.3f} ms'
+        if name in baseline:
+            line += f'{seconds / baseline[name]:>10.2f}x'
+        print(line)
+
+    if args.save is not None:
+        with open(args.save, 'w') as file:
+            json.dump({'nodes': args.nodes, 'disk_nodes': args.disk_nodes,
+                       'results': results}, file, indent=2)
+    regressions = compare(results, baseline, args.tolerance)
+    for name, seconds, before in regressions:
+        print(f'Slower: {name} took {seconds * 1000:.3f} ms, '
+              f'{before * 1000:.3f} ms before')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,119 @@
+"""Assignment 2: Duplicate files in a file system tree
+
+=== Module Description ===
+This module finds the files in a FileSystemTree that have the same contents,
+and how many bytes could be reclaimed by keeping only one copy of each.
+
+Only files that could be duplicates are read:
+- Files are first grouped by size, which needs no reading at all, and files
+  with a size no other file has are dropped.
+- The first and last BLOCK_SIZE bytes of the remaining files are hashed, and
+  files are grouped by size and that hash.
+- Only the files that still have a possible duplicate are hashed in full.
+
+Files are read through memory maps, by a pool of threads, since hashing
+releases the GIL.
+"""
+from __future__ import annotations
+
+import hashlib
+import mmap
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+from tm_trees import FileSystemTree
+
+# The number of bytes hashed at each end of a file before it is hashed in
+# full.
+BLOCK_SIZE = 4096
+
+
+def find_duplicates(tree: FileSystemTree, workers: Optional[int] = None) -> \
+        List[Tuple[List[FileSystemTree], int]]:
+    """Return the sets of leaves in <tree> with the same contents, each with
+    the number of bytes that would be reclaimed by keeping only one of them,
+    most bytes first.
+
+    Empty files and files that cannot be read are ignored. <workers> is the
+    number of threads used to read files, as in ThreadPoolExecutor.
+    """
+    by_size: Dict[int, List[FileSystemTree]] = {}
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if len(node._subtrees) > 0:
+            stack.extend(node._subtrees)
+        elif node.data_size > 0:
+            by_size.setdefault(node.data_size, []).append(node)
+    groups = [group for group in by_size.values() if len(group) > 1]
+
+    with ThreadPoolExecutor(workers) as pool:
+        groups = _split_groups(groups, pool, _hash_ends)
+        # A file of at most two blocks was hashed in full already.
+        done = [g for g in groups if g[0].data_size <= 2 * BLOCK_SIZE]
+        groups = _split_groups(
+            [g for g in groups if g[0].data_size > 2 * BLOCK_SIZE], pool,
+            _hash_all)
+
+    duplicates = [(sorted(group, key=lambda t: t.get_path_string()),
+                   group[0].data_size * (len(group) - 1))
+                  for group in done + groups]
+    duplicates.sort(key=lambda d: -d[1])
+    return duplicates
+
+
+def _split_groups(groups: List[List[FileSystemTree]],
+                  pool: ThreadPoolExecutor,
+                  hash_file: Callable[[str], Optional[bytes]]) -> \
+        List[List[FileSystemTree]]:
+    """Return the groups of files in <groups> that have the same hash under
+    <hash_file>, using the threads in <pool>, without the files with no
+    duplicate left.
+    """
+    files = [tree for group in groups for tree in group]
+    hashes = pool.map(hash_file, [tree.get_file_path() for tree in files])
+    split: Dict[Hashable, List[FileSystemTree]] = {}
+    for tree, digest in zip(files, hashes):
+        if digest is not None:
+            split.setdefault((tree.data_size, digest), []).append(tree)
+    return [group for group in split.values() if len(group) > 1]
+
+
+def _hash_ends(path: str) -> Optional[bytes]:
+    """Return a hash of the first and last BLOCK_SIZE bytes of the file at
+    <path>, or None if it cannot be read.
+    """
+    return _hash_file(path, lambda data: data[:BLOCK_SIZE]
+                      + data[max(BLOCK_SIZE, len(data) - BLOCK_SIZE):])
+
+
+def _hash_all(path: str) -> Optional[bytes]:
+    """Return a hash of the contents of the file at <path>, or None if it
+    cannot be read.
+    """
+    return _hash_file(path, lambda data: data)
+
+
+def _hash_file(path: str, select: Callable[[mmap.mmap], bytes]) -> \
+        Optional[bytes]:
+    """Return a hash of the bytes chosen by <select> from the memory map of
+    the file at <path>, or None if it cannot be read.
+    """
+    try:
+        with open(path, 'rb') as file, \
+                mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return hashlib.blake2b(select(data), digest_size=16).digest()
+    except (OSError, ValueError):
+        return None
+
+
+if __name__ == '__main__':
+    import python_ta
+
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'hashlib', 'mmap', 'concurrent.futures',
+            '__future__', 'tm_trees'
+        ],
+        'allowed-io': ['_hash_file']
+    })
@@ -0,0 +1,518 @@
+"""Assignment 2: Estimated file system trees
+
+=== Module Description ===
+This module estimates the sizes in a file system from a sample of it, so
+that a treemap of a file system too large to scan quickly can be shown
+right away, and then refines the estimate into the exact sizes in the
+background.
+
+estimate_tree lists at most a given number of folders. In each folder it
+lists, it reads the sizes of at most SAMPLE_SIZE of its files and estimates
+at most SAMPLE_SIZE of its folders, sharing what is left of the number of
+folders to list between them. The size of the entries that were not sampled
+is extrapolated from the ones that were, and given to a single leaf, a
+remainder, in place of those entries. Each remainder also has the variance
+of its estimate, from which a confidence interval of the size of each folder
+is found.
+
+A Refiner replaces the remainders, in a background thread, by the entries
+they stand for: files with their exact sizes, and folders estimated in the
+same way, whose remainders are refined in turn. The remainders with the
+largest variance are refined first, so that the sizes least certain become
+exact first. The tree itself is only changed when Refiner.apply is called,
+e.g. by the treemap visualiser between frames, so it is never changed while
+it is being drawn.
+
+>>> tree = estimate_tree('/mnt/shared')
+>>> refiner = Refiner(tree)
+>>> refiner.start()
+>>> ...
+>>> if refiner.apply():
+...     tree.update_rectangles(tree.rect)
+"""
+from __future__ import annotations
+
+import heapq
+import math
+import os
+import queue
+import random
+import threading
+from typing import List, Optional, Set, Tuple
+
+from tm_trees import TMTree, FileSystemTree, convert_size
+
+# The number of files whose sizes are read, and the number of folders that
+# are estimated, in each folder that is listed.
+SAMPLE_SIZE = 32
+
+# The number of folders listed by estimate_tree, by default.
+MAX_FOLDERS = 1000
+
+# The number of standard errors on each side of an estimate in its
+# confidence interval, for a confidence of 95%.
+Z_SCORE = 1.96
+
+
+class EstimatedTree(FileSystemTree):
+    """A tree of files and folders in a file system, whose sizes may be
+    estimated.
+
+    The leaves represent files, or remainders, and the internal nodes
+    represent folders. A tree is estimated iff it is a remainder or it has
+    remainders in it.
+
+    === Private Attributes ===
+    _variance:
+        The variance of the estimate of data_size, which is the sum of the
+        variances of the remainders in this tree.
+    _remainders:
+        The number of remainders in this tree, including itself.
+
+    === Representation Invariants ===
+    - All TMTree RIs are inherited.
+    - _variance >= 0, and _variance == 0 if _remainders == 0
+    """
+
+    _variance: float = 0.0
+    _remainders: int = 0
+
+    def __init__(self, name: str, subtrees: List[EstimatedTree],
+                 data_size: int = 0) -> None:
+        """Initialize a tree with the given <name>, <subtrees> and
+        <data_size>, as in TMTree.
+
+        Unlike a FileSystemTree, this does not read the file system.
+        """
+        TMTree.__init__(self, name, subtrees, data_size)
+        if subtrees:
+            self._variance = sum(s._variance for s in subtrees)
+            self._remainders = sum(s._remainders for s in subtrees)
+
+    def is_estimated(self) -> bool:
+        """Return whether the size of this tree is estimated.
+        """
+        return self._remainders > 0
+
+    def get_interval(self) -> Tuple[int, int]:
+        """Return the lower and upper bounds of the 95% confidence interval
+        of the size of this tree.
+
+        Both bounds are data_size if this tree is not estimated.
+        """
+        error = Z_SCORE * math.sqrt(self._variance)
+        return max(0, math.floor(self.data_size - error)), \
+            math.ceil(self.data_size + error)
+
+    def get_estimated_rectangles(self) -> List[Tuple[int, int, int, int]]:
+        """Return the rectangles of the trees in the displayed-tree rooted at
+        this tree which are displayed, and estimated.
+
+        Trees that are not estimated are not visited.
+        """
+        lst = []
+        stack = [(self,) + self._ancestor_expansion()]
+        while stack:
+            tree, collapsed_at, expanded_all_at = stack.pop()
+            if tree._remainders == 0 or tree.data_size == 0:
+                continue
+            expanded, collapsed_at, expanded_all_at = \
+                tree._expansion(collapsed_at, expanded_all_at)
+            if expanded:
+                stack.extend((subtree, collapsed_at, expanded_all_at)
+                             for subtree in tree._subtrees)
+            else:
+                lst.append(tree.rect)
+        return lst
+
+    def get_suffix(self) -> str:
+        """Return the final descriptor of this tree, with the margin of
+        error of its size if it is estimated.
+        """
+        components = []
+        if len(self._subtrees) == 0:
+            components.append('file')
+        else:
+            components.append('folder')
+            items = sum(subtree._entries() for subtree in self._subtrees)
+            components.append(f'{items} items')
+        components.append(self._size_string())
+        return f' ({", ".join(components)})'
+
+    def _entries(self) -> int:
+        """Return the number of files and folders this tree stands for.
+        """
+        return 1
+
+    def _size_string(self) -> str:
+        """Return the size of this tree, with its margin of error if it is
+        estimated.
+        """
+        if self._remainders == 0:
+            return convert_size(self.data_size)
+        error = Z_SCORE * math.sqrt(self._variance)
+        return f'~{convert_size(self.data_size)} ± ' \
+               f'{convert_size(error)}, estimated'
+
+    def _add_estimate(self, variance: float, remainders: int) -> None:
+        """Add <variance> and <remainders> to the variance and the number of
+        remainders of this tree and its ancestors.
+        """
+        tree = self
+        while tree is not None:
+            tree._remainders += remainders
+            # Reset the variance when it must be 0, so rounding errors do
+            # not add up.
+            tree._variance = max(0.0, tree._variance + variance) \
+                if tree._remainders > 0 else 0.0
+            tree = tree._parent_ref()
+
+    def _attach(self, subtree: TMTree, position: Optional[int] = None) -> None:
+        super()._attach(subtree, position)
+        self._add_estimate(subtree._variance, subtree._remainders)
+
+    def _detach(self) -> None:
+        parent = self._parent_ref()
+        super()._detach()
+        parent._add_estimate(-self._variance, -self._remainders)
+
+
+class _Remainder(EstimatedTree):
+    """A leaf standing for the entries of a folder that were not sampled,
+    with their estimated total size.
+
+    === Private Attributes ===
+    _count:
+        The number of entries this leaf stands for.
+    """
+
+    _count: int
+
+    def __init__(self, count: int, data_size: int, variance: float) -> None:
+        """Initialize a remainder standing for <count> entries, with the
+        estimated total size <data_size> and the <variance> of that estimate.
+        """
+        super().__init__(f'({count} more items)', [], data_size)
+        self._count = count
+        self._variance = variance
+        self._remainders = 1
+
+    def _get_type(self) -> Optional[str]:
+        """Return None, since the types of the entries are not known.
+        """
+        return None
+
+    def _entries(self) -> int:
+        return self._count
+
+    def get_suffix(self) -> str:
+        """Return the final descriptor of this tree.
+        """
+        return f' ({self._size_string()})'
+
+
+class Refiner:
+    """A background thread that refines the sizes in an EstimatedTree, as
+    described in the module description.
+
+    === Public Attributes ===
+    tree:
+        The tree being refined.
+
+    === Private Attributes ===
+    _estimator:
+        The estimator of the folders found while refining.
+    _work:
+        The remainders left to refine, each with minus its variance, its id
+        so that remainders are never compared, the path of its folder, and
+        the names of the entries of its folder that are already in the
+        tree.
+    _results:
+        The remainders refined, each with the entries replacing it, in the
+        order they were refined.
+    _stop:
+        Set to stop refining.
+    _thread:
+        The thread refining the remainders.
+    """
+    tree: EstimatedTree
+    _estimator: _Estimator
+    _work: List[Tuple[float, int, _Remainder, str, Set[str]]]
+    _results: queue.Queue
+    _stop: threading.Event
+    _thread: threading.Thread
+
+    def __init__(self, tree: EstimatedTree,
+                 seed: Optional[int] = None) -> None:
+        """Initialize a refiner of <tree>, the root of a tree from
+        estimate_tree, which is started by start.
+        """
+        self.tree = tree
+        self._estimator = _Estimator(seed)
+        self._work = []
+        self._results = queue.Queue()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._add_work(tree, tree.get_file_path())
+
+    def start(self) -> None:
+        """Start refining the tree in the background.
+        """
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop refining the tree, and wait for the remainder being refined.
+        """
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def is_done(self) -> bool:
+        """Return whether refining finished, or was stopped, and all the
+        remainders refined were applied.
+        """
+        return self._thread.ident is not None and \
+            not self._thread.is_alive() and self._results.empty()
+
+    def apply(self) -> bool:
+        """Replace the remainders refined since the last call by their
+        entries, and return whether the tree changed.
+
+        Remainders that were removed from the tree, e.g. with delete_self,
+        are left out. This does not update the rectangles of the tree.
+        """
+        changed = False
+        while True:
+            try:
+                remainder, subtrees = self._results.get_nowait()
+            except queue.Empty:
+                return changed
+            folder = remainder.get_parent()
+            if folder is None or remainder not in folder._subtrees or \
+                    not self._is_attached(folder):
+                continue
+            for subtree in subtrees:
+                folder._attach(subtree)
+            remainder._detach()
+            changed = True
+
+    def _is_attached(self, tree: TMTree) -> bool:
+        """Return whether <tree> is in self.tree.
+        """
+        while tree._parent_ref() is not None:
+            if tree not in tree._parent_ref()._subtrees:
+                return False
+            tree = tree._parent_ref()
+        return tree is self.tree
+
+    def _add_work(self, tree: EstimatedTree, path: str) -> None:
+        """Add the remainders in <tree>, whose path is <path>, to the
+        remainders left to refine.
+        """
+        stack = [(tree, path)]
+        while stack:
+            tree, path = stack.pop()
+            if tree._remainders == 0:
+                continue
+            names = set()
+            for subtree in tree._subtrees:
+                if isinstance(subtree, _Remainder):
+                    heapq.heappush(self._work, (-subtree._variance,
+                                                id(subtree), subtree, path,
+                                                names))
+                else:
+                    names.add(subtree._name)
+                    stack.append((subtree, os.path.join(path,
+                                                        subtree._name)))
+
+    def _run(self) -> None:
+        """Refine the remainders left to refine, most uncertain first, until
+        there are none left or refining is stopped.
+        """
+        while self._work and not self._stop.is_set():
+            _, _, remainder, path, names = heapq.heappop(self._work)
+            files, folders = _list_folder(path)
+            subtrees = []
+            for name in files:
+                if name not in names:
+                    subtrees.append(EstimatedTree(
+                        name, [], _file_size(os.path.join(path, name))))
+            for name in folders:
+                if name not in names:
+                    subtree = self._estimator.estimate(
+                        os.path.join(path, name), 1)
+                    self._add_work(subtree, os.path.join(path, name))
+                    subtrees.append(subtree)
+            self._results.put((remainder, subtrees))
+
+
+class _Estimator:
+    """The estimator of the sizes of folders in estimate_tree.
+
+    === Private Attributes ===
+    _rng:
+        The random number generator choosing the samples.
+    _files:
+        The number of files whose sizes were read, and their total size.
+    _entries:
+        The number of folders listed, and the total number of entries in
+        them.
+    """
+    _rng: random.Random
+    _files: List[int]
+    _entries: List[int]
+
+    def __init__(self, seed: Optional[int] = None) -> None:
+        """Initialize an estimator, which chooses its samples with the
+        given random <seed>.
+        """
+        self._rng = random.Random(seed)
+        self._files = [0, 0]
+        self._entries = [0, 0]
+
+    def estimate(self, path: str, budget: int) -> EstimatedTree:
+        """Return the estimated tree of the file or folder at <path>, listing
+        at most <budget> folders, which must be at least 1.
+        """
+        name = os.path.basename(path)
+        if not os.path.isdir(path):
+            return EstimatedTree(name, [], _file_size(path))
+        files, folders = _list_folder(path)
+        self._entries[0] += 1
+        self._entries[1] += len(files) + len(folders)
+
+        sampled = self._rng.sample(files, min(len(files), SAMPLE_SIZE))
+        subtrees = [EstimatedTree(file, [],
+                                  _file_size(os.path.join(path, file)))
+                    for file in sampled]
+        sizes = [subtree.data_size for subtree in subtrees]
+        self._files[0] += len(sizes)
+        self._files[1] += sum(sizes)
+        size, variance = _extrapolate(sizes, len(files) - len(sampled),
+                                      self._guess_file())
+
+        count = min(len(folders), SAMPLE_SIZE, budget - 1)
+        explored = []
+        for i, folder in enumerate(self._rng.sample(folders, count)):
+            share = (budget - 1) // count + (i < (budget - 1) % count)
+            explored.append(self.estimate(os.path.join(path, folder), share))
+        folder_size, folder_variance = _extrapolate(
+            [subtree.data_size for subtree in explored],
+            len(folders) - count, self._guess_folder(),
+            sum(subtree._variance for subtree in explored))
+        subtrees.extend(explored)
+
+        left = len(files) - len(sampled) + len(folders) - count
+        if left > 0:
+            subtrees.append(_Remainder(left, size + folder_size,
+                                       variance + folder_variance))
+        return _folder(name, subtrees)
+
+    def _guess_file(self) -> float:
+        """Return the mean size of the files read so far, or 0 if none were.
+        """
+        return self._files[1] / self._files[0] if self._files[0] else 0.0
+
+    def _guess_folder(self) -> float:
+        """Return a guess of the size of a folder that cannot be sampled:
+        the mean size of a file times the mean number of entries in a
+        folder.
+        """
+        if self._entries[0] == 0:
+            return 0.0
+        return self._guess_file() * self._entries[1] / self._entries[0]
+
+
+def estimate_tree(path: str, max_folders: int = MAX_FOLDERS,
+                  seed: Optional[int] = None) -> EstimatedTree:
+    """Return the estimated tree of the file or folder at <path>, listing at
+    most <max_folders> folders, with samples chosen with the random <seed>.
+
+    Precondition: <path> is a valid path for this computer, and
+    <max_folders> >= 1.
+    """
+    tree = _Estimator(seed).estimate(path, max_folders)
+    tree._location = os.path.dirname(os.path.abspath(path))
+    return tree
+
+
+def _folder(name: str, subtrees: List[EstimatedTree]) -> EstimatedTree:
+    """Return the tree of the folder called <name>, with <subtrees>.
+    """
+    tree = EstimatedTree(name, subtrees)
+    if tree._types is None:
+        tree._types = {}
+    return tree
+
+
+def _extrapolate(sizes: List[int], unsampled: int, guess: float,
+                 sample_variance: float = 0.0) -> Tuple[int, float]:
+    """Return the estimated total size of <unsampled> entries from the sizes
+    of the <sizes> sampled from the same entries, and the variance of that
+    estimate.
+
+    <sample_variance> is the total variance of the sampled sizes, if they
+    are estimates themselves. If no sizes were sampled, each entry is given
+    the size <guess>, with a standard error as large.
+    """
+    if unsampled == 0:
+        return 0, 0.0
+    count = len(sizes)
+    if count == 0:
+        return round(unsampled * guess), unsampled * guess * guess
+    mean = sum(sizes) / count
+    if count > 1:
+        spread = sum((size - mean) ** 2 for size in sizes) / (count - 1)
+    else:
+        spread = mean * mean
+    # The variance of the estimate of the total of a simple random sample,
+    # with the finite population correction, plus the variance of the
+    # sampled sizes, scaled like them.
+    total = count + unsampled
+    variance = total * unsampled * spread / count + \
+        (unsampled / count) ** 2 * sample_variance
+    return round(unsampled * mean), variance
+
+
+def _list_folder(path: str) -> Tuple[List[str], List[str]]:
+    """Return the names of the files and of the folders in the folder at
+    <path>, in sorted order, or no names if it cannot be listed.
+
+    Symbolic links to folders are listed as files, since a link to a folder
+    containing it would be refined forever.
+    """
+    files = []
+    folders = []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    is_folder = entry.is_dir(follow_symlinks=False)
+                except OSError:
+                    is_folder = False
+                (folders if is_folder else files).append(entry.name)
+    except OSError:
+        pass
+    files.sort()
+    folders.sort()
+    return files, folders
+
+
+def _file_size(path: str) -> int:
+    """Return the size of the file at <path>, or 0 if it cannot be read.
+    """
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+if __name__ == '__main__':
+    import python_ta
+
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'heapq', 'math', 'os', 'queue', 'random',
+            'threading', '__future__', 'tm_trees'
+        ]
+    })
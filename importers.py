@@ -0,0 +1,255 @@
+"""Assignment 2: Trees imported from scans made by other tools
+
+=== Module Description ===
+This module builds trees of files and folders from scans made on other
+computers, without accessing the scanned file systems:
+
+- the JSON exports of ncdu (made with `ncdu -o FILE`), and
+- listings made with `find PATH -printf '%s %p\\n'`.
+
+Both are read as a stream, so the memory used, apart from the tree itself,
+only depends on the depth of the scanned folders: each folder's tree is built
+as soon as its last file has been read.
+"""
+from __future__ import annotations
+
+import json
+import os
+from typing import Iterable, Iterator, List, Optional, TextIO, Tuple
+
+from tm_trees import TMTree, _file_type, convert_size
+
+# The number of characters read from an ncdu export at a time.
+CHUNK_SIZE = 1 << 20
+
+# The markers of the start and the end of a JSON array in _json_events.
+_START = object()
+_END = object()
+
+
+class ImportedTree(TMTree):
+    """A tree of files and folders imported from a scan made by another tool.
+
+    The leaves represent files, and the internal nodes represent folders.
+
+    === Representation Invariants ===
+    - All TMTree RIs are inherited.
+    """
+
+    def _get_type(self) -> Optional[str]:
+        """Return the extension of this file, in lower case, or its name if
+        it is a core dump, or '' if it has neither.
+        """
+        return _file_type(self._name)
+
+    def get_separator(self) -> str:
+        """Return the separator used in the paths of the scan.
+        """
+        return '/'
+
+    def get_suffix(self) -> str:
+        """Return the final descriptor of this tree.
+        """
+        components = []
+        if len(self._subtrees) == 0:
+            components.append('file')
+        else:
+            components.append('folder')
+            components.append(f'{len(self._subtrees)} items')
+        components.append(convert_size(self.data_size))
+        return f' ({", ".join(components)})'
+
+
+def import_ncdu(filename: str, disk_usage: bool = False) -> ImportedTree:
+    """Return the tree of the scan exported by ncdu to <filename>.
+
+    The size of each file is its apparent size, or the disk space it uses if
+    <disk_usage> is True.
+
+    Raise ValueError if <filename> is not an ncdu export.
+    """
+    with open(filename, encoding='utf-8', errors='surrogateescape') as file:
+        return _build_from_ncdu(file, 'dsize' if disk_usage else 'asize')
+
+
+def import_find_listing(filename: str) -> ImportedTree:
+    """Return the tree of the files listed in <filename>, made by
+    `find PATH -printf '%s %p\\n'`.
+
+    The folders in the listing are recognised by having files listed inside
+    them, so empty folders are shown as files. Each folder's contents must be
+    listed together, as find does.
+
+    Raise ValueError if a line of <filename> is not a size and a path.
+    """
+    with open(filename, encoding='utf-8', errors='surrogateescape') as file:
+        return _build_from_find(file, os.path.basename(filename))
+
+
+def _folder(name: str, subtrees: List[ImportedTree]) -> ImportedTree:
+    """Return the tree of the folder called <name>, with <subtrees>.
+    """
+    tree = ImportedTree(name, subtrees)
+    if tree._types is None:
+        tree._types = {}
+    return tree
+
+
+def _build_from_ncdu(file: TextIO, size_field: str) -> ImportedTree:
+    """Return the tree of the ncdu export read from <file>, using the field
+    <size_field> of each file as its size.
+    """
+    # The folders being read, each with its information and its subtrees.
+    # The first one is the outer array of the export.
+    stack = []
+    root = None
+    for event in _json_events(file):
+        if event is _START:
+            stack.append([None, []])
+        elif event is _END:
+            if not stack:
+                raise ValueError('unbalanced ncdu export')
+            info, subtrees = stack.pop()
+            if not stack:
+                break
+            if not isinstance(info, dict):
+                raise ValueError('ncdu folder without information')
+            tree = _folder(info.get('name', ''), subtrees)
+            if len(stack) == 1:
+                root = tree
+            else:
+                stack[-1][1].append(tree)
+        elif len(stack) > 1 and isinstance(event, dict):
+            if stack[-1][0] is None:
+                stack[-1][0] = event
+            else:
+                stack[-1][1].append(ImportedTree(
+                    event.get('name', ''), [], event.get(size_field, 0)))
+    if root is None:
+        raise ValueError('not an ncdu export')
+    return root
+
+
+def _json_events(file: TextIO) -> Iterator[object]:
+    """Yield _START and _END for the start and end of each array in the JSON
+    read from <file>, and every other value in it, in order.
+
+    Only arrays are streamed; other values are decoded whole.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    pos = 0
+    eof = False
+    while True:
+        while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+            pos += 1
+        char = buffer[pos] if pos < len(buffer) else ''
+        if char == '[':
+            pos += 1
+            yield _START
+            continue
+        if char == ']':
+            pos += 1
+            yield _END
+            continue
+        if char:
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                end = None
+            # A value that ends the buffer may continue in the next chunk.
+            if end is not None and (end < len(buffer) or eof):
+                pos = end
+                yield value
+                continue
+            if eof:
+                raise ValueError('invalid JSON')
+        elif eof:
+            return
+        chunk = file.read(CHUNK_SIZE)
+        buffer = buffer[pos:] + chunk
+        pos = 0
+        eof = not chunk
+
+
+def _build_from_find(lines: Iterable[str], name: str) -> ImportedTree:
+    """Return the tree of the files listed in <lines>, in the format of
+    import_find_listing.
+
+    The root of the tree is the shallowest folder listed. If there are
+    several, they are put in a folder called <name>.
+    """
+    # The folders being read, each with its path and its subtrees, starting
+    # from a folder holding the top-level paths.
+    stack: List[Tuple[Tuple[str, ...], List[ImportedTree]]] = [((), [])]
+    pending = None
+    root_depth = None
+    for number, line in enumerate(lines, 1):
+        line = line.rstrip('\n')
+        if not line:
+            continue
+        size, _, path = line.partition(' ')
+        try:
+            size = int(size)
+        except ValueError:
+            raise ValueError(f'line {number} is not a size and a path: '
+                             f'{line!r}') from None
+        components = tuple(part for part in path.split('/') if part)
+        if root_depth is None or len(components) < root_depth:
+            root_depth = len(components)
+        if not components:
+            # The listing of the file system root, '/'.
+            name = ''
+            continue
+
+        if pending is not None:
+            pending_path, pending_size = pending
+            if components[:len(pending_path)] == pending_path:
+                stack.append((pending_path, []))
+            else:
+                stack[-1][1].append(
+                    ImportedTree(pending_path[-1], [], pending_size))
+        while stack[-1][0] != components[:len(stack[-1][0])]:
+            _close_folder(stack)
+        while len(stack[-1][0]) < len(components) - 1:
+            stack.append((components[:len(stack[-1][0]) + 1], []))
+        pending = (components, size)
+
+    if pending is not None:
+        stack[-1][1].append(ImportedTree(pending[0][-1], [], pending[1]))
+    while len(stack) > 1:
+        _close_folder(stack)
+
+    # Skip the folders above the listed ones, which only hold one folder.
+    root = None
+    subtrees = stack[0][1]
+    depth = 0
+    while depth < (root_depth or 0) and len(subtrees) == 1 and \
+            len(subtrees[0]._subtrees) > 0:
+        root = subtrees[0]
+        subtrees = root._subtrees
+        depth += 1
+    if root is None:
+        return _folder(name, subtrees)
+    root._parent_tree = None
+    return root
+
+
+def _close_folder(stack: List[Tuple[Tuple[str, ...],
+                                    List[ImportedTree]]]) -> None:
+    """Build the tree of the last folder in <stack>, remove it from <stack>,
+    and add it to the subtrees of the folder before it.
+    """
+    path, subtrees = stack.pop()
+    stack[-1][1].append(_folder(path[-1], subtrees))
+
+
+if __name__ == '__main__':
+    import python_ta
+
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'json', 'os', '__future__', 'tm_trees'
+        ],
+        'allowed-io': ['import_ncdu', 'import_find_listing']
+    })
@@ -0,0 +1,246 @@
+"""Assignment 2: Instrumentation of treemap operations
+
+=== Module Description ===
+This module counts and times the operations of TMTree, and the phases of
+drawing the treemap visualiser, to find out what makes it slow.
+
+Nothing is counted until enable is called. enable replaces the operations of
+TMTree in OPERATIONS by wrappers that record, in STATS, how many times each is
+called, how many nodes it visits, and how long it takes, and disable puts the
+original operations back. The phases of the visualiser are timed with phase,
+which does nothing unless instrumentation is enabled.
+
+Operations that a subclass of TMTree overrides are only counted when the
+subclass calls the TMTree operation.
+
+>>> enable()
+>>> tree.update_rectangles((0, 0, 1200, 670))
+>>> calls, nodes, seconds, last = STATS.get('update_rectangles')
+>>> STATS.export('stats.json')
+>>> disable()
+"""
+from __future__ import annotations
+
+import csv
+import json
+import time
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from typing import Any, Callable, ContextManager, Dict, Iterator, List, \
+    Optional, Tuple
+
+from tm_trees import TMTree
+
+# The operations of TMTree that are counted, each with the method called once
+# for every node it visits, or None if it does not visit nodes.
+OPERATIONS = {
+    'update_rectangles': '_update_rectangles',
+    'get_rectangles': '_get_rectangles',
+    'get_tree_at_position': '_get_tree_at_position',
+    'get_labels': '_get_labels',
+    'update_data_sizes': 'update_data_sizes',
+    'get_displayed_tree': None,
+    'get_largest_leaves': None,
+    'get_largest_subtrees': None,
+    'get_path_string': None,
+    'change_size': None,
+    'move': None,
+    'delete_self': None,
+    'undo': None,
+    'redo': None,
+    'expand': None,
+    'expand_all': None,
+    'collapse': None,
+    'collapse_all': None,
+}
+
+
+class Stats:
+    """The number of calls, the number of nodes visited, and the time spent,
+    in each of a number of named operations or phases.
+
+    === Private Attributes ===
+    _counters:
+        The calls, nodes, total seconds and seconds of the last call of each
+        operation or phase, by name.
+    """
+
+    _counters: Dict[str, List[Any]]
+
+    def __init__(self) -> None:
+        """Initialize stats with nothing counted.
+        """
+        self._counters = {}
+
+    def add(self, name: str, calls: int = 0, nodes: int = 0,
+            seconds: Optional[float] = None) -> None:
+        """Count <calls> calls, <nodes> nodes visited, and <seconds> spent,
+        in the operation or phase <name>.
+        """
+        counter = self._counters.get(name)
+        if counter is None:
+            counter = self._counters[name] = [0, 0, 0.0, 0.0]
+        counter[0] += calls
+        counter[1] += nodes
+        if seconds is not None:
+            counter[2] += seconds
+            counter[3] = seconds
+
+    @contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        """Count one call of <name>, and the time spent in the with
+        statement.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, 1, 0, time.perf_counter() - start)
+
+    def get(self, name: str) -> Tuple[int, int, float, float]:
+        """Return the calls, nodes visited, total seconds and seconds of the
+        last call of <name>.
+        """
+        return tuple(self._counters.get(name, (0, 0, 0.0, 0.0)))
+
+    def names(self) -> List[str]:
+        """Return the names of the operations and phases counted, in sorted
+        order.
+        """
+        return sorted(self._counters)
+
+    def reset(self) -> None:
+        """Forget everything counted so far.
+        """
+        self._counters.clear()
+
+    def export(self, filename: str) -> None:
+        """Write the stats to <filename>, as CSV if its name ends in '.csv',
+        and as JSON otherwise.
+        """
+        rows = [(name,) + self.get(name) for name in self.names()]
+        with open(filename, 'w', newline='') as file:
+            if filename.endswith('.csv'):
+                writer = csv.writer(file)
+                writer.writerow(['name', 'calls', 'nodes', 'seconds',
+                                 'last_seconds'])
+                writer.writerows(rows)
+            else:
+                json.dump({name: {'calls': calls, 'nodes': nodes,
+                                  'seconds': seconds, 'last_seconds': last}
+                           for name, calls, nodes, seconds, last in rows},
+                          file, indent=2)
+
+
+STATS = Stats()
+
+# The original methods of TMTree replaced by enable, by name, or None if
+# instrumentation is not enabled.
+_originals: Optional[Dict[str, Callable[..., Any]]] = None
+# The stats counted in since enable was last called.
+_stats = STATS
+
+
+def enable(stats: Stats = STATS) -> None:
+    """Count the operations of TMTree in <stats>, until disable is called.
+    """
+    global _originals, _stats
+    if _originals is not None:
+        disable()
+    _originals = {}
+    _stats = stats
+    for operation, visit in OPERATIONS.items():
+        for name in {operation, visit} - {None}:
+            _originals[name] = getattr(TMTree, name)
+        if visit == operation:
+            setattr(TMTree, operation,
+                    _counted_recursion(_originals[operation], operation,
+                                       stats))
+        else:
+            setattr(TMTree, operation,
+                    _counted(_originals[operation], operation, stats))
+            if visit is not None:
+                setattr(TMTree, visit,
+                        _counted_visit(_originals[visit], operation, stats))
+
+
+def disable() -> None:
+    """Stop counting the operations of TMTree.
+    """
+    global _originals
+    if _originals is not None:
+        for name, method in _originals.items():
+            setattr(TMTree, name, method)
+        _originals = None
+
+
+def is_enabled() -> bool:
+    """Return whether the operations of TMTree are being counted.
+    """
+    return _originals is not None
+
+
+def phase(name: str) -> ContextManager[None]:
+    """Return a context manager that times the phase <name>, in the stats
+    given to enable, if instrumentation is enabled, and does nothing
+    otherwise.
+    """
+    return _stats.timer(name) if _originals is not None else nullcontext()
+
+
+def _counted(method: Callable[..., Any], name: str,
+             stats: Stats) -> Callable[..., Any]:
+    """Return <method>, counting its calls and time in <stats> as <name>.
+    """
+    @wraps(method)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        with stats.timer(name):
+            return method(*args, **kwargs)
+    return wrapper
+
+
+def _counted_visit(method: Callable[..., Any], name: str,
+                   stats: Stats) -> Callable[..., Any]:
+    """Return <method>, counting each call as a node visited by <name> in
+    <stats>.
+    """
+    @wraps(method)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        stats.add(name, 0, 1)
+        return method(*args, **kwargs)
+    return wrapper
+
+
+def _counted_recursion(method: Callable[..., Any], name: str,
+                       stats: Stats) -> Callable[..., Any]:
+    """Return the recursive <method>, counting each call as a node visited by
+    <name> in <stats>, and only the outermost calls as calls, with their
+    time.
+    """
+    depth = [0]
+
+    @wraps(method)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        if depth[0] > 0:
+            stats.add(name, 0, 1)
+            return method(*args, **kwargs)
+        depth[0] += 1
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            depth[0] -= 1
+            stats.add(name, 1, 1, time.perf_counter() - start)
+    return wrapper
+
+
+if __name__ == '__main__':
+    import python_ta
+
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'csv', 'json', 'time', 'contextlib',
+            'functools', '__future__', 'tm_trees'
+        ],
+        'allowed-io': ['Stats.export']
+    })
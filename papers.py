@@ -58,13 +58,20 @@ Recommended steps:
    sure you have documented any new private attributes, and that PyTA passes
    on your code.
 """
+from __future__ import annotations
+
 import csv
-from typing import List, Dict
+import mmap
+import re
+from typing import List, Dict, Iterator, Optional, Tuple
 from tm_trees import TMTree
 
 # Filename for the dataset
 DATA_FILE = 'cs1_papers.csv'
 
+# A line break in a dataset file, which may be '\r', '\n' or '\r\n'.
+_LINE_BREAK = re.compile(rb'\r\n?|\n')
+
 
 class PaperTree(TMTree):
     """A tree representation of Computer Science Education research paper data.
@@ -74,6 +81,15 @@ class PaperTree(TMTree):
         The author of this paper represented by this tree.
     _doi:
         The doi of this paper represented by this tree.
+    _index:
+        The memory-mapped dataset this paper's metadata is read from, or None
+        if the metadata is stored in this tree directly.
+    _offset:
+        The byte offset of this paper's row in <_index>, or -1 if the metadata
+        is stored in this tree directly.
+    _data_index:
+        The memory-mapped dataset this tree loaded its papers from lazily,
+        which is closed by close(), or None if it did not.
 
     === Inherited Attributes ===
     rect:
@@ -95,35 +111,93 @@ class PaperTree(TMTree):
 
     === Representation Invariants ===
     - All TMTree RIs are inherited.
+    - If _index is not None, then _authors and _doi are not stored, and are
+      read from the row of _index at _offset instead.
     """
 
     _authors: str
     _doi: str
+    _index: Optional[_PaperIndex] = None
+    _offset: int = -1
+    _data_index: Optional[_PaperIndex] = None
 
     def __init__(self, name: str, subtrees: List[TMTree], authors: str = '',
                  doi: str = '', citations: int = 0, by_year: bool = True,
-                 all_papers: bool = False) -> None:
+                 all_papers: bool = False, lazy: bool = False,
+                 data_file: Optional[str] = None) -> None:
         """Initialize a new PaperTree with the given <name> and <subtrees>,
         <authors> and <doi>, and with <citations> as the size of the data.
 
         If <all_papers> is True, then this tree is to be the root of the paper
-        tree. In that case, load data about papers from DATA_FILE to build the
-        tree.
+        tree. In that case, load data about papers from <data_file>, or from
+        DATA_FILE if it is None, to build the tree.
 
         If <all_papers> is False, Do NOT load new data.
 
         <by_year> indicates whether or not the first level of subtrees should be
         the years, followed by each category, subcategory, and so on. If
         <by_year> is False, then the year in the dataset is simply ignored.
+
+        If <lazy> is True, <authors> and <doi> are not stored in this tree.
+        Instead, the papers loaded from the dataset only store their title,
+        citations and the position of their row in the dataset, and their
+        other columns are read from a memory map of the dataset when accessed.
         """
-        self._authors = authors
-        self._doi = doi
+        if not lazy:
+            self._authors = authors
+            self._doi = doi
 
         if all_papers:
-            nested_dict = _load_papers_to_dict(by_year)
-            subtrees = _build_tree_from_dict(nested_dict)
+            if data_file is None:
+                data_file = DATA_FILE
+            index = _PaperIndex(data_file) if lazy else None
+            nested_dict = _load_papers_to_dict(by_year, index, data_file)
+            subtrees = _build_tree_from_dict(nested_dict, index)
+            self._data_index = index
         super().__init__(name, subtrees, citations)
 
+    def __enter__(self) -> PaperTree:
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Close the dataset this tree loaded its papers from lazily, if it
+        did.
+
+        The metadata of those papers cannot be read afterwards, so this should
+        only be called once this tree is no longer used.
+        """
+        if self._data_index is not None:
+            self._data_index.close()
+
+    def __getattr__(self, attr: str) -> str:
+        """Return the metadata attribute <attr> of this paper, which is read
+        from its row in the dataset if this paper was loaded lazily, or is
+        empty if this tree is not a paper.
+
+        This is only called when <attr> is not stored in this tree.
+        """
+        if attr not in ('_authors', '_doi'):
+            raise AttributeError(attr)
+        index = self.__dict__.get('_index')
+        if index is None:
+            return ''
+        row = index.row_at(self.__dict__['_offset'])
+        return row['Author'] if attr == '_authors' else row['Url']
+
+    def get_metadata(self) -> Dict[str, str]:
+        """Return the columns of the dataset row of this paper.
+
+        Trees that were loaded eagerly only know their author, title, url and
+        citations.
+        """
+        if self._index is not None:
+            return self._index.row_at(self._offset)
+        return {'Author': self._authors, 'Title': self._name,
+                'Url': self._doi, 'Citations': str(self.data_size)}
+
     def get_separator(self) -> str:
         """Return the file separator for this OS.
         """
@@ -136,6 +210,90 @@ class PaperTree(TMTree):
         return ""
 
 
+class _PaperIndex:
+    """A read-only memory map of a papers dataset file, which reads single
+    rows from their byte offsets.
+
+    Rows may end in any of '\\r', '\\n' or '\\r\\n', and quoted fields may
+    contain line breaks.
+
+    === Private Attributes ===
+    _map:
+        The memory map of the dataset file.
+    _columns:
+        The column names in the header row of the dataset.
+    _start:
+        The byte offset of the first row after the header.
+    """
+
+    _map: mmap.mmap
+    _columns: List[str]
+    _start: int
+
+    def __init__(self, filename: str) -> None:
+        """Map the dataset file <filename> into memory and read its header.
+        """
+        # The map keeps its own handle on the file, so it stays open only as
+        # long as the map does.
+        with open(filename, 'rb') as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        header, self._start = self._read_line(0)
+        self._columns = next(csv.reader([header]))
+
+    def __enter__(self) -> _PaperIndex:
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Close the memory map of the dataset. Its rows cannot be read
+        afterwards.
+        """
+        self._map.close()
+
+    def _read_line(self, offset: int) -> Tuple[str, int]:
+        """Return the row starting at byte <offset> without its line break,
+        and the offset of the row after it.
+        """
+        data = self._map
+        end = offset
+        quotes = 0
+        while True:
+            # Only the next line break is searched for, so that reading a
+            # row costs as much as its length.
+            match = _LINE_BREAK.search(data, end)
+            if match is None:
+                stop = next_offset = len(data)
+            else:
+                stop, next_offset = match.span()
+            quotes += data[end:stop].count(b'"')
+            if quotes % 2 == 0 or match is None:
+                break
+            end = next_offset
+        return data[offset:stop].decode('utf-8'), next_offset
+
+    def rows(self) -> Iterator[Tuple[int, Dict[str, str]]]:
+        """Yield the byte offset and the columns of every row of the dataset.
+        """
+        offset = self._start
+        while offset < len(self._map):
+            line, next_offset = self._read_line(offset)
+            if line:
+                yield offset, self._parse(line)
+            offset = next_offset
+
+    def row_at(self, offset: int) -> Dict[str, str]:
+        """Return the columns of the row starting at byte <offset>.
+        """
+        return self._parse(self._read_line(offset)[0])
+
+    def _parse(self, line: str) -> Dict[str, str]:
+        """Return the columns of the row <line>, keyed by column name.
+        """
+        return dict(zip(self._columns, next(csv.reader([line]))))
+
+
 def _build_category(category_tree: Dict, category_list: List[str],
                     paper: Dict) -> None:
     """Return the nested dictionary with category names as keys and a list of
@@ -153,53 +311,87 @@ def _build_category(category_tree: Dict, category_list: List[str],
         _build_category(category_tree[next_category], category_list[1:], paper)
 
 
-def _load_papers_to_dict(by_year: bool = True) -> Dict:
-    """Return a nested dictionary of the data read from the papers dataset file.
+def _load_papers_to_dict(by_year: bool = True,
+                         index: Optional[_PaperIndex] = None,
+                         data_file: str = DATA_FILE) -> Dict:
+    """Return a nested dictionary of the data read from the papers dataset file
+    <data_file>.
 
     If <by_year>, then use years as the roots of the subtrees of the root of
     the whole tree. Otherwise, ignore years and use categories only.
+
+    If <index> is not None, read the rows from <index>, and only keep the
+    title, citations and byte offset of each paper.
     """
     paper_dict = {}
-    with open(DATA_FILE, "r", encoding="utf-8") as file:
+    if index is not None:
+        for offset, row in index.rows():
+            paper = {
+                'Title': row['Title'],
+                'Citations': int(row['Citations']),
+                'Offset': offset
+            }
+            _insert_paper(paper_dict, row, paper, by_year)
+        return paper_dict
+
+    with open(data_file, "r", encoding="utf-8") as file:
         csv_reader = csv.DictReader(file)
 
         for row in csv_reader:
-            year = row['Year']
-            category_list = row['Category'].split(':')
             paper = {
                 'Author': row['Author'],
                 'Title': row['Title'],
                 'Url': row['Url'],
                 'Citations': int(row['Citations'])
             }
+            _insert_paper(paper_dict, row, paper, by_year)
 
-            if by_year:
-                if year not in paper_dict:
-                    paper_dict[year] = {}
-                insert_dict = paper_dict[year]
-            else:
-                insert_dict = paper_dict
+    return paper_dict
 
-            _build_category(insert_dict, category_list, paper)
 
-    return paper_dict
+def _insert_paper(paper_dict: Dict, row: Dict[str, str], paper: Dict,
+                  by_year: bool) -> None:
+    """Insert <paper>, read from the dataset row <row>, into <paper_dict>
+    under its year (if <by_year>) and categories.
+    """
+    year = row['Year']
+    category_list = row['Category'].split(':')
+
+    if by_year:
+        if year not in paper_dict:
+            paper_dict[year] = {}
+        insert_dict = paper_dict[year]
+    else:
+        insert_dict = paper_dict
+
+    _build_category(insert_dict, category_list, paper)
 
 
-def _build_tree_from_dict(nested_dict: Dict) -> List[PaperTree]:
+def _build_tree_from_dict(nested_dict: Dict,
+                          index: Optional[_PaperIndex] = None
+                          ) -> List[PaperTree]:
     """Return a list of trees from the nested dictionary <nested_dict>.
+
+    If <index> is not None, the papers read their metadata from <index>.
     """
     subtrees = []
     if 'papers' in nested_dict:
         paper_subtrees = []
         for paper in nested_dict['papers']:
-            node = PaperTree(paper['Title'], [], paper['Author'],
-                             paper['Url'], paper['Citations'])
+            if index is None:
+                node = PaperTree(paper['Title'], [], paper['Author'],
+                                 paper['Url'], paper['Citations'])
+            else:
+                node = PaperTree(paper['Title'], [],
+                                 citations=paper['Citations'], lazy=True)
+                node._index = index
+                node._offset = paper['Offset']
             paper_subtrees.append(node)
         subtrees.extend(paper_subtrees)
 
     for key, value in nested_dict.items():
         if key != 'papers':
-            subtree = _build_tree_from_dict(value)
+            subtree = _build_tree_from_dict(value, index)
             node = PaperTree(key, subtree)
             subtrees.append(node)
 
@@ -210,7 +402,8 @@ if __name__ == '__main__':
     import python_ta
 
     python_ta.check_all(config={
-        'allowed-import-modules': ['python_ta', 'typing', 'csv', 'tm_trees'],
-        'allowed-io': ['_load_papers_to_dict'],
-        'max-args': 8
+        'allowed-import-modules': ['python_ta', 'typing', 'csv', 'mmap',
+                                   're', 'tm_trees'],
+        'allowed-io': ['_load_papers_to_dict', '_PaperIndex.__init__'],
+        'max-args': 10
     })
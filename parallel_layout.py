@@ -0,0 +1,264 @@
+"""Assignment 2: Treemap layout in a pool of processes
+
+=== Module Description ===
+This module computes the rectangles of a large expanded TMTree in a pool of
+worker processes, for TMTree.update_rectangles(rect, workers).
+
+The tree is first laid out, in this process, down to enough subtrees to keep
+every worker busy, and those subtrees are shared out into chunks of about the
+same total size. Each chunk is then flattened, breadth first, into an array
+of the sizes of its displayed trees and an array of how many displayed
+subtrees each has, so that the subtrees of a tree are next to each other.
+Workers lay out these arrays without needing the trees themselves, and send
+back an array of rectangles, in the same order, which are given to the trees.
+
+The rectangles are computed with the same arithmetic as the serial layout, so
+they are identical to it. Flattening the trees and giving them their
+rectangles is still done by this process, so only the arithmetic of the
+layout is spread across the workers.
+"""
+from __future__ import annotations
+
+import heapq
+import struct
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from tm_trees import TMTree
+
+# The number of chunks laid out by each worker, so that workers given small
+# chunks are not left idle.
+TASKS_PER_WORKER = 4
+
+# The plan of a layout; see _plan.
+Plan = Tuple[List[TMTree], List[Tuple[List[TMTree], int, array, array]]]
+
+# The pool of processes, and its number of workers, kept between layouts.
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_workers = 0
+
+
+def layout_in_parallel(tree: TMTree, rect: Tuple[int, int, int, int],
+                       workers: int, plan: Optional[Plan] = None) -> \
+        Tuple[List[TMTree], Plan]:
+    """Update the rectangles in <tree> to fill <rect>, using <workers>
+    processes, and return the trees given a rectangle, and the plan of the
+    layout.
+
+    <plan> is the plan of an earlier layout of <tree>, which is reused to
+    skip finding and flattening the trees if it is given. It must only be
+    given if no tree was expanded, collapsed or edited since.
+    """
+    if plan is None:
+        plan = _plan(tree, workers * TASKS_PER_WORKER)
+    split, chunks = plan
+    rects = _place(tree, rect, split)
+    results = _get_pool(workers).map(
+        _layout_arrays,
+        [[rects[id(root)] for root in trees[:roots]]
+         for trees, roots, _, _ in chunks],
+        [sizes for _, _, sizes, _ in chunks],
+        [counts for _, _, _, counts in chunks])
+    placed = list(split)
+    for (trees, _, _, _), packed in zip(chunks, results):
+        for subtree, subtree_rect in zip(trees, struct.iter_unpack('4q',
+                                                                   packed)):
+            subtree.rect = subtree_rect
+        placed.extend(trees)
+    return placed, plan
+
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    """Return a pool of <workers> processes, reusing the last one if it has
+    as many.
+    """
+    global _pool, _pool_workers
+    if _pool is None or _pool_workers != workers:
+        if _pool is not None:
+            _pool.shutdown()
+        _pool = ProcessPoolExecutor(workers)
+        _pool_workers = workers
+    return _pool
+
+
+def _plan(tree: TMTree, count: int) -> Plan:
+    """Return the plan of a layout of <tree> in about <count> chunks.
+
+    A plan is the trees laid out by this process, each before its subtrees,
+    and the chunks laid out by the workers, each as the trees displayed in
+    it, flattened by _flatten, the number of those trees it starts with, and
+    the arrays of their sizes and of their numbers of displayed subtrees.
+    """
+    split, items = _split(tree, count)
+    chunks = []
+    for chunk in _chunk(items, count):
+        trees, sizes, counts = _flatten(chunk)
+        chunks.append((trees, len(chunk), sizes, counts))
+    return split, chunks
+
+
+def _split(tree: TMTree, count: int) -> \
+        Tuple[List[TMTree], List[Tuple[TMTree, int, int]]]:
+    """Return the largest trees in <tree> that are expanded, each before its
+    subtrees, so that at least <count> subtrees are left to lay out under
+    them, or none of those can be split, and return those subtrees.
+
+    Each subtree left is given with the latest _collapsed_at and
+    _expanded_all_at of its ancestors.
+    """
+    # The trees left to lay out, largest first, with a counter so that trees
+    # of the same size are never compared.
+    heap = [(-tree.data_size, 0, tree) + tree._ancestor_expansion()]
+    split = []
+    done = []
+    number = 1
+    while heap and len(heap) + len(done) < count:
+        item = heapq.heappop(heap)
+        subtree = item[2]
+        expanded, collapsed_at, expanded_all_at = \
+            subtree._expansion(item[3], item[4])
+        if subtree.is_empty() or subtree.data_size == 0 or not expanded:
+            done.append(item[2:])
+            continue
+        split.append(subtree)
+        if len(subtree._subtrees) >= count:
+            # There are enough subtrees already, so skip the heap.
+            done.extend((child, collapsed_at, expanded_all_at)
+                        for child in subtree._subtrees)
+            break
+        for child in subtree._subtrees:
+            heapq.heappush(heap, (-child.data_size, number, child,
+                                  collapsed_at, expanded_all_at))
+            number += 1
+    return split, done + [item[2:] for item in heap]
+
+
+def _place(tree: TMTree, rect: Tuple[int, int, int, int],
+           split: List[TMTree]) -> Dict[int, Tuple[int, int, int, int]]:
+    """Lay out the trees in <split>, from _split, when <tree> fills <rect>,
+    and return the rectangles of them and their subtrees, by id.
+    """
+    rects = {id(tree): rect}
+    for subtree in split:
+        subtree_rect = rects[id(subtree)]
+        subtree.rect = subtree_rect
+        children = list(subtree._subtrees)
+        rects.update(zip(map(id, children), _split_rect(
+            subtree_rect, [child.data_size for child in children],
+            subtree.data_size)))
+    return rects
+
+
+def _chunk(items: List[Tuple[TMTree, int, int]],
+           count: int) -> List[List[Tuple[TMTree, int, int]]]:
+    """Return <items>, from _split, cut into at most <count> runs of items
+    with about the same total data_size.
+    """
+    total = sum(item[0].data_size for item in items)
+    chunks = [[]]
+    size = 0
+    for item in items:
+        if chunks[-1] and size * count >= total * len(chunks):
+            chunks.append([])
+        chunks[-1].append(item)
+        size += item[0].data_size
+    return chunks
+
+
+def _flatten(items: List[Tuple[TMTree, int, int]]) -> \
+        Tuple[List[TMTree], array, array]:
+    """Return the trees displayed in the trees of <items>, from _split,
+    breadth first, with the array of their sizes and the array of the number
+    of subtrees each has displayed.
+
+    Trees that are empty or have size 0 are given size 0 and no subtrees, as
+    the layout does not look inside them.
+    """
+    trees = [item[0] for item in items]
+    expansions = [item[1:] for item in items]
+    sizes = array('q')
+    counts = array('q')
+    i = 0
+    while i < len(trees):
+        subtree = trees[i]
+        size = subtree.data_size
+        if subtree.is_empty() or size == 0:
+            sizes.append(0)
+            counts.append(0)
+            i += 1
+            continue
+        sizes.append(size)
+        # This is TMTree._expansion, inlined since it is done for every tree.
+        collapsed_at, expanded_all_at = expansions[i]
+        i += 1
+        collapsed_at = max(collapsed_at, subtree._collapsed_at)
+        expanded_all_at = max(expanded_all_at, subtree._expanded_all_at)
+        count = len(subtree._subtrees)
+        if count > 0 and \
+                max(subtree._expanded_at, expanded_all_at) > collapsed_at:
+            counts.append(count)
+            trees.extend(subtree._subtrees)
+            expansions.extend([(collapsed_at, expanded_all_at)] * count)
+        else:
+            counts.append(0)
+    return trees, sizes, counts
+
+
+def _layout_arrays(rects: List[Tuple[int, int, int, int]], sizes: array,
+                   counts: array) -> bytes:
+    """Return the rectangles, packed as four 64-bit integers each, of the
+    trees flattened into <sizes> and <counts> by _flatten, when the first
+    ones fill <rects>.
+    """
+    rects = list(rects)
+    rects_out = array('q')
+    child = len(rects)
+    for i, size in enumerate(sizes):
+        if size == 0:
+            rects_out.extend((0, 0, 0, 0))
+            continue
+        rects_out.extend(rects[i])
+        count = counts[i]
+        if count > 0:
+            rects.extend(_split_rect(rects[i], sizes[child:child + count],
+                                     size))
+            child += count
+    return rects_out.tobytes()
+
+
+def _split_rect(rect: Tuple[int, int, int, int], sizes: Sequence[int],
+                total: int) -> List[Tuple[int, int, int, int]]:
+    """Return the rectangles of trees with the given <sizes>, out of <total>,
+    that fill <rect>, in the same way as TMTree._tm_alg.
+    """
+    x, y, width, height = rect
+    used_space = 0
+    last = len(sizes) - 1
+    rects = []
+    for i, size in enumerate(sizes):
+        prop = size / total
+        if width > height:
+            sub_width = (width - used_space
+                         if i == last
+                         else int(width * prop))
+            rects.append((x + used_space, y, sub_width, height))
+            used_space += sub_width
+        else:
+            sub_height = (height - used_space
+                          if i == last
+                          else int(height * prop))
+            rects.append((x, y + used_space, width, sub_height))
+            used_space += sub_height
+    return rects
+
+
+if __name__ == '__main__':
+    import python_ta
+
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'heapq', 'struct', 'array',
+            'concurrent.futures', '__future__', 'tm_trees'
+        ]
+    })
@@ -0,0 +1,135 @@
+"""Assignment 2: Differences between two scans of a tree
+
+=== Module Description ===
+This module compares two TMTrees of the same data taken at different times,
+e.g. two FileSystemTrees (or snapshots of them) of the same folder, and
+reports what was added, removed and resized.
+
+Every tree has a digest of the names and sizes in it, so the comparison skips
+the subtrees that did not change, and only visits the parts of the trees that
+did.
+
+The growth between two scans can also be shown as a treemap, using
+GrowthTree.
+"""
+from __future__ import annotations
+
+from typing import Dict, List, Optional, Tuple
+
+from tm_trees import TMTree, convert_size
+
+ADDED = 'added'
+REMOVED = 'removed'
+RESIZED = 'resized'
+
+
+def diff_trees(old: TMTree, new: TMTree) -> List[Tuple[str, str, int]]:
+    """Return the changes from <old> to <new>, as tuples of the kind of
+    change (ADDED, REMOVED or RESIZED), the path of the tree that changed,
+    and the change in its data_size.
+
+    Subtrees are matched by name. A subtree that was added or removed is
+    reported once, without the trees inside it. Only leaves are reported as
+    resized.
+    """
+    changes = []
+    _compare(old, new, changes)
+    return changes
+
+
+def growth_tree(old: TMTree, new: TMTree) -> GrowthTree:
+    """Return a tree of the growth from <old> to <new>, whose leaves are the
+    trees that were added or grew, with their growth as their data_size.
+    """
+    return _compare(old, new, []) or GrowthTree(new, [], 0)
+
+
+def _compare(old: TMTree, new: TMTree,
+             changes: List[Tuple[str, str, int]]) -> Optional[GrowthTree]:
+    """Add the changes from <old> to <new> to <changes>, and return the tree
+    of the growth from <old> to <new>, or None if nothing grew.
+    """
+    if old._get_digest() == new._get_digest():
+        return None
+    if len(old._subtrees) == 0 or len(new._subtrees) == 0:
+        if len(old._subtrees) == 0 and len(new._subtrees) == 0:
+            growth = new.data_size - old.data_size
+            if growth != 0:
+                changes.append((RESIZED, new.get_path_string(), growth))
+        else:
+            changes.append((REMOVED, old.get_path_string(), -old.data_size))
+            changes.append((ADDED, new.get_path_string(), new.data_size))
+            growth = new.data_size
+        return GrowthTree(new, [], growth) if growth > 0 else None
+
+    old_subtrees: Dict[str, TMTree] = {t._name: t for t in old._subtrees}
+    grown = []
+    for subtree in new._subtrees:
+        old_subtree = old_subtrees.pop(subtree._name, None)
+        if old_subtree is None:
+            changes.append((ADDED, subtree.get_path_string(),
+                            subtree.data_size))
+            if subtree.data_size > 0:
+                grown.append(GrowthTree(subtree, [], subtree.data_size))
+        else:
+            growth = _compare(old_subtree, subtree, changes)
+            if growth is not None:
+                grown.append(growth)
+    for subtree in old_subtrees.values():
+        changes.append((REMOVED, subtree.get_path_string(),
+                        -subtree.data_size))
+    return GrowthTree(new, grown) if grown else None
+
+
+class GrowthTree(TMTree):
+    """A tree of the growth between two scans of the same data.
+
+    The leaves are the trees that were added or grew, and their data_size is
+    their growth.
+
+    === Private Attributes ===
+    _separator:
+        The path separator of the scanned trees.
+    _size_suffix:
+        Whether the scanned trees describe their size in their suffix.
+
+    === Representation Invariants ===
+    - All TMTree RIs are inherited.
+    """
+
+    _separator: str
+    _size_suffix: bool
+
+    def __init__(self, tree: TMTree, subtrees: List[GrowthTree],
+                 growth: int = 0) -> None:
+        """Initialize the growth tree for <tree> in the newer scan, with the
+        given <subtrees>, or with <growth> as its data_size if it has no
+        subtrees.
+        """
+        super().__init__(tree._name, subtrees, growth)
+        self._colour = tree._colour
+        self._separator = tree.get_separator()
+        self._size_suffix = bool(tree.get_suffix())
+
+    def get_separator(self) -> str:
+        """Return the path separator of the scanned trees.
+        """
+        return self._separator
+
+    def get_suffix(self) -> str:
+        """Return the final descriptor of this tree, which is its growth if
+        the scanned trees describe their size.
+        """
+        if not self._size_suffix:
+            return ''
+        return f' (+{convert_size(self.data_size)})'
+
+
+if __name__ == '__main__':
+    import python_ta
+
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', '__future__', 'tm_trees'
+        ]
+    })
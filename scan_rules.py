@@ -0,0 +1,337 @@
+"""Assignment 2: Rules for the files and folders left out of a scan
+
+=== Module Description ===
+This module compiles rules written like the lines of a .gitignore file into a
+ScanRules, which FileSystemTree uses to leave files and folders out of a scan
+as it goes, so that excluded folders are never listed at all.
+
+Each rule is a pattern matched against the path of a file or folder under the
+scanned folder, with '/' between its components:
+
+- Blank lines, and lines starting with '#', are not rules.
+- A pattern starting with '!' includes the paths it matches, instead of
+  excluding them. When several rules match a path, the last one wins.
+- A pattern ending with '/' only matches folders.
+- A pattern with a '/' at its start or in its middle matches from the scanned
+  folder, and any other pattern matches the names of files and folders at
+  any depth.
+- '*' matches anything but '/', '?' matches any character but '/', and
+  '[abc]' matches one of the characters in it. '**/' matches any number of
+  folders, and a final '/**' matches everything inside a folder.
+- A backslash matches the character after it, e.g. '\\#' or '\\!'.
+
+As in git, a file cannot be included again if a folder containing it is
+excluded, since that folder is not listed.
+
+A ScanRules also decides how links and mounted file systems are scanned, so
+that the totals match those of du:
+
+- Each folder is scanned once, even if it is reached again through a symlink
+  or a bind mount, so that symlink loops do not recurse forever.
+- With follow_symlinks False, symlinks are leaves of their own size, like in
+  du -P, instead of the files and folders they point to.
+- With one_filesystem True, folders on another file system than the scanned
+  folder are left out, like in du -x.
+- With count_links_once True, each file is only counted the first time it is
+  scanned, even if it has several hard links or symlinks to it, like in du.
+
+All the rules are compiled into a single regular expression, so each path is
+matched once, however many rules there are.
+
+Excluded folders can be shown as a single leaf each, an ExcludedTree, whose
+size is estimated from a small sample of the folder by the estimates module.
+
+>>> rules = ScanRules(['**/.git/objects/', 'node_modules/'],
+...                   follow_symlinks=False, one_filesystem=True)
+>>> tree = FileSystemTree('/', rules)
+"""
+from __future__ import annotations
+
+import os
+import re
+import stat
+from typing import Iterable, List, Optional, Pattern, Set, Tuple
+
+from tm_trees import TMTree, FileSystemTree, convert_size
+
+# The number of folders listed to estimate the size of an excluded folder.
+EXCLUDED_FOLDERS = 16
+
+# The colour of the leaves of excluded folders.
+EXCLUDED_COLOUR = (96, 96, 96)
+
+
+class ScanRules:
+    """Rules for the files and folders to leave out of a scan, as described
+    in the module description.
+
+    === Public Attributes ===
+    show_excluded:
+        Whether the excluded folders are shown as an ExcludedTree each,
+        instead of being left out.
+    follow_symlinks:
+        Whether symlinks are scanned as the files and folders they point to.
+    one_filesystem:
+        Whether folders on another file system than the scanned folder are
+        left out.
+    count_links_once:
+        Whether a file reached through several hard links or symlinks is
+        only counted once.
+
+    === Private Attributes ===
+    _included:
+        Whether each rule includes the paths it matches, in order.
+    _regex:
+        The regular expression matching the paths matched by any rule, with a
+        group for each rule, or None if there are no rules. A folder's path
+        is matched with a '/' at its end.
+    _device:
+        The device of the folder being scanned.
+    _seen:
+        The (device, inode) pairs of the folders scanned so far, and of the
+        files that could be reached again if count_links_once is True.
+    _last:
+        The path whose status was found last, and its status, since it is
+        needed both to scan a folder and by the tree for the entry in it.
+    """
+    show_excluded: bool
+    follow_symlinks: bool
+    one_filesystem: bool
+    count_links_once: bool
+    _included: List[bool]
+    _regex: Optional[Pattern[str]]
+    _device: Optional[int]
+    _seen: Set[Tuple[int, int]]
+    _last: Optional[Tuple[str, os.stat_result]]
+
+    def __init__(self, rules: Iterable[str] = (),
+                 show_excluded: bool = False,
+                 follow_symlinks: bool = True,
+                 one_filesystem: bool = False,
+                 count_links_once: bool = False) -> None:
+        """Compile <rules>, which are lines of a .gitignore file.
+
+        If <show_excluded> is True, the excluded folders are shown as an
+        ExcludedTree each. <follow_symlinks>, <one_filesystem> and
+        <count_links_once> are described in the module description.
+
+        Raise ValueError if a rule is not a valid pattern.
+        """
+        self.show_excluded = show_excluded
+        self.follow_symlinks = follow_symlinks
+        self.one_filesystem = one_filesystem
+        self.count_links_once = count_links_once
+        self._device = None
+        self._seen = set()
+        self._last = None
+        self._included = []
+        regexes = []
+        for rule in rules:
+            compiled = _compile_rule(rule)
+            if compiled is not None:
+                regexes.append(compiled[0])
+                self._included.append(compiled[1])
+        # Later rules come first, so that the last rule matching a path is
+        # the one whose group matches.
+        self._regex = re.compile('|'.join(
+            f'(?P<r{i}>{regex})'
+            for i, regex in reversed(list(enumerate(regexes))))) \
+            if regexes else None
+
+    @classmethod
+    def from_file(cls, filename: str,
+                  show_excluded: bool = False) -> ScanRules:
+        """Return the rules in the .gitignore-style file <filename>.
+        """
+        with open(filename, encoding='utf-8') as file:
+            return cls(file.read().splitlines(), show_excluded)
+
+    def is_excluded(self, path: str, is_folder: bool) -> bool:
+        """Return whether the file or folder at <path>, under the scanned
+        folder, is excluded, given whether it <is_folder>.
+        """
+        if self._regex is None:
+            return False
+        match = self._regex.fullmatch(path + '/' if is_folder else path)
+        return match is not None and \
+            not self._included[int(match.lastgroup[1:])]
+
+    def start_scan(self, path: str) -> None:
+        """Start a new scan of the file or folder at <path>, forgetting the
+        files and folders scanned before.
+        """
+        self._seen = set()
+        self._last = None
+        status = self.get_status(path)
+        self._device = status.st_dev
+        self.is_scanned(status)
+
+    def get_status(self, path: str) -> os.stat_result:
+        """Return the status of the file or folder at <path>, or of the
+        symlink itself if symlinks are not followed or it is broken.
+        """
+        if self._last is not None and self._last[0] == path:
+            return self._last[1]
+        try:
+            status = os.stat(path, follow_symlinks=self.follow_symlinks)
+        except FileNotFoundError:
+            status = os.lstat(path)
+        self._last = (path, status)
+        return status
+
+    def is_scanned(self, status: os.stat_result) -> bool:
+        """Return whether the file or folder with <status> is scanned, and
+        remember it if so: it is not if it was scanned already, or is on
+        another file system when scanning one file system.
+        """
+        if self.one_filesystem and status.st_dev != self._device:
+            return False
+        # Without following symlinks, only a file with several hard links
+        # can be reached twice.
+        if stat.S_ISDIR(status.st_mode) or self.count_links_once and \
+                (self.follow_symlinks or status.st_nlink > 1):
+            key = (status.st_dev, status.st_ino)
+            if key in self._seen:
+                return False
+            self._seen.add(key)
+        return True
+
+    def excluded_tree(self, path: str) -> Optional[ExcludedTree]:
+        """Return the tree to show in place of the excluded folder at <path>,
+        or None if excluded folders are left out.
+        """
+        if not self.show_excluded:
+            return None
+        from estimates import estimate_tree
+
+        estimate = estimate_tree(path, EXCLUDED_FOLDERS)
+        return ExcludedTree(os.path.basename(path), estimate.data_size,
+                            estimate.get_interval()[1] - estimate.data_size)
+
+
+class ExcludedTree(FileSystemTree):
+    """A leaf standing for a folder excluded from a scan, with its estimated
+    size.
+
+    === Private Attributes ===
+    _error:
+        The margin of error of data_size.
+
+    === Representation Invariants ===
+    - All TMTree RIs are inherited.
+    """
+
+    _error: float
+
+    def __init__(self, name: str, data_size: int, error: float) -> None:
+        """Initialize a leaf for the excluded folder called <name>, of the
+        estimated size <data_size>, give or take <error>.
+
+        Unlike a FileSystemTree, this does not read the file system.
+        """
+        TMTree.__init__(self, name, [], data_size)
+        self._colour = EXCLUDED_COLOUR
+        self._error = error
+
+    def _get_type(self) -> Optional[str]:
+        """Return None, since the types of the files inside are not known.
+        """
+        return None
+
+    def get_suffix(self) -> str:
+        """Return the final descriptor of this tree.
+        """
+        size = f'~{convert_size(self.data_size)}'
+        if self._error > 0:
+            size += f' ± {convert_size(self._error)}'
+        return f' (excluded folder, {size})'
+
+
+def _compile_rule(rule: str) -> Optional[Tuple[str, bool]]:
+    """Return the regular expression matching the paths matched by <rule>,
+    and whether <rule> includes them, or None if <rule> is not a rule.
+
+    Raise ValueError if <rule> is not a valid pattern.
+    """
+    # Trailing spaces are ignored, unless they are escaped.
+    rule = rule.rstrip('\n')
+    while rule.endswith(' ') and not rule.endswith('\\ '):
+        rule = rule[:-1]
+    if not rule or rule.startswith('#'):
+        return None
+    included = rule.startswith('!')
+    if included:
+        rule = rule[1:]
+    folders_only = rule.endswith('/')
+    rule = rule.rstrip('/')
+    anchored = '/' in rule
+    rule = rule[1:] if rule.startswith('/') else rule
+    if not rule:
+        raise ValueError('empty pattern')
+    regex = _translate(rule)
+    try:
+        re.compile(regex)
+    except re.error as error:
+        raise ValueError(f'invalid pattern {rule!r}: {error}') from None
+    return (('' if anchored else '(?:.*/)?') + regex
+            + ('/' if folders_only else '/?'), included)
+
+
+def _translate(pattern: str) -> str:
+    """Return the regular expression matching the paths matched by the
+    glob <pattern>, as described in the module description.
+    """
+    parts = []
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        at_start = i == 0 or pattern[i - 1] == '/'
+        if at_start and pattern.startswith('**/', i):
+            parts.append('(?:.*/)?')
+            i += 3
+        elif at_start and pattern.startswith('**', i) and \
+                i + 2 == len(pattern):
+            parts.append('.+')
+            i += 2
+        elif char == '*':
+            parts.append('[^/]*')
+            i += 1
+        elif char == '?':
+            parts.append('[^/]')
+            i += 1
+        elif char == '[':
+            # A ']' right after the '[', or after its negation, is in the set.
+            start = i + 1
+            if start < len(pattern) and pattern[start] in '!^':
+                start += 1
+            end = pattern.find(']', start + 1)
+            if end == -1:
+                parts.append(re.escape(char))
+                i += 1
+                continue
+            chars = pattern[start:end].replace('\\', '\\\\') \
+                .replace('[', '\\[').replace(']', '\\]')
+            if pattern[i + 1] in '!^':
+                parts.append(f'[^/{chars}]')
+            else:
+                parts.append(f'[{chars}]')
+            i = end + 1
+        elif char == '\\' and i + 1 < len(pattern):
+            parts.append(re.escape(pattern[i + 1]))
+            i += 2
+        else:
+            parts.append(re.escape(char))
+            i += 1
+    return ''.join(parts)
+
+
+if __name__ == '__main__':
+    import python_ta
+
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'os', 're', 'stat', '__future__',
+            'tm_trees', 'estimates'
+        ],
+        'allowed-io': ['from_file']
+    })
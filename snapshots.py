@@ -0,0 +1,355 @@
+"""Assignment 2: Binary snapshots of treemap trees
+
+=== Module Description ===
+This module saves any TMTree to a compact binary snapshot file, and opens
+snapshot files as SnapshotTrees, so that a tree built on one computer (for
+example, a FileSystemTree of a server) can be inspected on another.
+
+A snapshot file is memory-mapped when it is opened, and a SnapshotTree only
+creates the trees for the nodes whose subtrees are actually needed, e.g.
+because they are expanded in the visualiser. Opening a snapshot takes the same
+time no matter how many nodes it has. A snapshot stays open until its root is
+closed, e.g. by using it in a with statement.
+
+=== Snapshot Format ===
+All integers are little-endian.
+
+- A header (HEADER): the magic bytes MAGIC, the number of nodes, the offset of
+  the type count table, the offset of the string table, the number of types,
+  the flags, and the length of the path separator.
+- The path separator, encoded in UTF-8.
+- The type table: one TYPE record for each type of leaf (see
+  TMTree._get_type), holding the offset and length of its name in the string
+  table.
+- The node table: one NODE record for each node, in breadth-first order, so
+  that the subtrees of each node are consecutive. A record holds the node's
+  data_size, the size of its largest leaf, the offset and length of its name
+  in the string table, the index of its first subtree, its number of
+  subtrees, its colour, its digest, and the index and number of its type
+  counts in the type count table.
+- The type count table: one TYPE_COUNT record for each type of leaf in each
+  node, holding the index of the type in the type table, and the number and
+  total size of the leaves of that type in the node. A leaf with a type has
+  one record, with a count of 1.
+- The string table: the names of the nodes and of the types, encoded in
+  UTF-8.
+"""
+from __future__ import annotations
+
+import mmap
+import struct
+from collections import deque
+from typing import Any, BinaryIO, List, Optional, Tuple
+
+from tm_trees import TMTree, _LazySubtreeList, convert_size
+
+MAGIC = b'TMSNAP2\0'
+HEADER = struct.Struct('<8sQQQIIH2x')
+TYPE = struct.Struct('<QI')
+NODE = struct.Struct('<QQQIII3Bx16sQI')
+TYPE_COUNT = struct.Struct('<IQQ')
+
+# The name length stored for the empty tree, whose name is None.
+_NO_NAME = 0xFFFFFFFF
+# The flag set when the saved tree describes its size in its suffix, like a
+# FileSystemTree.
+_SIZE_SUFFIX = 1
+
+
+def save_snapshot(tree: TMTree, filename: str) -> None:
+    """Save <tree> to the snapshot file <filename>.
+
+    All the subtrees of <tree> are saved, whether or not they are expanded.
+    """
+    separator = tree.get_separator().encode('utf-8')
+    flags = _SIZE_SUFFIX if tree.get_suffix() else 0
+
+    nodes = []
+    queue = deque([tree])
+    while queue:
+        node = queue.popleft()
+        nodes.append(node)
+        queue.extend(node._subtrees)
+
+    names = bytearray()
+    types = {}
+    records = []
+    type_counts = []
+    next_child = 1
+    for node in nodes:
+        count = len(node._subtrees)
+        if node._name is None:
+            name_offset, name_length = 0, _NO_NAME
+        else:
+            name_offset, name_length = _add_name(names, node._name)
+        counts = node._type_counts()
+        records.append(NODE.pack(node.data_size, node._largest(),
+                                 name_offset, name_length,
+                                 next_child if count else 0, count,
+                                 *node._colour, node._get_digest(),
+                                 len(type_counts), len(counts)))
+        for leaf_type, (type_count, type_size) in counts.items():
+            if leaf_type not in types:
+                types[leaf_type] = len(types)
+            type_counts.append(TYPE_COUNT.pack(types[leaf_type], type_count,
+                                               type_size))
+        next_child += count
+
+    type_records = [TYPE.pack(*_add_name(names, leaf_type))
+                    for leaf_type in types]
+    counts_offset = HEADER.size + len(separator) + TYPE.size * len(types) + \
+        NODE.size * len(nodes)
+    names_offset = counts_offset + TYPE_COUNT.size * len(type_counts)
+    with open(filename, 'wb') as file:
+        file.write(HEADER.pack(MAGIC, len(nodes), counts_offset, names_offset,
+                               len(types), flags, len(separator)))
+        file.write(separator)
+        file.writelines(type_records)
+        file.writelines(records)
+        file.writelines(type_counts)
+        file.write(names)
+
+
+def _add_name(names: bytearray, name: str) -> Tuple[int, int]:
+    """Add <name> to the end of the string table <names>, and return its
+    offset and length in it.
+    """
+    encoded = name.encode('utf-8', 'surrogateescape')
+    offset = len(names)
+    names.extend(encoded)
+    return offset, len(encoded)
+
+
+def open_snapshot(filename: str) -> SnapshotTree:
+    """Open the snapshot file <filename>, and return the root of the tree
+    saved in it. The file stays open until the root is closed.
+
+    Raise ValueError if <filename> is not a snapshot file.
+
+    >>> with open_snapshot('workshop.snap') as tree:
+    ...     print(tree.get_type_breakdown())
+    """
+    return SnapshotTree(_Snapshot(filename), 0)
+
+
+class _Snapshot:
+    """An open, memory-mapped snapshot file.
+
+    === Public Attributes ===
+    separator:
+        The path separator of the saved tree.
+    size_suffix:
+        Whether the saved tree describes its size in its suffix.
+
+    === Private Attributes ===
+    _file:
+        The open snapshot file.
+    _map:
+        The memory map of <_file>.
+    _count:
+        The number of nodes in the snapshot.
+    _types:
+        The name of each type of leaf in the type table.
+    _nodes_offset:
+        The offset of the node table.
+    _counts_offset:
+        The offset of the type count table.
+    _names_offset:
+        The offset of the string table.
+    """
+
+    separator: str
+    size_suffix: bool
+    _file: BinaryIO
+    _map: mmap.mmap
+    _count: int
+    _types: List[str]
+    _nodes_offset: int
+    _counts_offset: int
+    _names_offset: int
+
+    def __init__(self, filename: str) -> None:
+        """Open and map the snapshot file <filename>.
+
+        Raise ValueError if <filename> is not a snapshot file.
+        """
+        self._file = open(filename, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        except ValueError:
+            # An empty file cannot be mapped.
+            self._file.close()
+            raise ValueError(f'{filename} is not a snapshot file') from None
+        if len(self._map) < HEADER.size or \
+                self._map[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f'{filename} is not a snapshot file')
+        _, self._count, self._counts_offset, self._names_offset, type_count, \
+            flags, separator_length = HEADER.unpack_from(self._map, 0)
+        types_offset = HEADER.size + separator_length
+        self.separator = self._map[HEADER.size:types_offset].decode('utf-8')
+        self.size_suffix = bool(flags & _SIZE_SUFFIX)
+        self._types = [
+            self._name(*TYPE.unpack_from(self._map,
+                                         types_offset + TYPE.size * i))
+            for i in range(type_count)]
+        self._nodes_offset = types_offset + TYPE.size * type_count
+
+    def close(self) -> None:
+        """Close the snapshot file. Its nodes cannot be read afterwards.
+        """
+        self._map.close()
+        self._file.close()
+
+    def node(self, index: int) -> Tuple[Any, ...]:
+        """Return the name, data_size, largest leaf size, index of the first
+        subtree, number of subtrees, colour, digest and type counts of the
+        node at <index>.
+
+        The type counts map each type of leaf in the node to the number and
+        total size of those leaves, as in TMTree._type_counts.
+        """
+        data_size, largest, name_offset, name_length, first, count, \
+            red, green, blue, digest, counts_first, counts_length = \
+            NODE.unpack_from(self._map, self._nodes_offset + NODE.size * index)
+        name = None if name_length == _NO_NAME else \
+            self._name(name_offset, name_length)
+        type_counts = {}
+        for i in range(counts_first, counts_first + counts_length):
+            type_index, type_count, type_size = TYPE_COUNT.unpack_from(
+                self._map, self._counts_offset + TYPE_COUNT.size * i)
+            type_counts[self._types[type_index]] = [type_count, type_size]
+        return name, data_size, largest, first, count, (red, green, blue), \
+            digest, type_counts
+
+    def _name(self, offset: int, length: int) -> str:
+        """Return the name at <offset> in the string table, of <length>
+        bytes.
+        """
+        start = self._names_offset + offset
+        return self._map[start:start + length].decode('utf-8',
+                                                      'surrogateescape')
+
+
+class SnapshotTree(TMTree):
+    """A tree read from a snapshot file.
+
+    The subtrees of a SnapshotTree are only read from the snapshot file when
+    they are first needed.
+
+    === Private Attributes ===
+    _snapshot:
+        The snapshot file this tree was read from.
+    _index:
+        The index of this tree in the node table of <_snapshot>.
+    _first:
+        The index of the first subtree of this tree in the node table.
+    _type:
+        The type of this leaf, or None if this tree is not a leaf or its leaf
+        had no type.
+
+    === Representation Invariants ===
+    - All TMTree RIs are inherited.
+    """
+
+    _snapshot: _Snapshot
+    _index: int
+    _first: int
+    _type: Optional[str] = None
+
+    def __init__(self, snapshot: _Snapshot, index: int) -> None:
+        """Initialize the tree for the node at <index> in <snapshot>, without
+        reading its subtrees.
+        """
+        name, data_size, largest, first, count, colour, digest, types = \
+            snapshot.node(index)
+        super().__init__(name, [], data_size)
+        self._snapshot = snapshot
+        self._index = index
+        self._first = first
+        self._colour = colour
+        self._digest = digest
+        if count > 0:
+            self._largest_leaf = largest
+            self._subtrees = _LazySubtreeList(self, count)
+            if types:
+                self._types = types
+        elif types:
+            self._type = next(iter(types))
+
+    def __enter__(self) -> SnapshotTree:
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Close the snapshot file this tree was read from.
+
+        The subtrees that were not read from it yet cannot be read afterwards,
+        so this should only be called once this tree is no longer used.
+        """
+        self._snapshot.close()
+
+    def _load_subtrees(self) -> List[SnapshotTree]:
+        """Read and return the subtrees of this tree from the snapshot.
+        """
+        subtrees = []
+        for index in range(self._first, self._first + len(self._subtrees)):
+            subtree = SnapshotTree(self._snapshot, index)
+            subtree._parent_tree = self
+            subtrees.append(subtree)
+        return subtrees
+
+    def _get_type(self) -> Optional[str]:
+        """Return the type of this leaf in the saved tree, or None if it had
+        no type.
+        """
+        return self._type
+
+    def update_data_sizes(self) -> int:
+        """Update the data_size for this tree and its subtrees, based on the
+        size of their leaves, and return the new size.
+
+        Subtrees that were not read from the snapshot yet keep the size that
+        was saved.
+        """
+        if isinstance(self._subtrees, _LazySubtreeList) and \
+                not self._subtrees.is_loaded():
+            return self.data_size
+        return super().update_data_sizes()
+
+    def get_separator(self) -> str:
+        """Return the path separator of the saved tree.
+        """
+        return self._snapshot.separator
+
+    def get_suffix(self) -> str:
+        """Return the final descriptor of this tree.
+
+        Like a FileSystemTree, this describes the size of this tree if the
+        saved tree did.
+        """
+        if not self._snapshot.size_suffix:
+            return ''
+        components = []
+        if len(self._subtrees) == 0:
+            components.append('file')
+        else:
+            components.append('folder')
+            components.append(f'{len(self._subtrees)} items')
+        components.append(convert_size(self.data_size))
+        return f' ({", ".join(components)})'
+
+
+if __name__ == '__main__':
+    import python_ta
+
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'mmap', 'struct', 'collections',
+            '__future__', 'tm_trees'
+        ],
+        'allowed-io': ['save_snapshot', '_Snapshot.__init__']
+    })
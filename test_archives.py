@@ -0,0 +1,118 @@
+import io
+import tarfile
+import zipfile
+
+from archives import open_archive, is_archive, _read_tar_headers
+from treemap_cli import load_tree
+
+
+def test_zip_archive(tmp_path) -> None:
+    """Test that a zip archive has the folders, files and sizes in its
+    index.
+    """
+    filename = str(tmp_path / 'build.zip')
+    with zipfile.ZipFile(filename, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('bin/app', b'a' * 1000)
+        archive.writestr('lib/', b'')
+        archive.writestr('lib/libz.so', b'b' * 300)
+        archive.writestr('README', b'hello')
+
+    tree = open_archive(filename)
+    assert is_archive(filename)
+    assert tree.data_size == 1305
+    assert tree.get_suffix() == ' (archive, 3 items, 1.27kB)'
+    assert sorted(t.get_path_string() for t in tree.get_largest_leaves(5)) \
+        == ['build.zip/README', 'build.zip/bin/app', 'build.zip/lib/libz.so']
+    assert tree.get_type_breakdown() == {'': (2, 1005), '.so': (1, 300)}
+
+
+def test_nested_archive_opens_when_expanded(tmp_path) -> None:
+    """Test that an archive inside a tar archive is a single file until it
+    is expanded, and then has the sizes of its own files.
+    """
+    inner = io.BytesIO()
+    with zipfile.ZipFile(inner, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('data/big.bin', b'\0' * 100000)
+        archive.writestr('small.txt', b'x' * 10)
+    filename = str(tmp_path / 'backup.tar.gz')
+    with tarfile.open(filename, 'w:gz') as archive:
+        _add_file(archive, 'backup/inner.zip', inner.getvalue())
+        _add_file(archive, 'backup/notes.txt', b'n' * 50)
+
+    assert open_archive(filename).data_size == len(inner.getvalue()) + 50
+    tree = open_archive(filename, nested=True)
+    tree.update_rectangles((0, 0, 400, 200))
+    tree.expand_all()
+    assert tree.data_size == 100060
+    assert tree.get_largest_leaves(1)[0].get_path_string() == \
+        'backup.tar.gz/backup/inner.zip/data/big.bin'
+    assert tree.get_type_breakdown() == {'.bin': (1, 100000),
+                                         '.txt': (2, 60)}
+    assert len(tree.get_rectangles()) == 3
+    assert sum(w * h for (_, _, w, h), _ in tree.get_rectangles()) == \
+        400 * 200
+
+
+def test_nested_archive_queried_before_expanding(tmp_path) -> None:
+    """Test that the largest leaves and subtrees of a zip archive inside a
+    zip archive are found in order, and with the sizes of its contents, when
+    it was not expanded first.
+    """
+    inner = io.BytesIO()
+    with zipfile.ZipFile(inner, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('big.bin', b'\0' * 1000000)
+        archive.writestr('small.bin', b'\0' * 500000)
+    filename = str(tmp_path / 'outer.zip')
+    with zipfile.ZipFile(filename, 'w', zipfile.ZIP_STORED) as archive:
+        archive.writestr('a/inner.zip', inner.getvalue())
+        archive.writestr('b/random.dat', b'r' * 700000)
+
+    tree = open_archive(filename, nested=True)
+    leaves = tree.get_largest_leaves(3)
+    assert [leaf.get_path_string() for leaf in leaves] == \
+        ['outer.zip/a/inner.zip/big.bin', 'outer.zip/b/random.dat',
+         'outer.zip/a/inner.zip/small.bin']
+    assert tree.data_size == 2200000
+    assert [t.get_path_string() for t in tree.get_largest_subtrees(3)] == \
+        ['outer.zip/a', 'outer.zip/a/inner.zip', 'outer.zip/b']
+    assert tree.get_largest_leaves(3) == leaves
+
+    tree = load_tree(filename, 'archive')
+    assert tree.data_size == 2200000
+    assert tree.get_type_breakdown() == {'.bin': (2, 1500000),
+                                         '.dat': (1, 700000)}
+
+
+def test_tar_headers_match_tarfile() -> None:
+    """Test that the tar headers are read like tarfile reads them, with
+    long and non-ASCII names, in each tar format.
+    """
+    names = ['a' * 150 + '/' + 'b' * 120, 'caf\u00e9/menu.txt', 'plain']
+    for tar_format in (tarfile.GNU_FORMAT, tarfile.PAX_FORMAT):
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode='w', format=tar_format) \
+                as archive:
+            for i, name in enumerate(names):
+                _add_file(archive, name, b'x' * (i * 700))
+            folder = tarfile.TarInfo('empty')
+            folder.type = tarfile.DIRTYPE
+            archive.addfile(folder)
+        buffer.seek(0)
+        with tarfile.open(fileobj=buffer) as archive:
+            expected = [(info.name, info.size, info.isdir())
+                        for info in archive]
+        assert _read_tar_headers(buffer) == expected
+
+
+def _add_file(archive: tarfile.TarFile, name: str, data: bytes) -> None:
+    """Add a file called <name> with <data> to <archive>.
+    """
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    archive.addfile(info, io.BytesIO(data))
+
+
+if __name__ == '__main__':
+    import pytest
+
+    pytest.main(['test_archives.py'])
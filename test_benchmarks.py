@@ -0,0 +1,53 @@
+import os
+import random
+
+from benchmarks import SHAPES, build_tree, write_directory, count_nodes, \
+    compare
+from tm_trees import FileSystemTree
+
+
+def test_shapes_have_about_n_nodes() -> None:
+    """Test that every shape builds a tree with about the requested number
+    of nodes, and that the tree has the same size as the layout.
+    """
+    for make in SHAPES.values():
+        layout = make(5000, random.Random(0))
+        assert 2500 <= count_nodes(layout) <= 10000
+        tree = build_tree(layout)
+        assert tree.data_size == sum(_file_sizes(layout))
+
+
+def test_directory_matches_tree(tmp_path) -> None:
+    """Test that a layout written to a folder scans to the same paths and
+    sizes as the tree built from it in memory.
+    """
+    layout = SHAPES['skewed'](200, random.Random(0))
+    path = os.path.join(str(tmp_path), 'root')
+    write_directory(layout, path)
+    scanned = FileSystemTree(path)
+    built = build_tree(layout)
+    assert scanned.data_size == built.data_size
+    assert sorted(t.get_path_string() for t in scanned.get_largest_leaves(5)) \
+        == sorted(t.get_path_string() for t in built.get_largest_leaves(5))
+
+
+def test_compare() -> None:
+    """Test that only benchmarks slower than the tolerance are reported.
+    """
+    results = {'a': 1.0, 'b': 2.0, 'c': 3.0}
+    baseline = {'a': 1.0, 'b': 1.0}
+    assert compare(results, baseline, 0.5) == [('b', 2.0, 1.0)]
+
+
+def _file_sizes(layout) -> list:
+    """Return the sizes of the files in <layout>.
+    """
+    if not isinstance(layout, list):
+        return [layout]
+    return [size for subtree in layout for size in _file_sizes(subtree)]
+
+
+if __name__ == '__main__':
+    import pytest
+
+    pytest.main(['test_benchmarks.py'])
@@ -0,0 +1,49 @@
+import os
+
+from duplicates import find_duplicates, BLOCK_SIZE
+from tm_trees import FileSystemTree
+
+
+def test_find_duplicates(tmp_path) -> None:
+    """Test that only files with the same contents are reported, including
+    large files that differ only in the middle.
+    """
+    large = bytes(range(256)) * (3 * BLOCK_SIZE // 256)
+    changed = large[:len(large) // 2] + b'!' + large[len(large) // 2 + 1:]
+    files = {
+        'a.txt': b'hello', os.path.join('sub', 'b.txt'): b'hello',
+        'c.txt': b'world', 'empty1': b'', 'empty2': b'',
+        'big1.bin': large, os.path.join('sub', 'big2.bin'): large,
+        'big3.bin': changed,
+    }
+    os.mkdir(tmp_path / 'sub')
+    for name, contents in files.items():
+        (tmp_path / name).write_bytes(contents)
+
+    tree = FileSystemTree(str(tmp_path))
+    duplicates = find_duplicates(tree, workers=2)
+    assert [([t._name for t in group], reclaimable)
+            for group, reclaimable in duplicates] == \
+        [(['big1.bin', 'big2.bin'], len(large)), (['a.txt', 'b.txt'], 5)]
+    assert duplicates[1][0][1].get_file_path() == \
+        str(tmp_path / 'sub' / 'b.txt')
+
+
+def test_displayed_tree() -> None:
+    """Test that the displayed tree of a leaf is its highest collapsed
+    ancestor.
+    """
+    tree = FileSystemTree(os.path.join(os.getcwd(), 'example-directory',
+                                       'workshop'))
+    leaf = tree.get_largest_leaves(1)[0]
+    assert leaf.get_displayed_tree() is tree
+    tree.expand_all()
+    assert leaf.get_displayed_tree() is leaf
+    leaf.collapse()
+    assert leaf.get_displayed_tree() is leaf.get_parent()
+
+
+if __name__ == '__main__':
+    import pytest
+
+    pytest.main(['test_duplicates.py'])
@@ -0,0 +1,96 @@
+import os
+
+from estimates import Refiner, SAMPLE_SIZE, estimate_tree
+from tm_trees import TMTree, FileSystemTree
+
+
+def _make_folder(path: str) -> None:
+    """Make a folder at <path> with more files and more folders than are
+    sampled, some of which hold files or folders in turn.
+    """
+    os.mkdir(path)
+    for i in range(SAMPLE_SIZE + 10):
+        with open(os.path.join(path, f'file{i}.txt'), 'wb') as file:
+            file.write(b'x' * (i * 37 % 200))
+    for i in range(SAMPLE_SIZE + 5):
+        folder = os.path.join(path, f'folder{i}')
+        os.mkdir(folder)
+        for j in range(i % 3):
+            with open(os.path.join(folder, f'data{j}.bin'), 'wb') as file:
+                file.write(b'x' * (100 * i + j))
+        if i % 4 == 0:
+            os.mkdir(os.path.join(folder, 'empty'))
+
+
+def _check_sizes(tree: TMTree) -> None:
+    """Check that the size of each folder in <tree> is the total size of its
+    subtrees.
+    """
+    if len(tree._subtrees) > 0:
+        assert tree.data_size == sum(s.data_size for s in tree._subtrees)
+        for subtree in tree._subtrees:
+            assert subtree.get_parent() is tree
+            _check_sizes(subtree)
+
+
+def _refine(refiner: Refiner) -> None:
+    """Refine the tree of <refiner> until it is done.
+    """
+    refiner.start()
+    while not refiner.is_done():
+        refiner.apply()
+    refiner.stop()
+
+
+def test_estimate_then_refine(tmp_path) -> None:
+    """Test that an estimated tree stands for every entry, and becomes the
+    same as a scanned tree once it is refined.
+    """
+    path = str(tmp_path / 'data')
+    _make_folder(path)
+    tree = estimate_tree(path, max_folders=10, seed=0)
+    _check_sizes(tree)
+    assert tree.is_estimated()
+    low, high = tree.get_interval()
+    assert low <= tree.data_size <= high
+    assert tree.get_suffix().startswith(
+        f' (folder, {2 * SAMPLE_SIZE + 15} items, ~')
+    assert tree.get_file_path() == path
+
+    _refine(Refiner(tree, seed=0))
+    _check_sizes(tree)
+    scanned = FileSystemTree(path)
+    assert not tree.is_estimated()
+    assert tree.get_interval() == (scanned.data_size, scanned.data_size)
+    assert tree._get_digest() == scanned._get_digest()
+    assert tree.get_type_breakdown() == scanned.get_type_breakdown()
+    assert '~' not in tree.get_suffix()
+
+
+def test_refine_after_delete(tmp_path) -> None:
+    """Test that remainders deleted before they are refined are left out,
+    and the tree is marked as estimated only while it has remainders.
+    """
+    path = str(tmp_path / 'data')
+    _make_folder(path)
+    tree = estimate_tree(path, max_folders=1, seed=1)
+    tree.expand_all()
+    tree.update_rectangles((0, 0, 800, 600))
+    remainder = [s for s in tree._subtrees if s.is_estimated()][0]
+    assert tree.get_estimated_rectangles() == [remainder.rect]
+    assert remainder.delete_self()
+    assert not tree.is_estimated()
+    assert tree.get_estimated_rectangles() == []
+
+    _refine(Refiner(tree))
+    _check_sizes(tree)
+    assert len(tree._subtrees) == SAMPLE_SIZE
+    tree.undo()
+    assert tree.is_estimated()
+    assert remainder in tree._subtrees
+
+
+if __name__ == '__main__':
+    import pytest
+
+    pytest.main(['test_estimates.py'])
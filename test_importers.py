@@ -0,0 +1,79 @@
+import json
+
+import importers
+from importers import import_ncdu, import_find_listing
+
+
+def test_import_ncdu(tmp_path, monkeypatch) -> None:
+    """Test that an ncdu export is imported with its folders and sizes, even
+    when it is read in tiny chunks.
+    """
+    export = [1, 2, {'progname': 'ncdu', 'progver': '1.19'},
+              [{'name': '/srv', 'asize': 4096, 'dsize': 4096},
+               {'name': 'app.log', 'asize': 1200, 'dsize': 4096},
+               [{'name': 'data', 'asize': 4096},
+                {'name': 'db.sqlite', 'asize': 50000, 'dsize': 53248},
+                [{'name': 'empty'}]],
+               {'name': 'core', 'asize': 7}]]
+    filename = str(tmp_path / 'srv.json')
+    with open(filename, 'w') as file:
+        json.dump(export, file, indent=1)
+    monkeypatch.setattr(importers, 'CHUNK_SIZE', 5)
+
+    tree = import_ncdu(filename)
+    assert tree.data_size == 51207
+    assert tree.get_suffix() == ' (folder, 3 items, 50.01kB)'
+    assert [t.get_path_string() for t in tree.get_largest_leaves(3)] == \
+        ['/srv/data/db.sqlite', '/srv/app.log', '/srv/core']
+    assert tree.get_type_breakdown() == \
+        {'.sqlite': (1, 50000), '.log': (1, 1200), 'core': (1, 7)}
+    assert import_ncdu(filename, disk_usage=True).data_size == 57344
+
+
+def test_import_find_listing(tmp_path) -> None:
+    """Test that the folders of a find listing are recognised from the
+    files in them, including folders that are not listed themselves.
+    """
+    filename = str(tmp_path / 'host1.txt')
+    with open(filename, 'w') as file:
+        file.write('4096 /var/log\n'
+                   '100 /var/log/syslog\n'
+                   '4096 /var/log/apt\n'
+                   '20 /var/log/apt/history log\n'
+                   '5 /var/log/dmesg\n'
+                   '3 /var/log/nginx/access.log\n')
+
+    tree = import_find_listing(filename)
+    assert tree.get_path_string() == 'log'
+    assert tree.get_parent() is None
+    assert tree.data_size == 128
+    assert sorted((t.get_path_string(), t.data_size)
+                  for t in tree.get_largest_leaves(10)) == \
+        [('log/apt/history log', 20), ('log/dmesg', 5),
+         ('log/nginx/access.log', 3), ('log/syslog', 100)]
+    assert sorted(t._name for t in tree._subtrees) == \
+        ['apt', 'dmesg', 'nginx', 'syslog']
+
+
+def test_import_find_listing_of_several_paths(tmp_path) -> None:
+    """Test that a listing of several folders is put in a folder named
+    after the listing.
+    """
+    filename = str(tmp_path / 'host2.txt')
+    with open(filename, 'w') as file:
+        file.write('4096 ./a\n1 ./a/x\n4096 ./b\n2 ./b/y\n7 ./c\n')
+    tree = import_find_listing(filename)
+    assert tree.get_path_string() == '.'
+    assert tree.data_size == 10
+
+    with open(filename, 'w') as file:
+        file.write('4096 /etc\n1 /etc/hosts\n4096 /home\n2 /home/me\n')
+    tree = import_find_listing(filename)
+    assert tree.get_path_string() == 'host2.txt'
+    assert sorted(t._name for t in tree._subtrees) == ['etc', 'home']
+
+
+if __name__ == '__main__':
+    import pytest
+
+    pytest.main(['test_importers.py'])
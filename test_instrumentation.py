@@ -0,0 +1,63 @@
+import json
+import os
+
+import instrumentation
+from instrumentation import Stats
+from tm_trees import TMTree, FileSystemTree
+
+EXAMPLE_PATH = os.path.join(os.getcwd(), 'example-directory', 'workshop')
+
+
+def test_counts_calls_and_nodes(tmp_path) -> None:
+    """Test that the calls and visited nodes of tree operations are counted
+    while instrumentation is enabled, and only then.
+    """
+    original = TMTree.update_rectangles
+    tree = FileSystemTree(EXAMPLE_PATH)
+    stats = Stats()
+    instrumentation.enable(stats)
+    try:
+        tree.update_rectangles((0, 0, 200, 100))
+        tree.expand()
+        tree.update_data_sizes()
+        with instrumentation.phase('draw'):
+            pass
+    finally:
+        instrumentation.disable()
+    tree.update_rectangles((0, 0, 200, 100))
+
+    assert TMTree.update_rectangles is original
+    assert not instrumentation.is_enabled()
+    # The root is not expanded at first, so only it is visited; expanding it
+    # lays out the root and its 3 subtrees.
+    assert stats.get('update_rectangles')[:2] == (2, 5)
+    assert stats.get('update_data_sizes')[:2] == (1, _count(tree))
+    assert stats.get('expand')[0] == 1
+    assert stats.get('draw')[0] == 1
+
+    filename = str(tmp_path / 'stats.json')
+    stats.export(filename)
+    with open(filename) as file:
+        exported = json.load(file)
+    assert exported['update_rectangles']['nodes'] == 5
+    assert set(exported) == set(stats.names())
+
+
+def test_phase_disabled() -> None:
+    """Test that phases are not timed while instrumentation is disabled.
+    """
+    with instrumentation.phase('nothing'):
+        pass
+    assert 'nothing' not in instrumentation.STATS.names()
+
+
+def _count(tree: TMTree) -> int:
+    """Return the number of nodes in <tree>.
+    """
+    return 1 + sum(_count(subtree) for subtree in tree._subtrees)
+
+
+if __name__ == '__main__':
+    import pytest
+
+    pytest.main(['test_instrumentation.py'])
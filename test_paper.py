@@ -1,4 +1,4 @@
-from papers import PaperTree
+from papers import PaperTree, _PaperIndex
 
 
 def test_parent_tree_attributes_empty() -> None:
@@ -14,6 +14,67 @@ def test_parent_tree_attributes_empty() -> None:
     # rest tested on the visualizer
 
 
+def test_lazy_metadata_matches_eager() -> None:
+    """Test that lazily loaded papers read the same metadata from the dataset
+    as eagerly loaded papers store.
+    """
+    eager = PaperTree('CS1', [], all_papers=True, by_year=True)
+    lazy = PaperTree('CS1', [], all_papers=True, by_year=True, lazy=True)
+    assert eager.data_size == lazy.data_size
+
+    eager_leaves = _leaves(eager)
+    lazy_leaves = _leaves(lazy)
+    assert len(eager_leaves) == len(lazy_leaves)
+    for paper, lazy_paper in zip(eager_leaves, lazy_leaves):
+        assert '_authors' not in lazy_paper.__dict__
+        assert paper._name == lazy_paper._name
+        assert paper._authors == lazy_paper._authors
+        assert paper._doi == lazy_paper._doi
+        assert lazy_paper.get_metadata()['Title'] == paper._name
+    lazy.close()
+
+
+def test_index_line_breaks(tmp_path) -> None:
+    """Test that rows are read whatever their line breaks, including line
+    breaks inside quoted fields.
+    """
+    path = tmp_path / 'papers.csv'
+    path.write_bytes(b'A,B\r\n1,"x\ny"\r2,3\n"4\r\n5",6\r\n7,8')
+    with _PaperIndex(str(path)) as index:
+        assert list(index.rows()) == [
+            (5, {'A': '1', 'B': 'x\ny'}), (13, {'A': '2', 'B': '3'}),
+            (17, {'A': '4\r\n5', 'B': '6'}), (27, {'A': '7', 'B': '8'})]
+        assert index.row_at(13) == {'A': '2', 'B': '3'}
+    assert index._map.closed
+
+
+def test_data_file(tmp_path) -> None:
+    """Test that the papers are loaded from the given dataset file, eagerly
+    and lazily.
+    """
+    path = tmp_path / 'papers.csv'
+    path.write_text('Author,Title,Year,Category,Url,Citations\n'
+                    'A,T1,2000,X: Y,u1,3\nB,T2,2001,X,u2,4\n')
+    for lazy in (False, True):
+        with PaperTree('P', [], all_papers=True, by_year=False, lazy=lazy,
+                       data_file=str(path)) as tree:
+            assert tree.data_size == 7
+            assert [leaf._doi for leaf in _leaves(tree)] == ['u2', 'u1']
+        assert (tree._data_index is not None) == lazy
+        assert not lazy or tree._data_index._map.closed
+
+
+def _leaves(tree: PaperTree) -> list:
+    """Return the leaves of <tree>, in order.
+    """
+    if tree._subtrees == []:
+        return [tree]
+    leaves = []
+    for subtree in tree._subtrees:
+        leaves.extend(_leaves(subtree))
+    return leaves
+
+
 # def test_parent_tree_attributes_empty() -> None:
 #     """Test if PaperTree is set correctly This test will not work.
 #     """
@@ -0,0 +1,54 @@
+import random
+
+from tm_trees import TMTree
+from benchmarks import SyntheticTree
+
+
+def _random_tree(rng: random.Random, depth: int) -> TMTree:
+    """Return a random tree, at most <depth> deep, with some empty
+    files and some folders expanded.
+    """
+    if depth == 0 or rng.random() < 0.3:
+        return SyntheticTree(str(rng.random()), [], data_size=rng.choice(
+            [0, 1, 7, 100, 12345]))
+    subtrees = [_random_tree(rng, depth - 1)
+                for _ in range(rng.randint(1, 6))]
+    tree = SyntheticTree(str(rng.random()), subtrees)
+    if rng.random() < 0.8:
+        tree._expanded = True
+    return tree
+
+
+def _rects(tree: TMTree) -> list:
+    """Return the rectangles of all trees in <tree>, in preorder.
+    """
+    rects = [tree.rect]
+    for subtree in tree._subtrees:
+        rects.extend(_rects(subtree))
+    return rects
+
+
+def test_parallel_layout_matches_serial() -> None:
+    """Test that the rectangles laid out by a pool of processes are the same
+    as the ones laid out serially, including the ones left alone inside
+    empty folders, and when the layout is made again in another rectangle.
+    """
+    for seed, rect in enumerate([(0, 0, 1200, 670), (5, 9, 31, 400),
+                                 (0, 0, 3, 2)]):
+        tree = _random_tree(random.Random(seed), 6)
+        tree.update_rectangles(rect)
+        other = _random_tree(random.Random(seed), 6)
+        other.update_rectangles(rect, workers=2)
+        assert _rects(other) == _rects(tree)
+
+        # The second layout reuses the plan of the first.
+        resized = rect[:2] + (rect[3], rect[2])
+        tree.update_rectangles(resized)
+        other.update_rectangles(resized, workers=2)
+        assert _rects(other) == _rects(tree)
+
+
+if __name__ == '__main__':
+    import pytest
+
+    pytest.main(['test_parallel_layout.py'])
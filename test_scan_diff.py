@@ -0,0 +1,52 @@
+import os
+
+from scan_diff import diff_trees, growth_tree, ADDED, REMOVED, RESIZED
+from tm_trees import FileSystemTree
+
+EXAMPLE_PATH = os.path.join(os.getcwd(), 'example-directory', 'workshop')
+
+
+def test_identical_scans() -> None:
+    """Test that two scans of the same folder have no differences, and that
+    the comparison does not look inside them.
+    """
+    old = FileSystemTree(EXAMPLE_PATH)
+    new = FileSystemTree(EXAMPLE_PATH)
+    new._subtrees.sort(key=lambda t: t._name, reverse=True)
+    assert old._get_digest() == new._get_digest()
+    assert diff_trees(old, new) == []
+    assert growth_tree(old, new).data_size == 0
+
+
+def test_diff_after_changes() -> None:
+    """Test the changes and growth reported after files are resized, moved
+    and deleted.
+    """
+    old = FileSystemTree(EXAMPLE_PATH)
+    new = FileSystemTree(EXAMPLE_PATH)
+    files = {t._name: t for t in new.get_largest_leaves(10)}
+    folders = {t._name: t for t in new.get_largest_subtrees(10)}
+    files['Q3.pdf'].change_size(1.0)
+    files['Q2.pdf'].move(folders['activities'])
+    files['draft.pptx'].delete_self()
+
+    changes = diff_trees(old, new)
+    images = os.path.join('workshop', 'activities', 'images')
+    assert sorted(changes) == sorted([
+        (RESIZED, os.path.join(images, 'Q3.pdf'), 49),
+        (REMOVED, os.path.join(images, 'Q2.pdf'), -20),
+        (ADDED, os.path.join('workshop', 'activities', 'Q2.pdf'), 20),
+        (REMOVED, os.path.join('workshop', 'draft.pptx'), -58),
+    ])
+
+    growth = growth_tree(old, new)
+    assert growth.data_size == 69
+    growth.expand_all()
+    assert len(growth.get_rectangles()) == 2
+    assert growth.get_suffix() == ' (+69.00B)'
+
+
+if __name__ == '__main__':
+    import pytest
+
+    pytest.main(['test_scan_diff.py'])
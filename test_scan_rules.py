@@ -0,0 +1,156 @@
+import os
+
+import pytest
+
+from scan_rules import ScanRules, ExcludedTree, EXCLUDED_COLOUR
+from tm_trees import FileSystemTree
+
+
+def _make_folder(path: str) -> None:
+    """Make a folder at <path> with a few files, a folder to exclude and a
+    folder holding a file with the same name as that folder.
+    """
+    os.makedirs(os.path.join(path, 'build', 'objects'))
+    os.makedirs(os.path.join(path, 'src', 'lib'))
+    files = {'notes.txt': 10, 'data.csv': 20, 'keep.csv': 30,
+             'build/out.bin': 400, 'build/objects/a.o': 500,
+             'src/main.py': 60, 'src/build': 7, 'src/lib/util.py': 80}
+    for name, size in files.items():
+        with open(os.path.join(path, name), 'wb') as file:
+            file.write(b'x' * size)
+
+
+def _names(tree: FileSystemTree) -> set:
+    """Return the paths of all the files and folders in <tree>, under it.
+    """
+    names = set()
+    for subtree in tree._subtrees:
+        names.add(subtree._name)
+        names.update(f'{subtree._name}/{name}' for name in _names(subtree))
+    return names
+
+
+def test_rules() -> None:
+    """Test that rules match like the lines of a .gitignore file.
+    """
+    rules = ScanRules(['# a comment', '', '*.log', '!keep.log', 'build/',
+                       '/top', 'docs/*.md', '**/cache/**', 'a?c[!x]'])
+    assert rules.is_excluded('x.log', False)
+    assert rules.is_excluded('deep/down/x.log', False)
+    assert not rules.is_excluded('deep/keep.log', False)
+    assert rules.is_excluded('src/build', True)
+    assert not rules.is_excluded('src/build', False)
+    assert rules.is_excluded('top', False)
+    assert not rules.is_excluded('src/top', False)
+    assert rules.is_excluded('docs/a.md', False)
+    assert not rules.is_excluded('docs/sub/a.md', False)
+    assert not rules.is_excluded('other/docs/a.md', False)
+    assert rules.is_excluded('x/cache/y/z', False)
+    assert not rules.is_excluded('x/cache', True)
+    assert rules.is_excluded('abcd', False)
+    assert not rules.is_excluded('abcx', False)
+    assert not rules.is_excluded('ab/d', False)
+    assert not rules.is_excluded('notes.txt', False)
+    assert not ScanRules([]).is_excluded('anything', False)
+    with pytest.raises(ValueError):
+        ScanRules(['/'])
+
+
+def test_scan_with_rules(tmp_path, monkeypatch) -> None:
+    """Test that a scan leaves out what the rules exclude, without listing
+    the excluded folders.
+    """
+    path = str(tmp_path / 'data')
+    _make_folder(path)
+    listed = []
+    listdir = os.listdir
+
+    def counted(folder: str) -> list:
+        listed.append(os.path.relpath(folder, path))
+        return listdir(folder)
+
+    monkeypatch.setattr(os, 'listdir', counted)
+    tree = FileSystemTree(path, ScanRules(['*.csv', '!keep.csv', 'build/']))
+    assert _names(tree) == {'notes.txt', 'keep.csv', 'src', 'src/main.py',
+                            'src/build', 'src/lib', 'src/lib/util.py'}
+    assert tree.data_size == 10 + 30 + 60 + 7 + 80
+    assert 'build' not in listed
+
+
+def test_show_excluded(tmp_path) -> None:
+    """Test that excluded folders, but not excluded files, can be shown as a
+    grey leaf with their estimated size.
+    """
+    path = str(tmp_path / 'data')
+    _make_folder(path)
+    tree = FileSystemTree(path, ScanRules(['build/', '*.csv'], True))
+    excluded = [s for s in tree._subtrees if isinstance(s, ExcludedTree)]
+    assert [s._name for s in excluded] == ['build']
+    assert excluded[0].data_size == 900
+    assert excluded[0]._colour == EXCLUDED_COLOUR
+    assert excluded[0].get_suffix().startswith(' (excluded folder, ~')
+    assert excluded[0].get_parent() is tree
+    assert tree.data_size == 10 + 900 + 60 + 7 + 80
+    assert 'data.csv' not in _names(tree)
+
+
+def test_links_and_loops(tmp_path) -> None:
+    """Test that symlink loops are scanned once, and that symlinks and hard
+    links can be counted like in du.
+    """
+    path = tmp_path / 'data'
+    _make_folder(str(path))
+    os.link(path / 'notes.txt', path / 'src' / 'notes.txt')
+    os.symlink('..', path / 'src' / 'up')
+    os.symlink('missing', path / 'broken')
+    total = 10 + 20 + 30 + 400 + 500 + 60 + 7 + 80
+
+    tree = FileSystemTree(str(path), ScanRules())
+    assert 'src/up' not in _names(tree)
+    assert tree.data_size == total + 10 + len('missing')
+
+    tree = FileSystemTree(str(path), ScanRules(count_links_once=True))
+    assert tree.data_size == total + len('missing')
+
+    tree = FileSystemTree(str(path), ScanRules(follow_symlinks=False))
+    assert 'src/up' in _names(tree)
+    assert tree.data_size == total + 10 + len('..') + len('missing')
+
+    rules = ScanRules(follow_symlinks=False, count_links_once=True)
+    assert FileSystemTree(str(path), rules).data_size == \
+        FileSystemTree(str(path), rules).data_size == \
+        total + len('..') + len('missing')
+
+
+def test_one_filesystem(tmp_path, monkeypatch) -> None:
+    """Test that folders on other file systems are left out, and not listed,
+    when scanning one file system.
+    """
+    path = str(tmp_path / 'data')
+    _make_folder(path)
+    mount = os.path.join(path, 'build')
+    stat = os.stat
+
+    def fake_stat(name: str, *args, **kwargs) -> os.stat_result:
+        status = stat(name, *args, **kwargs)
+        if name.startswith(mount):
+            return os.stat_result((status.st_mode, status.st_ino,
+                                   status.st_dev + 1) + tuple(status)[3:])
+        return status
+
+    monkeypatch.setattr(os, 'stat', fake_stat)
+    assert 'build' in _names(FileSystemTree(path, ScanRules()))
+    listdir = os.listdir
+
+    def checked(folder: str) -> list:
+        assert folder != mount
+        return listdir(folder)
+
+    monkeypatch.setattr(os, 'listdir', checked)
+    tree = FileSystemTree(path, ScanRules(one_filesystem=True))
+    assert 'build' not in _names(tree)
+    assert tree.data_size == 10 + 20 + 30 + 60 + 7 + 80
+
+
+if __name__ == '__main__':
+    pytest.main(['test_scan_rules.py'])
@@ -0,0 +1,69 @@
+import os
+
+from snapshots import save_snapshot, open_snapshot
+from tm_trees import FileSystemTree
+
+EXAMPLE_PATH = os.path.join(os.getcwd(), 'example-directory', 'workshop')
+
+
+def test_snapshot_round_trip(tmp_path) -> None:
+    """Test that a snapshot has the same structure, sizes, colours, paths and
+    types as the tree that was saved, and that it is closed by a with
+    statement.
+    """
+    tree = FileSystemTree(EXAMPLE_PATH)
+    filename = str(tmp_path / 'workshop.snap')
+    save_snapshot(tree, filename)
+    with open_snapshot(filename) as snapshot:
+        assert _describe(snapshot) == _describe(tree)
+        assert snapshot.get_separator() == os.sep
+        assert snapshot.get_suffix() == tree.get_suffix()
+        assert [t.get_path_string() for t in snapshot.get_largest_leaves(2)] \
+            == [t.get_path_string() for t in tree.get_largest_leaves(2)]
+        assert snapshot.get_type_breakdown() == tree.get_type_breakdown()
+        snapshot.get_largest_leaves(1)[0].delete_self()
+        tree.get_largest_leaves(1)[0].delete_self()
+        assert snapshot.get_type_breakdown() == tree.get_type_breakdown()
+    assert snapshot._snapshot._map.closed
+
+
+def test_snapshot_reads_subtrees_lazily(tmp_path) -> None:
+    """Test that opening and laying out a snapshot does not read the subtrees
+    of the nodes that are not expanded.
+    """
+    filename = str(tmp_path / 'workshop.snap')
+    tree = FileSystemTree(EXAMPLE_PATH)
+    save_snapshot(tree, filename)
+    snapshot = open_snapshot(filename)
+
+    snapshot.update_rectangles((0, 0, 200, 100))
+    assert len(snapshot.get_rectangles()) == 1
+    assert snapshot.get_type_breakdown() == tree.get_type_breakdown()
+    assert not snapshot._subtrees.is_loaded()
+    assert snapshot.get_suffix() == ' (folder, 3 items, 151.00B)'
+
+    snapshot.expand()
+    assert snapshot._subtrees.is_loaded()
+    assert len(snapshot.get_rectangles()) == 3
+    for subtree in snapshot._subtrees:
+        assert subtree.get_parent() is snapshot
+        if len(subtree._subtrees) > 0:
+            assert not subtree._subtrees.is_loaded()
+
+    snapshot.expand_all()
+    assert len(snapshot.get_rectangles()) == 6
+    snapshot.close()
+
+
+def _describe(tree) -> tuple:
+    """Return the name, size, colour and subtrees of <tree>, with the subtrees
+    sorted by name.
+    """
+    return (tree._name, tree.data_size, tree._colour,
+            sorted(_describe(subtree) for subtree in tree._subtrees))
+
+
+if __name__ == '__main__':
+    import pytest
+
+    pytest.main(['test_snapshots.py'])
@@ -0,0 +1,135 @@
+import json
+import os
+import struct
+import threading
+import urllib.error
+import urllib.request
+import zlib
+
+import tile_server
+from tile_server import TileServer, TILE_SIZE, MAX_ZOOM
+from tm_trees import TMTree, FileSystemTree
+
+EXAMPLE_PATH = os.path.join(os.getcwd(), 'example-directory', 'workshop')
+
+
+def _start(tree: TMTree) -> TileServer:
+    """Return a server of the treemap of <tree>, serving on a free port in
+    another thread.
+    """
+    server = TileServer(tree, ('127.0.0.1', 0))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _get(server: TileServer, path: str, headers: dict = None) -> tuple:
+    """Return the status, headers and body of the response of <server> to a
+    request for <path>.
+    """
+    url = f'http://127.0.0.1:{server.server_address[1]}{path}'
+    request = urllib.request.Request(url, headers=headers or {})
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, response.headers, response.read()
+    except urllib.error.HTTPError as error:
+        return error.code, error.headers, error.read()
+
+
+def _pixels(png: bytes) -> list:
+    """Return the rows of RGB colours of the unfiltered PNG image <png>.
+    """
+    assert png.startswith(b'\x89PNG\r\n\x1a\n')
+    width, height = struct.unpack('>II', png[16:24])
+    length = struct.unpack('>I', png[33:37])[0]
+    data = zlib.decompress(png[41:41 + length])
+    row_size = 1 + 3 * width
+    return [[tuple(data[y * row_size + 1 + 3 * x:y * row_size + 4 + 3 * x])
+             for x in range(width)] for y in range(height)]
+
+
+def test_tiles_match_hit_test() -> None:
+    """Test that each pixel of the tiles has the colour of the file that the
+    hit-test finds there, and that bad requests are refused.
+    """
+    tree = FileSystemTree(EXAMPLE_PATH)
+    tree.expand_all()
+    server = _start(tree)
+    try:
+        status, headers, body = _get(server, '/meta')
+        assert status == 200
+        assert json.loads(body)['size'] == 151
+
+        for zoom, x, y in [(0, 0, 0), (1, 1, 0), (2, 0, 3)]:
+            status, headers, body = _get(server, f'/tiles/{zoom}/{x}/{y}.png')
+            assert status == 200 and headers['Content-Type'] == 'image/png'
+            shift = MAX_ZOOM - zoom
+            rows = _pixels(body)
+            for py in range(0, TILE_SIZE, 17):
+                for px in range(0, TILE_SIZE, 13):
+                    world = ((x * TILE_SIZE + px << shift) + 1,
+                             (y * TILE_SIZE + py << shift) + 1)
+                    leaf = tree.get_tree_at_position(world)
+                    assert rows[py][px] == leaf._colour
+
+        status, _, body = _get(server, '/hit?x=1&y=1')
+        assert status == 200
+        assert json.loads(body)['path'].startswith('workshop')
+        assert _get(server, '/hit?x=-5&y=1')[0] == 404
+        assert _get(server, '/tiles/1/2/0.png')[0] == 400
+        assert _get(server, '/tiles/0/0/0.png?by=type')[0] == 200
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_tile_cache(monkeypatch) -> None:
+    """Test that tiles are drawn once, even for viewers asking at the same
+    time, and drawn again after the tree changes.
+    """
+    tree = FileSystemTree(EXAMPLE_PATH)
+    tree.expand_all()
+    server = _start(tree)
+    rendered = []
+    render = tile_server._render_tile
+
+    def counted(*args) -> bytes:
+        rendered.append(args[1:])
+        return render(*args)
+
+    monkeypatch.setattr(tile_server, '_render_tile', counted)
+    try:
+        def fail(*args) -> None:
+            raise AssertionError('layout was computed')
+        with monkeypatch.context() as patch:
+            patch.setattr(TMTree, '_tm_alg', fail)
+            threads = [threading.Thread(target=_get,
+                                        args=(server, '/tiles/1/0/0.png'))
+                       for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        assert len(rendered) == 1
+
+        _, headers, _ = _get(server, '/tiles/1/0/0.png')
+        tag = headers['ETag']
+        assert len(rendered) == 1
+        status, _, body = _get(server, '/tiles/1/0/0.png',
+                               {'If-None-Match': tag})
+        assert status == 304 and body == b''
+
+        leaf = tree.get_tree_at_position((1, 1))
+        leaf.change_size(5)
+        status, headers, body = _get(server, '/tiles/1/0/0.png',
+                                     {'If-None-Match': tag})
+        assert status == 200 and headers['ETag'] != tag
+        assert len(rendered) == 2
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == '__main__':
+    import pytest
+
+    pytest.main(['test_tile_server.py'])
@@ -0,0 +1,59 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from snapshots import save_snapshot, SnapshotTree
+from tm_trees import FileSystemTree
+from treemap_cli import load_tree, main
+
+EXAMPLE_PATH = os.path.join(os.getcwd(), 'example-directory', 'workshop')
+
+
+def test_summary_does_not_import_gui() -> None:
+    """Test that printing a summary imports neither pygame nor the modules
+    for other formats.
+    """
+    script = ('import sys, treemap_cli\n'
+              f'treemap_cli.main([{EXAMPLE_PATH!r}, "--types"])\n'
+              'print(sorted({"pygame", "papers", "archives", "snapshots"}'
+              ' & set(sys.modules)))\n')
+    output = subprocess.run([sys.executable, '-c', script], check=True,
+                            capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__))
+                            ).stdout
+    assert output.splitlines()[0].startswith('workshop (folder, 3 items')
+    assert output.splitlines()[-1] == '[]'
+
+
+def test_load_tree_formats(tmp_path) -> None:
+    """Test that snapshots and ncdu exports are recognised.
+    """
+    filename = str(tmp_path / 'scan')
+    save_snapshot(FileSystemTree(EXAMPLE_PATH), filename)
+    tree = load_tree(filename)
+    assert isinstance(tree, SnapshotTree)
+    assert tree.data_size == 151
+    tree.close()
+
+    filename = str(tmp_path / 'scan.json')
+    with open(filename, 'w') as file:
+        file.write('[1, 0, {}, [{"name": "/"}, {"name": "a", "asize": 3}]]')
+    assert load_tree(filename).data_size == 3
+    assert isinstance(load_tree(EXAMPLE_PATH), FileSystemTree)
+
+
+def test_estimate_rejects_scan_options(capsys) -> None:
+    """Test that --estimate is not combined with the options it would
+    ignore.
+    """
+    for options in (['--format', 'archive'], ['--exclude', '*.pdf'], ['-x'],
+                    ['--no-follow-symlinks']):
+        with pytest.raises(SystemExit):
+            main([EXAMPLE_PATH, '--estimate'] + options)
+        assert '--estimate' in capsys.readouterr().err
+
+
+if __name__ == '__main__':
+    pytest.main(['test_treemap_cli.py'])
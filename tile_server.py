@@ -0,0 +1,390 @@
+"""Assignment 2: Treemap tile server
+
+=== Module Description ===
+This module serves the treemap of a TMTree over HTTP, so that it can be
+viewed in a browser instead of the treemap visualiser, e.g. to share the
+treemap of a scan with a team.
+
+The tree is laid out once in a square "world" of WORLD pixels, and the
+treemap is served as PNG images, or tiles, of TILE_SIZE pixels: at zoom level
+z, the world is cut into 2 ** z by 2 ** z tiles. It is served at
+/tiles/<z>/<x>/<y>.png, or /tiles/<z>/<x>/<y>.png?by=type to colour the
+trees by their largest file type. /hit?x=<x>&y=<y> describes, in JSON, the
+file at a position in the world, /meta describes the tree and the tiles, and
+/ is a page to view the treemap.
+
+Tiles are kept in an LRU cache, so tiles already served are not drawn again,
+and the cache is emptied whenever a tree is expanded, collapsed or edited.
+Every request is handled in its own thread, but the tree is laid out and the
+tiles are drawn by one of them at a time, so viewers asking for the same tile
+at the same time wait for it to be drawn once, and the tree is only laid out
+again after it changes.
+
+Run it with the command-line summary, e.g.:
+
+    python treemap_cli.py example-directory/workshop --serve 8000
+"""
+from __future__ import annotations
+
+import json
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from tm_trees import TMTree
+
+# The width and height of a tile, in pixels.
+TILE_SIZE = 256
+
+# The deepest zoom level, at which one pixel of a tile is one pixel of the
+# world.
+MAX_ZOOM = 8
+
+# The width and height of the world the tree is laid out in.
+WORLD = TILE_SIZE << MAX_ZOOM
+
+# The number of tiles kept in the cache.
+TILE_CACHE_SIZE = 1024
+
+# The page served at /, which shows the tiles and describes the file that is
+# clicked. It is dragged to move and scrolled to zoom.
+VIEWER = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Treemap</title>
+<style>
+body { margin: 0; font: 14px monospace; background: #000; color: #fff; }
+#map { position: absolute; top: 0; bottom: 24px; left: 0; right: 0;
+       overflow: hidden; cursor: grab; }
+#map img { position: absolute; image-rendering: pixelated; }
+#status { position: absolute; bottom: 0; height: 24px; left: 8px; }
+</style></head>
+<body><div id="map"></div><div id="status"></div>
+<script>
+const TILE = %(tile_size)d, MAX_ZOOM = %(max_zoom)d;
+const map = document.getElementById('map');
+const status = document.getElementById('status');
+let zoom = 0, left = 0, top = 0, drag = null;
+function scale() { return TILE * 2 ** zoom / (TILE << MAX_ZOOM); }
+function draw() {
+  map.innerHTML = '';
+  const count = 2 ** zoom;
+  const x0 = Math.max(0, Math.floor(left / TILE));
+  const y0 = Math.max(0, Math.floor(top / TILE));
+  for (let y = y0; y < count && y * TILE < top + map.clientHeight; y++) {
+    for (let x = x0; x < count && x * TILE < left + map.clientWidth; x++) {
+      const img = document.createElement('img');
+      img.src = `/tiles/${zoom}/${x}/${y}.png` + location.search;
+      img.style.left = (x * TILE - left) + 'px';
+      img.style.top = (y * TILE - top) + 'px';
+      map.appendChild(img);
+    }
+  }
+}
+map.onwheel = (e) => {
+  e.preventDefault();
+  const next = Math.min(MAX_ZOOM, Math.max(0, zoom + (e.deltaY < 0 ? 1 : -1)));
+  const factor = 2 ** (next - zoom);
+  left = (left + e.offsetX) * factor - e.offsetX;
+  top = (top + e.offsetY) * factor - e.offsetY;
+  zoom = next;
+  draw();
+};
+map.onmousedown = (e) => { drag = [e.clientX, e.clientY, false]; };
+window.onmouseup = (e) => {
+  if (drag !== null && !drag[2]) {
+    const rect = map.getBoundingClientRect();
+    const x = Math.floor((e.clientX - rect.left + left) / scale());
+    const y = Math.floor((e.clientY - rect.top + top) / scale());
+    fetch(`/hit?x=${x}&y=${y}`).then((r) => r.json()).then((tree) => {
+      status.textContent = tree.error || `${tree.path}${tree.suffix}`;
+    });
+  }
+  drag = null;
+};
+window.onmousemove = (e) => {
+  if (drag === null) return;
+  left -= e.clientX - drag[0];
+  top -= e.clientY - drag[1];
+  drag = [e.clientX, e.clientY, true];
+  draw();
+};
+window.onresize = draw;
+fetch('/meta').then((r) => r.json()).then((tree) => {
+  status.textContent = `${tree.path}${tree.suffix}`;
+});
+draw();
+</script></body></html>
+"""
+
+
+class TileServer(ThreadingHTTPServer):
+    """An HTTP server of the treemap of a tree, as described in the module
+    description.
+
+    === Public Attributes ===
+    tree:
+        The tree whose treemap is served.
+
+    === Private Attributes ===
+    _lock:
+        The lock held while laying out the tree, drawing tiles, or reading
+        the cache.
+    _tiles:
+        The PNG data of the tiles drawn since the tree last changed, by
+        (zoom, x, y, by_type), least recently used first.
+    _generation:
+        The expansion time and the version of the trees when the tiles in
+        _tiles were drawn.
+    """
+    tree: TMTree
+    _lock: threading.Lock
+    _tiles: OrderedDict
+    _generation: Tuple[int, int]
+
+    daemon_threads = True
+
+    def __init__(self, tree: TMTree, address: Tuple[str, int]) -> None:
+        """Initialize a server of the treemap of <tree>, listening at
+        <address>, a host and a port.
+        """
+        super().__init__(address, _TileHandler)
+        self.tree = tree
+        self._lock = threading.Lock()
+        self._tiles = OrderedDict()
+        self._generation = (-1, -1)
+        with self._lock:
+            self._refresh()
+
+    def get_tile(self, zoom: int, x: int, y: int,
+                 by_type: bool = False) -> Tuple[bytes, str]:
+        """Return the PNG data of the tile at <x>, <y> at level <zoom>, and
+        a tag that changes whenever it does.
+
+        If <by_type> is True, the trees are coloured by their largest file
+        type, as in TMTree.get_rectangles.
+
+        Raise ValueError if there is no such tile.
+        """
+        if not 0 <= zoom <= MAX_ZOOM or not 0 <= x < 1 << zoom or \
+                not 0 <= y < 1 << zoom:
+            raise ValueError(f'no tile {zoom}/{x}/{y}')
+        with self._lock:
+            self._refresh()
+            key = (zoom, x, y, by_type)
+            tile = self._tiles.get(key)
+            if tile is None:
+                tile = self._tiles[key] = _render_tile(self.tree, zoom, x, y,
+                                                       by_type)
+                if len(self._tiles) > TILE_CACHE_SIZE:
+                    self._tiles.popitem(last=False)
+            else:
+                self._tiles.move_to_end(key)
+            tag = '{}-{}-{}'.format(*self._generation, '-'.join(map(str, key)))
+        return tile, tag
+
+    def hit_test(self, x: int, y: int) -> Optional[TMTree]:
+        """Return the leaf displayed at <x>, <y> in the world, or None if
+        there is none, as in TMTree.get_tree_at_position.
+        """
+        with self._lock:
+            self._refresh()
+            return self.tree.get_tree_at_position((x, y))
+
+    def _refresh(self) -> None:
+        """Lay out the tree in the world, and empty the cache if the tree
+        changed since the tiles in it were drawn.
+
+        The layout is restored from the layout cache of TMTree, unless the
+        tree changed, so this is cheap to do on every request.
+        """
+        self.tree.update_rectangles((0, 0, WORLD, WORLD))
+        generation = (TMTree._clock, TMTree._version)
+        if generation != self._generation:
+            self._tiles.clear()
+            self._generation = generation
+
+
+class _TileHandler(BaseHTTPRequestHandler):
+    """The handler of the requests to a TileServer.
+    """
+    server: TileServer
+
+    def do_GET(self) -> None:
+        """Respond to a request for the viewer page, a tile, a hit-test, or
+        the description of the tree.
+        """
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        parts = url.path.strip('/').split('/')
+        try:
+            if url.path == '/':
+                page = VIEWER % {'tile_size': TILE_SIZE,
+                                 'max_zoom': MAX_ZOOM}
+                self._send(200, 'text/html; charset=utf-8', page.encode())
+            elif url.path == '/meta':
+                description = describe(self.server.tree)
+                description.update(tile_size=TILE_SIZE, max_zoom=MAX_ZOOM,
+                                   world=WORLD)
+                self._send_json(200, description)
+            elif url.path == '/hit':
+                tree = self.server.hit_test(int(query['x'][0]),
+                                            int(query['y'][0]))
+                if tree is None:
+                    self._send_json(404, {'error': 'no file there'})
+                else:
+                    self._send_json(200, describe(tree))
+            elif len(parts) == 4 and parts[0] == 'tiles' and \
+                    parts[3].endswith('.png'):
+                self._send_tile(int(parts[1]), int(parts[2]),
+                                int(parts[3][:-4]),
+                                query.get('by') == ['type'])
+            else:
+                self._send_json(404, {'error': f'not found: {url.path}'})
+        except (KeyError, ValueError) as error:
+            self._send_json(400, {'error': str(error)})
+
+    def _send_tile(self, zoom: int, x: int, y: int, by_type: bool) -> None:
+        """Respond with a tile, or with 304 if the browser has it already.
+        """
+        tile, tag = self.server.get_tile(zoom, x, y, by_type)
+        tag = f'"{tag}"'
+        if self.headers.get('If-None-Match') == tag:
+            self.send_response(304)
+            self.send_header('ETag', tag)
+            self.end_headers()
+            return
+        self._send(200, 'image/png', tile, {'ETag': tag,
+                                            'Cache-Control': 'no-cache'})
+
+    def _send_json(self, status: int, value: Any) -> None:
+        """Respond with <status> and <value> encoded as JSON.
+        """
+        self._send(status, 'application/json', json.dumps(value).encode())
+
+    def _send(self, status: int, content_type: str, body: bytes,
+              headers: Optional[Dict[str, str]] = None) -> None:
+        """Respond with <status> and <body>, of type <content_type>, with the
+        extra <headers>.
+        """
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args: Any) -> None:
+        """Do not log each request, since every viewer asks for many tiles.
+        """
+
+
+def serve(tree: TMTree, host: str = '127.0.0.1', port: int = 8000) -> None:
+    """Serve the treemap of <tree> at <host> and <port> until interrupted.
+    """
+    with TileServer(tree, (host, port)) as server:
+        print(f'Serving the treemap of {tree.get_path_string()} at '
+              f'http://{host}:{server.server_address[1]}/')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+def describe(tree: TMTree) -> Dict[str, Any]:
+    """Return the name, path, size, description and rectangle of <tree>, to
+    be sent as JSON.
+    """
+    return {'name': tree._name, 'path': tree.get_path_string(),
+            'size': tree.data_size, 'suffix': tree.get_suffix(),
+            'rect': list(tree.rect)}
+
+
+def _render_tile(tree: TMTree, zoom: int, x: int, y: int,
+                 by_type: bool) -> bytes:
+    """Return the PNG data of the tile at <x>, <y> at level <zoom> of the
+    treemap of <tree>, which is laid out in the world.
+
+    Each pixel is given the colour of the rectangle containing its top-left
+    corner, so that rectangles share no pixels and leave none uncovered.
+    """
+    shift = MAX_ZOOM - zoom
+    row_size = 1 + 3 * TILE_SIZE
+    # The rows of the image, each starting with a 0 for no PNG filter.
+    pixels = bytearray(row_size * TILE_SIZE)
+    for (x0, y0, x1, y1), colour in _tile_rectangles(
+            tree, x * TILE_SIZE << shift, y * TILE_SIZE << shift, shift,
+            by_type):
+        row = bytes(colour) * (x1 - x0)
+        start = y0 * row_size + 1 + 3 * x0
+        for i in range(start, start + (y1 - y0) * row_size, row_size):
+            pixels[i:i + len(row)] = row
+    return _png(pixels, TILE_SIZE, TILE_SIZE)
+
+
+def _tile_rectangles(tree: TMTree, left: int, top: int, shift: int,
+                     by_type: bool) -> \
+        List[Tuple[Tuple[int, int, int, int], Tuple[int, int, int]]]:
+    """Return the pixels covered by each displayed leaf of <tree> in the
+    tile whose top-left corner is at <left>, <top> in the world, and whose
+    pixels are 2 ** <shift> pixels of the world wide, as the left, top, right
+    and bottom of a rectangle of pixels, with the colour of the leaf.
+
+    The subtrees of trees that cover no pixels of the tile are not visited.
+    Every subtree of an expanded tree that covers some is checked, though,
+    so a tile in a folder with many small files visits all of them, even
+    though most of them cover no pixels of the tile.
+    """
+    lst = []
+    stack = [(tree,) + tree._ancestor_expansion()]
+    while stack:
+        subtree, collapsed_at, expanded_all_at = stack.pop()
+        if subtree.is_empty() or subtree.data_size == 0:
+            continue
+        rx, ry, width, height = subtree.rect
+        # The first pixel whose corner is in the rectangle, and the first
+        # one after it, rounding up.
+        x0 = max(0, (rx - left + (1 << shift) - 1) >> shift)
+        y0 = max(0, (ry - top + (1 << shift) - 1) >> shift)
+        x1 = min(TILE_SIZE, (rx + width - left + (1 << shift) - 1) >> shift)
+        y1 = min(TILE_SIZE, (ry + height - top + (1 << shift) - 1) >> shift)
+        if x0 >= x1 or y0 >= y1:
+            continue
+        expanded, collapsed_at, expanded_all_at = \
+            subtree._expansion(collapsed_at, expanded_all_at)
+        if expanded:
+            stack.extend((child, collapsed_at, expanded_all_at)
+                         for child in subtree._subtrees)
+        else:
+            colour = subtree._type_colour() if by_type else subtree._colour
+            lst.append(((x0, y0, x1, y1), colour))
+    return lst
+
+
+def _png(pixels: bytearray, width: int, height: int) -> bytes:
+    """Return the PNG data of an RGB image of <width> by <height> pixels,
+    whose rows are in <pixels>, each after its filter type.
+    """
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + kind + data + \
+            struct.pack('>I', zlib.crc32(kind + data))
+
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + \
+        chunk(b'IDAT', zlib.compress(bytes(pixels))) + chunk(b'IEND', b'')
+
+
+if __name__ == '__main__':
+    import python_ta
+
+    python_ta.check_all(config={
+        'allowed-import-modules': [
+            'python_ta', 'typing', 'json', 'struct', 'threading', 'zlib',
+            'collections', 'http.server', 'urllib.parse', '__future__',
+            'tm_trees'
+        ],
+        'allowed-io': ['serve']
+    })
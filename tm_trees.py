@@ -17,13 +17,46 @@ This module contains the basic tree interface required by the treemap
 visualiser. You will both add to the abstract class, and complete a
 concrete implementation of a subclass to represent files and folders on your
 computer's file system.
+
+Large trees should be built inside bulk_build(), so that the garbage
+collector does not keep scanning them.
 """
 from __future__ import annotations
 
+import gc
+import hashlib
+import heapq
 import math
 import os
-from random import randint
-from typing import List, Tuple, Optional
+import weakref
+import zlib
+from bisect import bisect_left, insort
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from fnmatch import fnmatch
+from random import getrandbits
+from stat import S_ISDIR
+from typing import TYPE_CHECKING, Any, Callable, Deque, Dict, Iterable, \
+    Iterator, List, Tuple, Optional
+
+if TYPE_CHECKING:
+    from scan_rules import ScanRules
+
+# The number of layouts kept by TMTree.update_rectangles, so that going back
+# to a tree laid out recently restores its rectangles instead of recomputing
+# them. Each layout refers to every tree it placed, so this is small: enough
+# to go back to the parent of the tree shown, e.g. after Q in the visualiser.
+LAYOUT_CACHE_SIZE = 2
+
+# The number of edits that can be undone. Older edits are forgotten, so that
+# the trees they removed can be freed.
+UNDO_LIMIT = 10000
+
+
+def _no_parent() -> None:
+    """Return the parent of a tree that has no parent, which is None.
+    """
+    return None
 
 
 class TMTree:
@@ -52,12 +85,92 @@ class TMTree:
     _name:
         The root value of this tree, or None if this tree is empty.
     _subtrees:
-        The subtrees of this tree.
+        The subtrees of this tree, which can be removed in constant time.
     _parent_tree:
         The parent tree of this tree; i.e., the tree that contains this tree
         as a subtree, or None if this tree is not part of a larger tree.
+        This is computed from _parent_ref.
+    _parent_ref:
+        A weak reference to the parent tree of this tree, or _no_parent if it
+        has none, so that calling it returns _parent_tree either way. It is
+        weak so that trees do not form reference cycles with their parents,
+        and a tree is freed as soon as nothing but its subtrees refers to it.
+    _detached:
+        Whether this tree was removed from the subtrees of its parent, which
+        _parent_tree still refers to (see delete_self).
     _expanded:
         Whether or not this tree is considered expanded for visualization.
+        This is computed from the expansion times of this tree and its
+        ancestors, so that a whole subtree is expanded or collapsed by
+        setting one time.
+    _largest_leaf:
+        The data_size of the largest leaf in this tree, if this tree has
+        subtrees and _largest_count is not 0.
+    _largest_count:
+        The number of subtrees of this tree whose largest leaf is
+        _largest_leaf, or -1 if they were not counted yet. If it is 0, the
+        last of them was removed or shrunk, and _largest_leaf is recomputed
+        when it is next needed (see _largest). The largest leaf of this tree
+        is then smaller than that of its closest ancestor whose
+        _largest_count is not 0, and this tree is not counted in the
+        _largest_count of its parent.
+    _types:
+        The number of leaves and the total data_size of the leaves of each
+        type (see _get_type) in this tree, or None if this tree is a leaf or
+        has no leaves with a type.
+    _digest:
+        A digest of the names and sizes in this tree, or None if it was not
+        computed since this tree last changed. Equal trees have equal
+        digests, no matter the order of their subtrees.
+    _expanded_at:
+        The time at which this tree was last expanded by one depth.
+    _expanded_all_at:
+        The time at which this tree and all its descendants were last
+        expanded.
+    _collapsed_at:
+        The time at which this tree and all its descendants were last
+        collapsed.
+    _clock:
+        The last expansion time given out, shared by all trees. A tree is
+        expanded iff it is not a leaf, and the latest of its _expanded_at and
+        of the _expanded_all_at of itself and its ancestors is after the
+        latest _collapsed_at of itself and its ancestors.
+    _batch_depth:
+        The number of batches currently open on this tree. Only used on the
+        root of a tree.
+    _batch_dirty:
+        Whether this tree was changed during the batches open on it, and so
+        needs its rectangles updated when they are closed. Only used on the
+        root of a tree.
+    _edits:
+        The log of the edits made to this tree that can be undone or redone,
+        or None if no edits were made yet. Only used on the root of a tree.
+    _path:
+        The path string of this tree, and the value of _path_epoch when it
+        was computed, or None if it was not computed yet.
+    _path_epoch:
+        A counter shared by all trees, which is increased whenever a tree is
+        removed from its parent, so that cached path strings are recomputed.
+    _version:
+        A counter shared by all trees, which is increased whenever the size
+        or the subtrees of a tree change, so that cached layouts are
+        recomputed.
+    _layout:
+        The last layout made by calling update_rectangles on this tree, as
+        the rectangle, _clock and _version it was made with, the trees it
+        placed other than this tree, the rectangle it gave each of them, its
+        plan if it was made by parallel_layout, and the rectangle it gave
+        this tree, or None if there is none. This tree is left out of the
+        trees placed so that it does not refer to itself, except through
+        the plan.
+    _layouts:
+        Weak references to the trees with a _layout, by id, least recently
+        used first, shared by all trees. Only the last LAYOUT_CACHE_SIZE
+        trees keep their _layout, and only until a tree is expanded, collapsed
+        or edited, after which their layouts cannot be restored.
+    _current_layout:
+        A weak reference to the tree of the last layout made or restored,
+        and the key of that layout, so that laying it out again does nothing.
 
     === Representation Invariants ===
     - data_size >= 0
@@ -82,9 +195,28 @@ class TMTree:
     data_size: int
     _colour: Tuple[int, int, int]
     _name: str
-    _subtrees: List[TMTree]
-    _parent_tree: Optional[TMTree]
-    _expanded: bool
+    _subtrees: _SubtreeList
+    _parent_ref: Callable[[], Optional[TMTree]] = staticmethod(_no_parent)
+    _largest_leaf: int = 0
+    _largest_count: int = -1
+    _detached: bool = False
+    _types: Optional[Dict[str, List[int]]] = None
+    _digest: Optional[bytes] = None
+    _expanded_at: int = 0
+    _expanded_all_at: int = 0
+    _collapsed_at: int = 0
+    _clock: int = 0
+    _batch_depth: int = 0
+    _batch_dirty: bool = False
+    _edits: Optional[_EditLog] = None
+    _path: Optional[Tuple[int, str]] = None
+    _path_epoch: int = 0
+    _version: int = 0
+    _layout: Optional[Tuple[Tuple[Any, ...], List[TMTree],
+                            List[Tuple[int, int, int, int]], Any,
+                            Tuple[int, int, int, int]]] = None
+    _layouts: OrderedDict = OrderedDict()
+    _current_layout: Optional[Tuple[weakref.ref, Tuple[Any, ...]]] = None
 
     def __init__(self, name: str, subtrees: List[TMTree],
                  data_size: int = 0) -> None:
@@ -102,30 +234,30 @@ class TMTree:
         """
         self.rect = (0, 0, 0, 0)
         self._name = name
-        self._subtrees = subtrees[:]
-        self._parent_tree = None
-
-        # You will change this in Task 5
-        # if len(self._subtrees) > 0:
-        #     self._expanded = True
-        # else:
-        self._expanded = False
+        self._subtrees = _SubtreeList(subtrees)
 
         # 1. Initialize self._colour and self.data_size, according to the
         # docstring.
         # 2. Set this tree as the parent for each of its subtrees.
         self.data_size = 0
-        num1 = randint(0, 255)
-        num2 = randint(0, 255)
-        num3 = randint(0, 255)
-        self._colour = (num1, num2, num3)
+        colour = getrandbits(24)
+        self._colour = (colour >> 16, colour >> 8 & 255, colour & 255)
 
-        if subtrees == []:
+        if not subtrees:
             self.data_size = data_size
         else:
+            self._largest_leaf = 0
+            parent = weakref.ref(self)
             for subtree in subtrees:
-                subtree._parent_tree = self
+                subtree._parent_ref = parent
                 self.data_size += subtree.data_size
+                self._largest_leaf = max(self._largest_leaf,
+                                         subtree._largest())
+                subtree_types = subtree._type_counts()
+                if subtree_types:
+                    if self._types is None:
+                        self._types = {}
+                    _add_type_counts(self._types, subtree_types, 1)
 
     def is_empty(self) -> bool:
         """Return True iff this tree is empty.
@@ -134,12 +266,141 @@ class TMTree:
 
     def get_parent(self) -> Optional[TMTree]:
         """Returns the parent of this tree.
+
+        Trees only refer to their parents weakly, so this is None once
+        nothing but its subtrees refers to the parent. Keep a reference to
+        the root while using the trees in it:
+
+        >>> FileSystemTree(path).get_largest_leaves(1)[0].get_parent() is None
+        True
+        """
+        return self._parent_ref()
+
+    @property
+    def _parent_tree(self) -> Optional[TMTree]:
+        """The parent tree of this tree, or None if it has none, or if it
+        was freed.
+        """
+        return self._parent_ref()
+
+    @_parent_tree.setter
+    def _parent_tree(self, parent: Optional[TMTree]) -> None:
+        self._parent_ref = _no_parent if parent is None else \
+            weakref.ref(parent)
+
+    def _attached_parent(self) -> Optional[TMTree]:
+        """Return the parent of this tree, or None if it has none, or if
+        this tree was removed from it, so that edits inside a deleted subtree
+        stop at its root instead of reaching the tree it was deleted from.
+        """
+        return None if self._detached else self._parent_ref()
+
+    @property
+    def _expanded(self) -> bool:
+        """Whether or not this tree is considered expanded for visualization.
+        """
+        return self._expansion(*self._ancestor_expansion())[0]
+
+    @_expanded.setter
+    def _expanded(self, expanded: bool) -> None:
+        """Expand this tree by one depth if <expanded>, and otherwise collapse
+        this tree and all its descendants.
         """
-        return self._parent_tree
+        if expanded:
+            self._expanded_at = TMTree._tick()
+        else:
+            self._collapsed_at = TMTree._tick()
+
+    @staticmethod
+    def _tick() -> int:
+        """Return a new expansion time, later than all previous ones.
+        """
+        TMTree._clock += 1
+        return TMTree._clock
 
-    def update_rectangles(self, rect: Tuple[int, int, int, int]) -> None:
+    def _ancestor_expansion(self) -> Tuple[int, int]:
+        """Return the latest _collapsed_at and the latest _expanded_all_at of
+        the ancestors of this tree.
+        """
+        collapsed_at = expanded_all_at = 0
+        tree = self._parent_ref()
+        while tree is not None:
+            collapsed_at = max(collapsed_at, tree._collapsed_at)
+            expanded_all_at = max(expanded_all_at, tree._expanded_all_at)
+            tree = tree._parent_ref()
+        return collapsed_at, expanded_all_at
+
+    def _expansion(self, collapsed_at: int,
+                   expanded_all_at: int) -> Tuple[bool, int, int]:
+        """Return whether this tree is expanded, and the latest _collapsed_at
+        and _expanded_all_at of this tree and its ancestors, given those of
+        its ancestors.
+        """
+        collapsed_at = max(collapsed_at, self._collapsed_at)
+        expanded_all_at = max(expanded_all_at, self._expanded_all_at)
+        expanded = self._subtrees._live > 0 and \
+            max(self._expanded_at, expanded_all_at) > collapsed_at
+        return expanded, collapsed_at, expanded_all_at
+
+    def update_rectangles(self, rect: Tuple[int, int, int, int],
+                          workers: Optional[int] = None) -> None:
         """Update the rectangles in this tree and its descendents using the
         treemap algorithm to fill the area defined by pygame rectangle <rect>.
+
+        If <workers> is more than 1, the rectangles are computed by that many
+        processes, as in parallel_layout, which is only worth it for very
+        large expanded trees laid out in several rectangles, e.g. as the
+        window is resized. The rectangles are the same either way.
+
+        If this tree was laid out in <rect> recently, and no tree was
+        expanded, collapsed or edited since, the rectangles of that layout are
+        restored instead of being computed again.
+        """
+        key = (rect, TMTree._clock, TMTree._version)
+        if TMTree._current_layout == (weakref.ref(self), key):
+            return
+        if self._layout is not None and self._layout[0] == key:
+            for tree, tree_rect in zip(self._layout[1], self._layout[2]):
+                tree.rect = tree_rect
+            self.rect = self._layout[4]
+        else:
+            plan = None
+            if workers is not None and workers > 1:
+                from parallel_layout import layout_in_parallel
+                if self._layout is not None and \
+                        self._layout[0][1:] == key[1:]:
+                    plan = self._layout[3]
+                placed, plan = layout_in_parallel(self, rect, workers, plan)
+                placed = [tree for tree in placed if tree is not self]
+            else:
+                placed = []
+                self._update_rectangles(rect, *self._ancestor_expansion(),
+                                        placed)
+                # This tree is placed last.
+                placed.pop()
+            # Loading lazy subtrees may have changed the sizes.
+            key = (rect, TMTree._clock, TMTree._version)
+            self._layout = (key, placed, [tree.rect for tree in placed], plan,
+                            self.rect)
+        layouts = TMTree._layouts
+        layouts[id(self)] = weakref.ref(self)
+        layouts.move_to_end(id(self))
+        for tree_id, ref in list(layouts.items()):
+            tree = ref()
+            if len(layouts) > LAYOUT_CACHE_SIZE or tree is None or \
+                    tree._layout is None or tree._layout[0][1:] != key[1:]:
+                del layouts[tree_id]
+                if tree is not None:
+                    tree._layout = None
+        TMTree._current_layout = (weakref.ref(self), key)
+
+    def _update_rectangles(self, rect: Tuple[int, int, int, int],
+                           collapsed_at: int, expanded_all_at: int,
+                           placed: Optional[List[TMTree]] = None) -> None:
+        """Helper for update_rectangles, given the latest _collapsed_at and
+        _expanded_all_at of the ancestors of this tree.
+
+        Each tree given a rectangle is added to <placed>.
         """
         # Read the handout carefully to help get started identifying base cases,
         # then write the outline of a recursive step.
@@ -149,50 +410,136 @@ class TMTree:
         # x, y, width, height = rect
         if self.is_empty() or self.data_size == 0:
             self.rect = (0, 0, 0, 0)
-        elif self._subtrees == [] or not self._expanded:
-            self.rect = rect
         else:
             self.rect = rect
-            self._tm_alg(rect)
-
-    def _tm_alg(self, rect: Tuple[int, int, int, int]) -> None:
+            # This is _expansion inlined, since it is run for every tree, and
+            # only for folders.
+            if self._subtrees._live > 0:
+                if self._collapsed_at > collapsed_at:
+                    collapsed_at = self._collapsed_at
+                if self._expanded_all_at > expanded_all_at:
+                    expanded_all_at = self._expanded_all_at
+                if self._expanded_at > collapsed_at or \
+                        expanded_all_at > collapsed_at:
+                    self._tm_alg(rect, collapsed_at, expanded_all_at, placed)
+        if placed is not None:
+            placed.append(self)
+
+    def _tm_alg(self, rect: Tuple[int, int, int, int],
+                collapsed_at: int, expanded_all_at: int,
+                placed: Optional[List[TMTree]] = None) -> None:
         """Helper for update_rectangles.
 
         """
         x, y, width, height = rect
         used_space = 0
-        for i, subtree in enumerate(self._subtrees):
+        last = self._subtrees._live - 1
+        i = -1
+        for subtree in self._subtrees.backing():
+            if subtree is None:
+                continue
+            i += 1
             prop = subtree.data_size / self.data_size
             if width > height:
                 sub_width = (width - used_space
-                             if i == len(self._subtrees) - 1
+                             if i == last
                              else int(width * prop))
                 new_rect = (x + used_space, y, sub_width, height)
                 used_space += sub_width
             else:
                 sub_height = (height - used_space
-                              if i == len(self._subtrees) - 1
+                              if i == last
                               else int(height * prop))
                 new_rect = (x, y + used_space, width, sub_height)
                 used_space += sub_height
-            subtree.update_rectangles(new_rect)
+            subtree._update_rectangles(new_rect, collapsed_at,
+                                       expanded_all_at, placed)
 
-    def get_rectangles(self) -> (
+    def get_rectangles(self, by_type: bool = False) -> (
             List)[Tuple[Tuple[int, int, int, int], Tuple[int, int, int]]]:
         """Return a list with tuples for every leaf in the displayed-tree
         rooted at this tree. Each tuple consists of a tuple that defines the
         appropriate pygame rectangle to display for a leaf, and the colour
         to fill it with.
+
+        If <by_type> is True, the colour of each rectangle is the colour of
+        the type with the largest total size in it, instead of its own.
+        """
+        lst = []
+        self._get_rectangles(lst, by_type, *self._ancestor_expansion())
+        return lst
+
+    def _get_rectangles(self, lst: List[Tuple[Tuple[int, int, int, int],
+                                              Tuple[int, int, int]]],
+                        by_type: bool, collapsed_at: int,
+                        expanded_all_at: int) -> None:
+        """Helper for get_rectangles, which adds the rectangles to <lst>,
+        given the latest _collapsed_at and _expanded_all_at of the ancestors
+        of this tree.
         """
         if self.is_empty():
-            return []
-        elif not self._expanded:
-            return [(self.rect, self._colour)]
+            return
+        # This is _expansion inlined, as in _update_rectangles.
+        if self._subtrees._live > 0:
+            if self._collapsed_at > collapsed_at:
+                collapsed_at = self._collapsed_at
+            if self._expanded_all_at > expanded_all_at:
+                expanded_all_at = self._expanded_all_at
+            if self._expanded_at > collapsed_at or \
+                    expanded_all_at > collapsed_at:
+                for subtree in self._subtrees.backing():
+                    if subtree is not None:
+                        subtree._get_rectangles(lst, by_type, collapsed_at,
+                                                expanded_all_at)
+                return
+        colour = self._type_colour() if by_type else self._colour
+        lst.append((self.rect, colour))
+
+    def get_labels(self, min_width: int, min_height: int) -> \
+            List[Tuple[Tuple[int, int, int, int], str]]:
+        """Return the rectangle and the name of each tree in the
+        displayed-tree rooted at this tree whose rectangle is at least
+        <min_width> wide and <min_height> tall.
+
+        Trees in smaller rectangles are not visited, since the trees inside
+        them are smaller still.
+        """
+        lst = []
+        self._get_labels(lst, (min_width, min_height),
+                         *self._ancestor_expansion())
+        return lst
+
+    def _get_labels(self, lst: List[Tuple[Tuple[int, int, int, int], str]],
+                    min_size: Tuple[int, int], collapsed_at: int,
+                    expanded_all_at: int) -> None:
+        """Helper for get_labels, which adds the labels to <lst>, given the
+        minimum width and height in <min_size>, and the latest _collapsed_at
+        and _expanded_all_at of the ancestors of this tree.
+        """
+        if self.is_empty() or self.rect[2] < min_size[0] or \
+                self.rect[3] < min_size[1]:
+            return
+        expanded, collapsed_at, expanded_all_at = \
+            self._expansion(collapsed_at, expanded_all_at)
+        if not expanded:
+            lst.append((self.rect, self._name))
+        elif self._subtrees.is_sorted_by_size():
+            # The subtrees get smaller along the list, except for the last
+            # one, which is given the space left over, so only the last one
+            # can be big enough after one is too small.
+            subtrees = self._subtrees
+            for subtree in subtrees:
+                if subtree.rect[2] < min_size[0] or \
+                        subtree.rect[3] < min_size[1]:
+                    subtrees[-1]._get_labels(lst, min_size, collapsed_at,
+                                             expanded_all_at)
+                    break
+                subtree._get_labels(lst, min_size, collapsed_at,
+                                    expanded_all_at)
         else:
-            lst = []
             for subtree in self._subtrees:
-                lst.extend(subtree.get_rectangles())
-            return lst
+                subtree._get_labels(lst, min_size, collapsed_at,
+                                    expanded_all_at)
 
     def get_tree_at_position(self, pos: Tuple[int, int]) -> Optional[TMTree]:
         """Return the leaf in the displayed-tree rooted at this tree whose
@@ -202,18 +549,52 @@ class TMTree:
         If <pos> is on the shared edge between two or more rectangles,
         always return the leftmost and topmost rectangle (wherever applicable).
         """
+        return self._get_tree_at_position(pos, *self._ancestor_expansion())
+
+    def _get_tree_at_position(self, pos: Tuple[int, int], collapsed_at: int,
+                              expanded_all_at: int) -> Optional[TMTree]:
+        """Helper for get_tree_at_position, given the latest _collapsed_at
+        and _expanded_all_at of the ancestors of this tree.
+        """
         if self.is_empty() or self.data_size == 0:
             return None
-        elif self._subtrees == [] or not self._expanded:
-            x, y, w, h = self.rect
-            ox, oy = pos[0], pos[1]
-            return self if x <= ox <= w + x and y <= oy <= y + h else None
-        else:
-            for subtree in self._subtrees:
-                tree = subtree.get_tree_at_position(pos)
-                if tree is not None:
-                    return tree
-            return None
+        # This is _expansion inlined, as in _update_rectangles.
+        if self._subtrees._live > 0:
+            if self._collapsed_at > collapsed_at:
+                collapsed_at = self._collapsed_at
+            if self._expanded_all_at > expanded_all_at:
+                expanded_all_at = self._expanded_all_at
+            if self._expanded_at > collapsed_at or \
+                    expanded_all_at > collapsed_at:
+                for subtree in self._subtrees.backing():
+                    if subtree is None:
+                        continue
+                    tree = subtree._get_tree_at_position(pos, collapsed_at,
+                                                         expanded_all_at)
+                    if tree is not None:
+                        return tree
+                return None
+        x, y, w, h = self.rect
+        ox, oy = pos[0], pos[1]
+        return self if x <= ox <= w + x and y <= oy <= y + h else None
+
+    def get_displayed_tree(self) -> TMTree:
+        """Return the tree whose rectangle is displayed for this tree: this
+        tree if all of its ancestors are expanded, and otherwise its highest
+        ancestor that is not expanded.
+        """
+        ancestors = []
+        tree = self._parent_ref()
+        while tree is not None:
+            ancestors.append(tree)
+            tree = tree._parent_ref()
+        collapsed_at = expanded_all_at = 0
+        for tree in reversed(ancestors):
+            expanded, collapsed_at, expanded_all_at = \
+                tree._expansion(collapsed_at, expanded_all_at)
+            if not expanded:
+                return tree
+        return self
 
     def update_data_sizes(self) -> int:
         """Update the data_size for this tree and its subtrees, based on the
@@ -223,36 +604,301 @@ class TMTree:
         """
         if self.is_empty():
             return 0
-        elif self._subtrees == []:
+        elif len(self._subtrees) == 0:
             return self.data_size
         else:
             data_size = 0
+            self._largest_leaf = 0
+            self._largest_count = -1
             for subtree in self._subtrees:
                 subtree_size = subtree.update_data_sizes()
                 data_size += subtree_size
+                self._largest_leaf = max(self._largest_leaf,
+                                         subtree._largest())
+            if data_size != self.data_size:
+                self._digest = None
+                TMTree._version += 1
+            if self._subtrees.is_sorted_by_size():
+                self._subtrees.sort_by_size()
             self.data_size = data_size
             return data_size
 
+    def sort_subtrees_by_size(self) -> None:
+        """Sort the subtrees of this tree and of all its descendants by
+        data_size, largest first, and keep them sorted as sizes change.
+
+        This puts the largest tiles first in the treemap, and lets searches
+        by size stop early. Sorting with _subtrees.sort, e.g. by name, stops
+        keeping that list sorted by size.
+        """
+        stack = [self]
+        while stack:
+            tree = stack.pop()
+            subtrees = tree._subtrees
+            subtrees.sort_by_size()
+            if not isinstance(subtrees, _LazySubtreeList) or \
+                    subtrees.is_loaded():
+                stack.extend(subtrees)
+
+    def _largest(self) -> int:
+        """Return the data_size of the largest leaf in this tree.
+        """
+        if len(self._subtrees) == 0:
+            return self.data_size
+        if self._largest_count == 0:
+            self._count_largest(None)
+        return self._largest_leaf
+
+    def _count_largest(self, largest: Optional[int]) -> None:
+        """Set _largest_count to the number of subtrees of this tree whose
+        largest leaf has size <largest>, or if <largest> is None, set
+        _largest_leaf to the largest of them first.
+        """
+        sizes = [subtree._largest() for subtree in self._subtrees]
+        if largest is None:
+            largest = max(sizes)
+            self._largest_leaf = largest
+        self._largest_count = sizes.count(largest)
+
+    def _fix_largest(self, old: Optional[int], new: Optional[int]) -> None:
+        """Update the largest leaf sizes of this tree and its ancestors after
+        the largest leaf size of one of the subtrees of this tree changed from
+        <old> to <new>.
+
+        <old> is -1 if the subtree was just added, or was not counted in the
+        _largest_count of this tree, and <new> is -1 if it was just removed,
+        or None if it is smaller than <old> but not known yet.
+
+        The subtrees are only searched for the new largest leaf when it is
+        next needed, after the last subtree with the largest leaf is removed
+        or shrunk, so that removing many subtrees with the same largest leaf
+        does not search the others each time.
+        """
+        tree = self
+        while tree is not None:
+            before = tree._largest_leaf
+            count = tree._largest_count
+            if len(tree._subtrees) == 0:
+                tree._largest_count = -1
+                new = tree.data_size
+                old = -1 if count == 0 else before
+            elif count == 0:
+                # The largest leaf of this tree is smaller than the one of
+                # its closest ancestor with a known largest leaf. Only a leaf
+                # at least as large as that one changes its ancestors.
+                if new is None or new == -1:
+                    return
+                stale = [tree]
+                tree = tree._attached_parent()
+                while tree is not None and tree._largest_count == 0 and \
+                        len(tree._subtrees) > 0:
+                    stale.append(tree)
+                    tree = tree._attached_parent()
+                if tree is None or new < tree._largest_leaf:
+                    return
+                for stale_tree in stale:
+                    stale_tree._largest_leaf = new
+                    stale_tree._largest_count = 1
+                old = -1
+                continue
+            elif new is not None and new > before:
+                tree._largest_count = 1
+                old = before
+            elif new == before:
+                if old != before and count > 0:
+                    tree._largest_count += 1
+                return
+            elif old != before:
+                return
+            else:
+                if count == -1:
+                    tree._count_largest(before)
+                else:
+                    tree._largest_count -= 1
+                if tree._largest_count > 0:
+                    return
+                old, new = before, None
+                tree = tree._attached_parent()
+                continue
+            tree._largest_leaf = new
+            tree = tree._attached_parent()
+
+    def _get_digest(self) -> bytes:
+        """Return the digest of the names and sizes in this tree, computing
+        it from the digests of the subtrees if needed.
+        """
+        if self._digest is None:
+            hasher = hashlib.blake2b(digest_size=16)
+            if self._name is not None:
+                hasher.update(self._name.encode('utf-8', 'surrogateescape'))
+            hasher.update(f'\0{self.data_size}\0{len(self._subtrees)}\0'
+                          .encode('ascii'))
+            for digest in sorted(subtree._get_digest()
+                                 for subtree in self._subtrees):
+                hasher.update(digest)
+            self._digest = hasher.digest()
+        return self._digest
+
+    def _get_type(self) -> Optional[str]:
+        """Return the type of this leaf, used to group leaves in the type
+        breakdown of a tree, or None if it has no type.
+        """
+        return None
+
+    def _type_counts(self) -> Dict[str, List[int]]:
+        """Return the number of leaves and the total data_size of the leaves
+        of each type in this tree.
+        """
+        if self._types is not None:
+            return self._types
+        if len(self._subtrees) > 0:
+            return {}
+        leaf_type = self._get_type()
+        if leaf_type is None:
+            return {}
+        return {leaf_type: [1, self.data_size]}
+
+    def _propagate_types(self, counts: Dict[str, List[int]],
+                         sign: int) -> None:
+        """Add <counts> to the type counts of this tree and its ancestors if
+        <sign> is 1, or subtract them if <sign> is -1.
+        """
+        if not counts:
+            return
+        tree = self
+        while tree is not None:
+            if tree._types is None:
+                tree._types = {}
+            _add_type_counts(tree._types, counts, sign)
+            tree = tree._attached_parent()
+
+    def get_type_breakdown(self) -> Dict[str, Tuple[int, int]]:
+        """Return the number of leaves and the total data_size of the leaves
+        of each type in this tree.
+
+        This takes time proportional to the number of types, since the counts
+        are collected when the tree is built and kept up to date by edits.
+        """
+        return {leaf_type: (count, size)
+                for leaf_type, (count, size) in self._type_counts().items()}
+
+    def _type_colour(self) -> Tuple[int, int, int]:
+        """Return the colour of the type with the largest total data_size in
+        this tree, or the colour of this tree if it has no types.
+        """
+        counts = self._type_counts()
+        if not counts:
+            return self._colour
+        largest = max(counts, key=lambda t: (counts[t][1], t))
+        code = zlib.crc32(largest.encode('utf-8'))
+        return (code >> 16) & 255, (code >> 8) & 255, code & 255
+
+    def get_largest_leaves(self, k: int, max_depth: Optional[int] = None,
+                           pattern: Optional[str] = None) -> List[TMTree]:
+        """Return the <k> largest leaves of this tree, largest first.
+
+        Only include leaves at most <max_depth> levels below this tree, if
+        <max_depth> is not None, and whose name matches the shell-style
+        <pattern>, if <pattern> is not None.
+
+        Subtrees are searched largest leaf first, so this only visits the
+        subtrees that may contain one of the <k> largest leaves.
+        """
+        leaves = []
+        # Leaves come before subtrees with the same largest leaf size, so that
+        # ties do not make the search visit more subtrees.
+        heap = [(-self._largest(), 0, 0, 0, self)]
+        count = 1
+        while heap and len(leaves) < k:
+            _, _, _, depth, tree = heapq.heappop(heap)
+            if tree.is_empty():
+                continue
+            if len(tree._subtrees) == 0:
+                if pattern is None or fnmatch(tree._name, pattern):
+                    leaves.append(tree)
+                continue
+            for subtree in tree._subtrees:
+                if max_depth is None or depth + 1 < max_depth or \
+                        (depth + 1 == max_depth and
+                         len(subtree._subtrees) == 0):
+                    heapq.heappush(heap, (-subtree._largest(),
+                                          len(subtree._subtrees) > 0, count,
+                                          depth + 1, subtree))
+                    count += 1
+        return leaves
+
+    def get_largest_subtrees(self, k: int, max_depth: Optional[int] = None,
+                             pattern: Optional[str] = None) -> List[TMTree]:
+        """Return the <k> largest subtrees of this tree that are not leaves,
+        largest first. This tree itself is not included.
+
+        Only include subtrees at most <max_depth> levels below this tree, if
+        <max_depth> is not None, and whose name matches the shell-style
+        <pattern>, if <pattern> is not None.
+
+        A subtree is never larger than the tree containing it, so subtrees
+        are searched largest first, and only the subtrees of the trees that
+        were returned or filtered out are visited. If the subtrees are sorted
+        by size, only the largest one of them is visited at first, and each
+        of the others only once the one before it is.
+        """
+        found = []
+        # Each tree is pushed with the index of the next one in the subtrees
+        # of its parent, if those are sorted by size, so that it is pushed
+        # after this one is popped.
+        heap = [(-self.data_size, 0, 0, self, None)]
+        count = 1
+        while heap and len(found) < k:
+            _, _, depth, tree, following = heapq.heappop(heap)
+            if following is not None:
+                siblings = tree._parent_ref()._subtrees
+                if following < len(siblings):
+                    heapq.heappush(heap, (-siblings[following].data_size,
+                                          count, depth, siblings[following],
+                                          following + 1))
+                    count += 1
+                if len(tree._subtrees) == 0:
+                    continue
+            if tree is not self and \
+                    (pattern is None or fnmatch(tree._name, pattern)):
+                found.append(tree)
+            if max_depth is not None and depth >= max_depth:
+                continue
+            if tree._subtrees.is_sorted_by_size():
+                if len(tree._subtrees) > 0:
+                    first = tree._subtrees[0]
+                    heapq.heappush(heap, (-first.data_size, count,
+                                          depth + 1, first, 1))
+                    count += 1
+                continue
+            for subtree in tree._subtrees:
+                if len(subtree._subtrees) > 0:
+                    heapq.heappush(heap, (-subtree.data_size, count,
+                                          depth + 1, subtree, None))
+                    count += 1
+        return found
+
     def move(self, destination: TMTree) -> None:
         """If this tree is a leaf, and <destination> is not a leaf, move this
         tree to be the last subtree of <destination>. Otherwise, do nothing.
         """
         if self.is_empty():
             pass
-        elif self._subtrees == [] and (destination._subtrees != []):
-            destination._subtrees.append(self)
-            self.delete_self()
-            self._parent_tree = destination
-            root = self._surface()
-            root.update_data_sizes()
-            root.update_rectangles(root.rect)
+        elif len(self._subtrees) == 0 and len(destination._subtrees) > 0:
+            parent = self._parent_ref()
+            self._edit_log().record(('move', self, parent,
+                                     parent._subtrees.position(self),
+                                     destination))
+            self._detach()
+            destination._attach(self)
+            self._refresh()
 
     def _surface(self) -> TMTree:
         """Return to the root of the tree.
 
         """
         root = self
-        while root._parent_tree is not None:
+        while root._parent_ref() is not None:
             root = root.get_parent()
         return root
 
@@ -264,21 +910,52 @@ class TMTree:
 
         Do nothing if this tree is not a leaf.
         """
-        if self._subtrees == [] and not self.is_empty():
+        if len(self._subtrees) == 0 and not self.is_empty():
             change = math.ceil(self.data_size * abs(factor))
             if factor > 0:
-                self.data_size += change
+                new_size = self.data_size + change
             else:
-                self.data_size = max(1, self.data_size - change)
+                new_size = max(1, self.data_size - change)
 
-            root = self._surface()
-            root.update_data_sizes()
-            root.update_rectangles(root.rect)
+            self._edit_log().record(('resize', self, self.data_size,
+                                     new_size))
+            self._resize(new_size)
+            self._refresh()
+
+    def _resize(self, new_size: int) -> None:
+        """Set the data_size of this leaf to <new_size>, and update the sizes
+        of its ancestors.
+        """
+        old_size = self.data_size
+        self._propagate_size(new_size - old_size)
+        parent = self._attached_parent()
+        if parent is not None:
+            parent._fix_largest(old_size, new_size)
+            leaf_type = self._get_type() if self._types is None else None
+            if leaf_type is not None:
+                parent._propagate_types(
+                    {leaf_type: [0, new_size - old_size]}, 1)
+
+    def _propagate_size(self, delta: int) -> None:
+        """Add <delta> to the data_size of this tree and all its ancestors,
+        and clear their digests, since this is done on every change to them.
+        Each of them is moved in the subtrees of its parent, if those are
+        sorted by size.
+        """
+        TMTree._version += 1
+        tree = self
+        while tree is not None:
+            tree.data_size += delta
+            tree._digest = None
+            parent = tree._attached_parent()
+            if parent is not None:
+                parent._subtrees.resized(tree, tree.data_size - delta)
+            tree = parent
 
     def _update_empty_folder(self) -> None:
         """ Update the data_size if a folder is empty.
         """
-        parent = self.get_parent()
+        parent = self._attached_parent()
         if parent is not None and len(parent._subtrees) == 1:
             if parent._subtrees[0].data_size == 0:
                 parent.data_size = 0
@@ -295,23 +972,165 @@ class TMTree:
         """
         parent = self.get_parent()
         if parent is not None:
-            parent._subtrees.remove(self)
-            if len(parent._subtrees) == 0:
-                parent.data_size = 0
-                parent._expanded = False
-                parent._update_empty_folder()
-                parent.update_rectangles(parent.rect)
-            root = self._surface()
-            root.update_data_sizes()
-            root.update_rectangles(root.rect)
+            self._edit_log().record(('delete', self, parent,
+                                     parent._subtrees.position(self)))
+            self._detach()
+            self._refresh()
             return True
         return False
 
+    def _detach(self) -> None:
+        """Remove this tree from the subtrees of its parent, and remove its
+        size from its ancestors.
+
+        Leave self._parent_tree as it is (see delete_self).
+
+        Precondition: self._parent_tree is not None.
+        """
+        parent = self._parent_ref()
+        parent._subtrees.remove(self)
+        self._detached = True
+        parent._propagate_size(-self.data_size)
+        parent._fix_largest(self._largest(), -1)
+        parent._propagate_types(self._type_counts(), -1)
+        TMTree._path_epoch += 1
+        if len(parent._subtrees) == 0:
+            # An empty folder is never expanded, so it is not collapsed here,
+            # which would collapse the subtree put back in it by undo.
+            parent.data_size = 0
+            parent.rect = (0, 0, 0, 0)
+            parent._update_empty_folder()
+
+    def _attach(self, subtree: TMTree, position: Optional[int] = None) -> None:
+        """Add <subtree> back at the <position> it had in the subtrees of this
+        tree, or as the last subtree of this tree if <position> is None, and
+        add its size to this tree and its ancestors.
+        """
+        if position is None:
+            self._subtrees.append(subtree)
+        else:
+            self._subtrees.restore(subtree, position)
+        subtree._parent_tree = self
+        subtree._detached = False
+        self._propagate_size(subtree.data_size)
+        self._fix_largest(-1, subtree._largest())
+        self._propagate_types(subtree._type_counts(), 1)
+
+    def _refresh(self) -> None:
+        """Update the rectangles of the whole tree containing this tree after
+        it was changed, or defer this until the batch open on it is closed.
+        """
+        root = self._surface()
+        if root._batch_depth > 0:
+            root._batch_dirty = True
+        else:
+            root.update_rectangles(root.rect)
+
+    @contextmanager
+    def batch(self, undoable: bool = True) -> Iterator[TMTree]:
+        """Open a batch on the whole tree containing this tree, and yield the
+        root of that tree.
+
+        While the batch is open, calls to delete_self, move and change_size on
+        any tree in it only update data sizes along the path to the root, and
+        the rectangles of the whole tree are updated once when the batch is
+        closed. Batches may be nested.
+
+        If <undoable> is False, the edits made while the batch is open are not
+        recorded, and the edits made before cannot be undone after them (see
+        commit), so that the trees removed are freed as soon as they are no
+        longer used.
+
+        >>> with tree.batch():
+        ...     for leaf in leaves:
+        ...         leaf.delete_self()
+        """
+        root = self._surface()
+        root._batch_depth += 1
+        log = None
+        if not undoable:
+            log = root._edit_log()
+            log.paused += 1
+        try:
+            yield root
+        finally:
+            if log is not None:
+                log.paused -= 1
+            root._batch_depth -= 1
+            if root._batch_depth == 0 and root._batch_dirty:
+                root._batch_dirty = False
+                root.update_rectangles(root.rect)
+
+    def _edit_log(self) -> _EditLog:
+        """Return the log of edits of the whole tree containing this tree.
+        """
+        root = self._surface()
+        if root._edits is None:
+            root._edits = _EditLog()
+        return root._edits
+
+    def undo(self) -> bool:
+        """Undo the last delete_self, move or change_size made on the whole
+        tree containing this tree, and return whether there was one to undo.
+        """
+        edit = self._edit_log().pop_done()
+        if edit is None:
+            return False
+        kind, tree = edit[0], edit[1]
+        if kind == 'resize':
+            tree._resize(edit[2])
+        else:
+            if kind == 'move':
+                tree._detach()
+            edit[2]._attach(tree, edit[3])
+        tree._refresh()
+        return True
+
+    def redo(self) -> bool:
+        """Redo the last edit undone on the whole tree containing this tree,
+        and return whether there was one to redo.
+
+        Making a new edit discards the edits that can be redone.
+        """
+        edit = self._edit_log().pop_undone()
+        if edit is None:
+            return False
+        kind, tree = edit[0], edit[1]
+        if kind == 'resize':
+            tree._resize(edit[3])
+        else:
+            tree._detach()
+            if kind == 'move':
+                edit[4]._attach(tree)
+        tree._refresh()
+        return True
+
+    def commit(self) -> None:
+        """Forget the edits made to the whole tree containing this tree, so
+        that they can no longer be undone or redone, and the trees they
+        removed are freed as soon as they are no longer used.
+        """
+        self._edit_log().clear()
+
+    def checkpoint(self) -> int:
+        """Return a checkpoint of the whole tree containing this tree, which
+        can be restored with undo_to, unless the edits since were forgotten.
+        """
+        return self._edit_log().checkpoint()
+
+    def undo_to(self, checkpoint: int) -> None:
+        """Undo the edits made to the whole tree containing this tree since
+        <checkpoint> was taken, or as many of them as were not forgotten.
+        """
+        with self.batch():
+            while self._edit_log().checkpoint() > checkpoint and self.undo():
+                pass
+
     def expand(self) -> None:
         """Expand the folder by one depth.
         If this tree is empty of a leaf, do nothing.
         """
-        if self._subtrees == [] or self.is_empty():
+        if len(self._subtrees) == 0 or self.is_empty():
             pass
         else:
             self._expanded = True
@@ -319,20 +1138,12 @@ class TMTree:
 
     def expand_all(self) -> None:
         """Expand the entire tree from the root.
-        """
-        self._expand_all_helper()
-        self.update_rectangles(self.rect)
 
-    def _expand_all_helper(self) -> None:
-        """Helper for expand_all.
-        If this tree is empty of a leaf, do nothing.
+        This takes constant time, apart from updating the rectangles.
         """
-        if self._subtrees == [] or self.is_empty():
-            pass
-        else:
-            self._expanded = True
-            for subtree in self._subtrees:
-                subtree._expand_all_helper()
+        if len(self._subtrees) > 0 and not self.is_empty():
+            self._expanded_all_at = TMTree._tick()
+        self.update_rectangles(self.rect)
 
     def collapse(self) -> None:
         """Collapse the folder by one depth.
@@ -340,25 +1151,16 @@ class TMTree:
         """
         parent = self.get_parent()
         if parent is not None:
-            parent._collapse_helper()
+            parent._expanded = False
             parent.update_rectangles(parent.rect)
 
-    def _collapse_helper(self) -> None:
-        """Helper function for collapse.
-        If this tree is empty of a leaf, do nothing.
-        """
-        if self._subtrees == [] or self.is_empty():
-            pass
-        else:
-            self._expanded = False
-            for subtree in self._subtrees:
-                subtree._collapse_helper()
-
     def collapse_all(self) -> None:
         """Collapse the entire tree from the root.
+
+        This takes constant time, apart from updating the rectangles.
         """
         root = self._surface()
-        root._collapse_helper()
+        root._expanded = False
         root.update_rectangles(root.rect)
 
     # Methods for the string representation
@@ -367,12 +1169,35 @@ class TMTree:
         Return a string representing the path containing this tree
         and its ancestors, using the separator for this OS between each
         tree's name.
+
+        The path strings of this tree and its parent are cached until a tree
+        is moved or deleted.
         """
-        if self._parent_tree is None:
+        if self._parent_ref() is None:
             return self._name
-        else:
-            return self._parent_tree.get_path_string() + \
-                self.get_separator() + self._name
+        epoch = TMTree._path_epoch
+        if self._path is not None and self._path[0] == epoch:
+            return self._path[1]
+
+        parent = self._parent_ref()
+        parent_cached = parent._path is not None and parent._path[0] == epoch
+        parts = []
+        tree = self
+        while tree is not None:
+            parts.append(tree._name)
+            if tree._parent_ref() is None:
+                break
+            parts.append(tree.get_separator())
+            tree = tree._parent_ref()
+            if tree._path is not None and tree._path[0] == epoch:
+                parts.append(tree._path[1])
+                break
+        path = ''.join(reversed(parts))
+        if not parent_cached:
+            parent._path = (epoch, path[:len(path) - len(parts[0])
+                                        - len(parts[1])])
+        self._path = (epoch, path)
+        return path
 
     def get_separator(self) -> str:
         """Return the string used to separate names in the string
@@ -387,6 +1212,475 @@ class TMTree:
         raise NotImplementedError
 
 
+class _EditLog:
+    """A log of the edits made to a tree, for undoing and redoing them.
+
+    Each edit is a tuple whose first element is its kind:
+    - ('delete', tree, parent, position)
+    - ('move', tree, parent, position, destination)
+    - ('resize', tree, old_size, new_size)
+    where <parent> and <position> describe where <tree> was before the edit,
+    and <position> is from _SubtreeList.position.
+
+    Only the last UNDO_LIMIT edits are kept.
+
+    === Public Attributes ===
+    paused:
+        The number of batches open that do not record edits. While it is
+        more than 0, each edit clears the log instead of being recorded,
+        since the edits before it could not be undone correctly.
+
+    === Private Attributes ===
+    _done:
+        The edits that can be undone, oldest first.
+    _undone:
+        The edits that can be redone, most recently undone last.
+    _forgotten:
+        The number of edits removed from the start of _done, so that
+        checkpoints stay the same as old edits are forgotten.
+    """
+
+    paused: int
+    _done: Deque[Tuple[Any, ...]]
+    _undone: List[Tuple[Any, ...]]
+    _forgotten: int
+
+    def __init__(self) -> None:
+        """Initialize an empty edit log.
+        """
+        self.paused = 0
+        self._done = deque(maxlen=UNDO_LIMIT)
+        self._undone = []
+        self._forgotten = 0
+
+    def record(self, edit: Tuple[Any, ...]) -> None:
+        """Record the new <edit>, discarding the edits that can be redone,
+        and the oldest edit if there are too many.
+        """
+        if self.paused > 0:
+            self.clear()
+            return
+        if len(self._done) == self._done.maxlen:
+            self._forgotten += 1
+        self._done.append(edit)
+        self._undone.clear()
+
+    def clear(self) -> None:
+        """Forget all the edits, so that none can be undone or redone.
+        """
+        self._forgotten += len(self._done)
+        self._done.clear()
+        self._undone.clear()
+
+    def pop_done(self) -> Optional[Tuple[Any, ...]]:
+        """Remove and return the last edit that can be undone, or None.
+        """
+        if not self._done:
+            return None
+        edit = self._done.pop()
+        self._undone.append(edit)
+        return edit
+
+    def pop_undone(self) -> Optional[Tuple[Any, ...]]:
+        """Remove and return the last edit that can be redone, or None.
+        """
+        if not self._undone:
+            return None
+        edit = self._undone.pop()
+        self._done.append(edit)
+        return edit
+
+    def checkpoint(self) -> int:
+        """Return the number of edits made and not undone, including the
+        forgotten ones.
+        """
+        return self._forgotten + len(self._done)
+
+
+class _SubtreeList:
+    """The subtrees of a tree, in order, which supports removing a subtree in
+    constant time, as well as the list operations used on subtrees.
+
+    Removed subtrees leave a None tombstone behind, and the tombstones are
+    compacted away once there are more of them than live subtrees. Each
+    subtree also has a position, which increases along the list and is kept
+    through compaction, so that a removed subtree can be restored to where it
+    was: into its tombstone, if that was not compacted away yet.
+
+    Traversals of the tree that are run on every frame read the list backing
+    this one directly (see backing), skipping the tombstones.
+
+    A list can instead be kept sorted by data_size, largest first, with
+    sort_by_size. Subtrees are then inserted where their size belongs, and
+    moved when their size changes (see resized), and removed subtrees leave
+    no tombstones, since their position is not needed to restore them.
+
+    === Private Attributes ===
+    _items:
+        The subtrees, with None in place of removed subtrees.
+    _positions:
+        The position of each item in _items, or None if nothing has been
+        removed yet, in which case the position of each item is its index.
+    _slots:
+        A map from the id of each subtree to its position, or None if nothing
+        has been removed yet. Its index in _items is found by bisecting
+        _positions, so that it does not change when other subtrees are
+        restored or compacted.
+    _live:
+        The number of subtrees that have not been removed.
+    _head:
+        The number of items at the start of _items that are known to be
+        tombstones, so that looking up the first subtree does not skip them
+        again.
+    _tail:
+        The number of items at the end of _items that are known to be
+        tombstones.
+    _by_size:
+        Whether this list is kept sorted by data_size, largest first. If so,
+        _positions and _slots are None.
+    """
+
+    __slots__ = ('_items', '_positions', '_slots', '_live', '_head', '_tail',
+                 '_by_size')
+    _items: List[Optional[TMTree]]
+    _positions: Optional[List[int]]
+    _slots: Optional[Dict[int, int]]
+    _live: int
+    _head: int
+    _tail: int
+    _by_size: bool
+
+    def __init__(self, subtrees: Iterable[TMTree] = ()) -> None:
+        """Initialize a new list of the given <subtrees>.
+        """
+        self._items = list(subtrees)
+        self._positions = None
+        self._slots = None
+        self._live = len(self._items)
+        self._head = self._tail = 0
+        self._by_size = False
+
+    def __len__(self) -> int:
+        return self._live
+
+    def __iter__(self) -> Iterator[TMTree]:
+        if self._live == len(self._items):
+            return iter(self._items)
+        return (item for item in self._items if item is not None)
+
+    def __getitem__(self, index: Any) -> Any:
+        items = self._items
+        if self._live == len(items):
+            return items[index]
+        if isinstance(index, slice):
+            return [item for item in items if item is not None][index]
+        if index < 0:
+            index += self._live
+        if not 0 <= index < self._live:
+            raise IndexError('subtree index out of range')
+        # The item is looked for from whichever end of the list is closer,
+        # starting after the tombstones already known to be at that end.
+        if index <= self._live // 2:
+            i = self._head
+            while items[i] is None:
+                i += 1
+            self._head = i
+            while index > 0:
+                i += 1
+                if items[i] is not None:
+                    index -= 1
+        else:
+            skip = self._live - 1 - index
+            i = len(items) - 1 - self._tail
+            while items[i] is None:
+                i -= 1
+            self._tail = len(items) - 1 - i
+            while skip > 0:
+                i -= 1
+                if items[i] is not None:
+                    skip -= 1
+        return items[i]
+
+    def __contains__(self, subtree: TMTree) -> bool:
+        if self._by_size:
+            try:
+                self._find(subtree, subtree.data_size)
+            except ValueError:
+                return False
+            return True
+        if self._slots is None:
+            return any(item is subtree for item in self._items)
+        return self._slot(subtree) is not None
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, (list, _SubtreeList)):
+            return len(self) == len(other) and list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f'_SubtreeList({list(self)!r})'
+
+    def __getstate__(self) -> List[TMTree]:
+        return list(self)
+
+    def __setstate__(self, state: List[TMTree]) -> None:
+        self.__init__(state)
+
+    def backing(self) -> List[Optional[TMTree]]:
+        """Return the list backing this list, in which removed subtrees are
+        None. It must not be changed.
+        """
+        return self._items
+
+    def _track(self) -> None:
+        """Start tracking the position of every subtree.
+        """
+        if self._slots is None:
+            self._positions = list(range(len(self._items)))
+            self._slots = {id(item): i for i, item in enumerate(self._items)}
+
+    def _slot(self, subtree: TMTree) -> Optional[int]:
+        """Return the index of <subtree> in _items, or None if it is not in
+        this list.
+
+        Precondition: the positions of the subtrees are tracked.
+        """
+        position = self._slots.get(id(subtree))
+        if position is None:
+            return None
+        slot = bisect_left(self._positions, position)
+        if slot < len(self._items) and self._items[slot] is subtree:
+            return slot
+        return None
+
+    def _compact(self) -> None:
+        """Remove all tombstones from _items.
+        """
+        if self._live == len(self._items):
+            return
+        live = [i for i, item in enumerate(self._items) if item is not None]
+        self._items = [self._items[i] for i in live]
+        self._positions = [self._positions[i] for i in live]
+        self._head = self._tail = 0
+
+    def append(self, subtree: TMTree) -> None:
+        """Add <subtree> to the end of this list, or where its size belongs
+        if this list is sorted by size.
+        """
+        if self._by_size:
+            insort(self._items, subtree, key=_negative_size)
+            self._live += 1
+            return
+        if self._slots is not None:
+            position = self._positions[-1] + 1 if self._positions else 0
+            self._slots[id(subtree)] = position
+            self._positions.append(position)
+        self._items.append(subtree)
+        self._live += 1
+        self._tail = 0
+
+    def remove(self, subtree: TMTree) -> None:
+        """Remove <subtree> from this list.
+
+        Raise ValueError if <subtree> is not in this list.
+        """
+        if self._by_size:
+            del self._items[self._find(subtree, subtree.data_size)]
+            self._live -= 1
+            return
+        self._track()
+        slot = self._slot(subtree)
+        if slot is None:
+            raise ValueError('subtree is not in this list')
+        del self._slots[id(subtree)]
+        self._items[slot] = None
+        self._live -= 1
+        if len(self._items) - self._live > max(16, self._live):
+            self._compact()
+
+    def position(self, subtree: TMTree) -> int:
+        """Return the position of <subtree>, which can be passed to restore
+        after <subtree> is removed.
+
+        Raise ValueError if <subtree> is not in this list.
+        """
+        if self._by_size:
+            return self._find(subtree, subtree.data_size)
+        self._track()
+        if self._slot(subtree) is None:
+            raise ValueError('subtree is not in this list')
+        return self._slots[id(subtree)]
+
+    def restore(self, subtree: TMTree, position: int) -> None:
+        """Add <subtree> back at the <position> it had before it was removed,
+        or where its size belongs if this list is sorted by size.
+        """
+        if self._by_size:
+            self.append(subtree)
+            return
+        self._track()
+        slot = bisect_left(self._positions, position)
+        if slot < len(self._items) and self._positions[slot] == position:
+            # The tombstone left by <subtree> is still there.
+            self._items[slot] = subtree
+        else:
+            self._items.insert(slot, subtree)
+            self._positions.insert(slot, position)
+        self._slots[id(subtree)] = position
+        self._live += 1
+        self._head = min(self._head, slot)
+        self._tail = min(self._tail, len(self._items) - 1 - slot)
+
+    def index(self, subtree: TMTree) -> int:
+        """Return the index of <subtree> in this list.
+        """
+        if self._by_size:
+            return self._find(subtree, subtree.data_size)
+        i = 0
+        for item in self._items:
+            if item is subtree:
+                return i
+            if item is not None:
+                i += 1
+        raise ValueError('subtree is not in this list')
+
+    def sort(self, key: Any = None, reverse: bool = False) -> None:
+        """Sort this list in place, like list.sort, and stop keeping it
+        sorted by size.
+        """
+        self._compact()
+        self._items.sort(key=key, reverse=reverse)
+        self._positions = None
+        self._slots = None
+        self._by_size = False
+        TMTree._version += 1
+
+    def sort_by_size(self) -> None:
+        """Sort this list by data_size, largest first, keeping the order of
+        subtrees of the same size, and keep it sorted from now on.
+        """
+        self.sort(key=_negative_size)
+        self._by_size = True
+
+    def is_sorted_by_size(self) -> bool:
+        """Return whether this list is kept sorted by size.
+        """
+        return self._by_size
+
+    def resized(self, subtree: TMTree, old_size: int) -> None:
+        """Move <subtree>, whose data_size was just changed from <old_size>,
+        to where its new size belongs, if this list is sorted by size.
+        """
+        if self._by_size:
+            del self._items[self._find(subtree, old_size)]
+            insort(self._items, subtree, key=_negative_size)
+
+    def _find(self, subtree: TMTree, size: int) -> int:
+        """Return the index of <subtree> in this list, which is sorted by
+        size, with <subtree> sorted as if its data_size were <size>.
+
+        Raise ValueError if <subtree> is not in this list.
+        """
+        items = self._items
+        i = bisect_left(items, -size, key=lambda item: -(
+            size if item is subtree else item.data_size))
+        while i < len(items) and (items[i] is subtree or
+                                  items[i].data_size == size):
+            if items[i] is subtree:
+                return i
+            i += 1
+        raise ValueError('subtree is not in this list')
+
+
+class _LazySubtreeList(_SubtreeList):
+    """The subtrees of a tree, which are only created when they are first
+    needed, apart from their number.
+
+    The subtrees are created by calling _load_subtrees() on the tree that
+    owns this list, which must return them with their parent already set.
+
+    === Private Attributes ===
+    _owner:
+        A weak reference to the tree whose subtrees are in this list, or None
+        if they have been created.
+    """
+
+    __slots__ = ('_owner',)
+    _owner: Optional[weakref.ref]
+
+    def __init__(self, owner: TMTree, count: int) -> None:
+        """Initialize a list of the <count> subtrees of <owner>, which are
+        not created yet.
+        """
+        super().__init__()
+        self._owner = weakref.ref(owner)
+        self._live = count
+
+    def is_loaded(self) -> bool:
+        """Return whether the subtrees in this list have been created.
+        """
+        return self._owner is None
+
+    def _load(self) -> None:
+        """Create the subtrees in this list, if they were not created yet.
+        """
+        if self._owner is not None:
+            owner, self._owner = self._owner(), None
+            self._items = list(owner._load_subtrees())
+            self._live = len(self._items)
+            if self._by_size:
+                self._items.sort(key=_negative_size)
+                for subtree in self._items:
+                    subtree.sort_subtrees_by_size()
+
+    def __iter__(self) -> Iterator[TMTree]:
+        self._load()
+        return super().__iter__()
+
+    def __getitem__(self, index: Any) -> Any:
+        self._load()
+        return super().__getitem__(index)
+
+    def backing(self) -> List[Optional[TMTree]]:
+        self._load()
+        return self._items
+
+    def __contains__(self, subtree: TMTree) -> bool:
+        self._load()
+        return super().__contains__(subtree)
+
+    def append(self, subtree: TMTree) -> None:
+        self._load()
+        super().append(subtree)
+
+    def remove(self, subtree: TMTree) -> None:
+        self._load()
+        super().remove(subtree)
+
+    def position(self, subtree: TMTree) -> int:
+        self._load()
+        return super().position(subtree)
+
+    def restore(self, subtree: TMTree, position: int) -> None:
+        self._load()
+        super().restore(subtree, position)
+
+    def index(self, subtree: TMTree) -> int:
+        self._load()
+        return super().index(subtree)
+
+    def sort(self, key: Any = None, reverse: bool = False) -> None:
+        self._load()
+        super().sort(key=key, reverse=reverse)
+
+    def sort_by_size(self) -> None:
+        # Subtrees that are not created yet are sorted when they are.
+        if self._owner is None:
+            super().sort_by_size()
+        else:
+            self._by_size = True
+
+
 class FileSystemTree(TMTree):
     """A tree representation of files and folders in a file system.
 
@@ -398,11 +1692,29 @@ class FileSystemTree(TMTree):
 
     The data_size attribute for regular files is simply the size of the file,
     as reported by os.path.getsize.
+
+    The digest and the type counts of each folder are computed while it is
+    scanned.
+
+    === Private Attributes ===
+    _location:
+        The absolute path of the folder containing the scanned file or
+        folder. Only set on the root of a scan.
     """
 
-    def __init__(self, path: str) -> None:
+    _location: Optional[str] = None
+
+    def __init__(self, path: str, rules: Optional[ScanRules] = None,
+                 relative: str = '') -> None:
         """Store the file tree structure contained in the given file or folder.
 
+        If <rules> is given, the files and folders in the given folder that
+        it excludes are left out, and the excluded folders are not listed.
+        It also decides whether symlinks are followed, and which folders and
+        hard links are scanned.
+        <relative> is the path of <path> under the folder being scanned,
+        which is given when scanning the folders in it.
+
         Precondition: <path> is a valid path for this computer.
         """
         # Remember that you should recursively go through the file system
@@ -410,14 +1722,59 @@ class FileSystemTree(TMTree):
         # encountered.
         #
         # Also remember to make good use of the superclass constructor!
-        if not os.path.isdir(path):
-            super().__init__(os.path.basename(path),
-                             [], os.path.getsize(path))
+        if rules is None:
+            is_folder = os.path.isdir(path)
+        else:
+            if not relative:
+                rules.start_scan(path)
+            status = rules.get_status(path)
+            is_folder = S_ISDIR(status.st_mode)
+        if not is_folder:
+            super().__init__(os.path.basename(path), [],
+                             os.path.getsize(path) if rules is None
+                             else status.st_size)
         else:
             subtree = []
             for p in os.listdir(path):
-                subtree.append(FileSystemTree(os.path.join(path, p)))
+                child = os.path.join(path, p)
+                if rules is None:
+                    tree = FileSystemTree(child)
+                else:
+                    status = rules.get_status(child)
+                    if not rules.is_scanned(status):
+                        continue
+                    child_relative = f'{relative}/{p}' if relative else p
+                    is_folder = S_ISDIR(status.st_mode)
+                    if rules.is_excluded(child_relative, is_folder):
+                        # Only excluded folders may be shown as a tile.
+                        tree = rules.excluded_tree(child) if is_folder \
+                            else None
+                        if tree is not None:
+                            subtree.append(tree)
+                        continue
+                    tree = FileSystemTree(child, rules, child_relative)
+                del tree._location
+                subtree.append(tree)
             super().__init__(os.path.basename(path), subtree)
+            if self._types is None:
+                self._types = {}
+        self._location = os.path.dirname(os.path.abspath(path))
+        self._get_digest()
+
+    def get_file_path(self) -> str:
+        """Return the absolute path of the file or folder this tree
+        represents, from its path string under the scanned folder.
+
+        Trees that were moved in the visualisation get the path they were
+        moved to, not the path they were scanned at.
+        """
+        return os.path.join(self._surface()._location, self.get_path_string())
+
+    def _get_type(self) -> Optional[str]:
+        """Return the extension of this file, in lower case, or its name if
+        it is a core dump, or '' if it has neither.
+        """
+        return _file_type(self._name)
 
     def get_separator(self) -> str:
         """Return the file separator for this OS.
@@ -427,13 +1784,6 @@ class FileSystemTree(TMTree):
     def get_suffix(self) -> str:
         """Return the final descriptor of this tree.
         """
-
-        def convert_size(data_size: float, suffix: str = 'B') -> str:
-            suffixes = {'B': 'kB', 'kB': 'MB', 'MB': 'GB', 'GB': 'TB'}
-            if data_size < 1024 or suffix == 'TB':
-                return f'{data_size:.2f}{suffix}'
-            return convert_size(data_size / 1024, suffixes[suffix])
-
         components = []
         if len(self._subtrees) == 0:
             components.append('file')
@@ -444,11 +1794,89 @@ class FileSystemTree(TMTree):
         return f' ({", ".join(components)})'
 
 
+def _negative_size(tree: TMTree) -> int:
+    """Return minus the data_size of <tree>, to sort trees largest first.
+    """
+    return -tree.data_size
+
+
+def _file_type(name: str) -> str:
+    """Return the extension of the file called <name>, in lower case, or
+    'core' if it is a core dump, or '' if it has neither.
+    """
+    name = name.lower()
+    if name == 'core' or name.startswith('core.'):
+        return 'core'
+    return os.path.splitext(name)[1]
+
+
+def _add_type_counts(counts: Dict[str, List[int]],
+                     other: Dict[str, List[int]], sign: int) -> None:
+    """Add the type counts <other> to <counts> if <sign> is 1, or subtract
+    them if <sign> is -1, removing the types with no leaves left.
+    """
+    for leaf_type, (count, size) in other.items():
+        entry = counts.get(leaf_type)
+        if entry is None:
+            counts[leaf_type] = [sign * count, sign * size]
+        else:
+            entry[0] += sign * count
+            entry[1] += sign * size
+            if entry[0] == 0:
+                del counts[leaf_type]
+
+
+def convert_size(data_size: float, suffix: str = 'B') -> str:
+    """Return <data_size>, in units of <suffix>, as a string in the largest
+    unit (up to TB) in which it is at least 1.
+    """
+    suffixes = {'B': 'kB', 'kB': 'MB', 'MB': 'GB', 'GB': 'TB'}
+    if data_size < 1024 or suffix == 'TB':
+        return f'{data_size:.2f}{suffix}'
+    return convert_size(data_size / 1024, suffixes[suffix])
+
+
+@contextmanager
+def bulk_build(freeze: bool = False) -> Iterator[None]:
+    """Keep the cyclic garbage collector from scanning the trees built
+    inside this context while they are built, and afterwards too if
+    <freeze> is True.
+
+    The collector is disabled while the trees are built, since otherwise it
+    runs again and again over all the trees built so far, none of which are
+    garbage. It is enabled again when the outermost context is left, and
+    then scans what was built once more as it ages.
+
+    If <freeze> is True, everything in the whole process when the outermost
+    context is left is also frozen (see gc.freeze), not only the trees, so
+    that later collections skip it. Frozen objects in reference cycles are
+    never collected unless gc.unfreeze is called, so this is only for
+    programs that build their trees once, like treemap_cli. Trees do not
+    form reference cycles, so they are still freed once they are no longer
+    used.
+
+    >>> with bulk_build():
+    ...     tree = FileSystemTree('/home')
+    """
+    if not gc.isenabled():
+        yield
+        return
+    gc.disable()
+    try:
+        yield
+    finally:
+        if freeze:
+            gc.freeze()
+        gc.enable()
+
+
 if __name__ == '__main__':
     import python_ta
 
     python_ta.check_all(config={
         'allowed-import-modules': [
-            'python_ta', 'typing', 'math', 'random', 'os', '__future__'
+            'python_ta', 'typing', 'math', 'random', 'os', '__future__', 'gc',
+            'contextlib', 'bisect', 'heapq', 'fnmatch', 'zlib', 'hashlib',
+            'weakref', 'collections', 'stat'
         ]
     })
@@ -0,0 +1,261 @@
+"""Assignment 2: Treemap command-line summaries
+
+=== Module Description ===
+This module prints text summaries of the data in a TMTree, such as its
+largest files and folders and the total size of each file type, for when
+opening the treemap visualiser is not possible or not needed, e.g. in
+scheduled jobs or on servers without a display.
+
+Run it with the path of a file, folder, or tar or zip archive, for example:
+
+    python treemap_cli.py example-directory/workshop --top 10
+
+It can also load a snapshot saved with the snapshots module, a papers dataset
+(a .csv file), an ncdu export (a .json file), or a find listing (with
+--format find). With --gui, the tree is shown in the treemap visualiser
+instead, and with --serve PORT, its treemap is served to browsers by the
+tile_server module. With --estimate, the sizes of a folder are estimated from
+a sample of it, by the estimates module, and refined in the background if it
+is shown with --gui. Folders can be left out of the scan with gitignore-style
+rules, given with --exclude, --include and --exclude-from, and symlinks, other
+file systems and hard links can be scanned like in du, with
+--no-follow-symlinks, --one-file-system and --count-links-once, as in the
+scan_rules module.
+
+Only the modules needed for the given data are imported, and pygame is only
+imported for --gui, so that the summary starts quickly.
+"""
+import argparse
+import os
+from typing import TYPE_CHECKING, List, Optional
+
+from tm_trees import TMTree, FileSystemTree, bulk_build, convert_size
+
+if TYPE_CHECKING:
+    from scan_rules import ScanRules
+
+# The formats of data that can be loaded, for --format.
+FORMATS = ('auto', 'path', 'archive', 'snapshot', 'papers', 'ncdu', 'find')
+
+
+def print_largest(tree: TMTree, k: int, max_depth: Optional[int] = None,
+                  pattern: Optional[str] = None) -> None:
+    """Print the <k> largest leaves and the <k> largest folders in <tree>,
+    with their sizes and paths.
+
+    <max_depth> and <pattern> filter the results, as in
+    TMTree.get_largest_leaves.
+    """
+    print(f'Largest {k} files:')
+    _print_trees(tree.get_largest_leaves(k, max_depth, pattern))
+    print(f'Largest {k} folders:')
+    _print_trees(tree.get_largest_subtrees(k, max_depth, pattern))
+
+
+def print_types(tree: TMTree) -> None:
+    """Print the number of files and the total size of each file type in
+    <tree>, largest total size first.
+    """
+    breakdown = tree.get_type_breakdown()
+    print('Size by type:')
+    for leaf_type in sorted(breakdown, key=lambda t: -breakdown[t][1]):
+        count, size = breakdown[leaf_type]
+        print(f'{convert_size(size):>12}  {count:>8} files  '
+              f'{leaf_type or "(no extension)"}')
+
+
+def print_changes(old: TMTree, new: TMTree) -> None:
+    """Print the paths that were added, removed or resized from <old> to
+    <new>, with the change in their size, largest change first.
+    """
+    from scan_diff import diff_trees
+
+    changes = diff_trees(old, new)
+    print('Changes:')
+    for kind, path, delta in sorted(changes, key=lambda c: -abs(c[2])):
+        sign = '+' if delta >= 0 else '-'
+        print(f'{sign + convert_size(abs(delta)):>12}  {kind:<8} {path}')
+
+
+def load_tree(path: str, data_format: str = 'auto',
+              rules: Optional['ScanRules'] = None) -> TMTree:
+    """Return the tree of the data at <path>, in the given <data_format>,
+    one of FORMATS.
+
+    Files and folders excluded by <rules> are left out of the scan of a
+    folder, which also follows its options for links and file systems.
+
+    With 'auto', the format is guessed: folders are scanned, snapshots are
+    recognised by their contents, .csv files are papers datasets, .json files
+    are ncdu exports, tar and zip archives are opened without being
+    extracted, and any other file is scanned.
+    """
+    if data_format == 'auto':
+        data_format = _guess_format(path)
+    if data_format == 'snapshot':
+        from snapshots import open_snapshot
+        return open_snapshot(path)
+    if data_format == 'papers':
+        from papers import PaperTree
+        return PaperTree(os.path.basename(path), [], all_papers=True,
+                         by_year=True, lazy=True, data_file=path)
+    if data_format == 'ncdu':
+        from importers import import_ncdu
+        return import_ncdu(path)
+    if data_format == 'find':
+        from importers import import_find_listing
+        return import_find_listing(path)
+    if data_format == 'archive':
+        from archives import open_archive
+        tree = open_archive(path, nested=True)
+        # Open the nested archives now, so that the sizes that are printed
+        # are those of their contents, and do not change while it is queried.
+        tree._open_nested_archives(True)
+        return tree
+    return FileSystemTree(path, rules)
+
+
+def _guess_format(path: str) -> str:
+    """Return the format, other than 'auto', of the data at <path>.
+    """
+    if not os.path.isfile(path):
+        return 'path'
+    from snapshots import MAGIC
+    with open(path, 'rb') as file:
+        if file.read(len(MAGIC)) == MAGIC:
+            return 'snapshot'
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.csv':
+        return 'papers'
+    if extension == '.json':
+        return 'ncdu'
+    from archives import is_archive
+    return 'archive' if is_archive(path) else 'path'
+
+
+def _print_trees(trees: List[TMTree]) -> None:
+    """Print the size and path of each tree in <trees>, one per line.
+    """
+    for tree in trees:
+        print(f'{convert_size(tree.data_size):>12}  {tree.get_path_string()}')
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Print a summary of the data given in the command-line arguments
+    <argv>, or show it in the treemap visualiser.
+    """
+    parser = argparse.ArgumentParser(
+        description='Print the largest files and folders under a path.')
+    parser.add_argument('path', help='the file, folder, archive, snapshot or '
+                                     'listing to summarise')
+    parser.add_argument('--format', choices=FORMATS, default='auto',
+                        help='the format of the data at the path')
+    parser.add_argument('-k', '--top', type=int, default=10,
+                        help='how many files and folders to print')
+    parser.add_argument('--depth', type=int, default=None,
+                        help='only include entries at most this deep')
+    parser.add_argument('--pattern', default=None,
+                        help="only include names matching this shell "
+                             "pattern, e.g. '*.log'")
+    parser.add_argument('--types', action='store_true',
+                        help='also print the total size of each file type')
+    parser.add_argument('--compare', metavar='SNAPSHOT', default=None,
+                        help='also print what changed since the scan saved '
+                             'in this snapshot file')
+    parser.add_argument('--gui', action='store_true',
+                        help='show the data in the treemap visualiser instead')
+    parser.add_argument('--exclude', metavar='PATTERN', action='append',
+                        dest='rules', default=[],
+                        help="leave out the files and folders matching this "
+                             "gitignore-style pattern, e.g. 'node_modules/'")
+    parser.add_argument('--include', metavar='PATTERN', action='append',
+                        dest='rules', type=lambda pattern: '!' + pattern,
+                        help='include the files and folders matching this '
+                             'pattern again, if an earlier one excluded them')
+    parser.add_argument('--exclude-from', metavar='FILE', default=None,
+                        help='read patterns from this gitignore-style file, '
+                             'before the ones given with --exclude')
+    parser.add_argument('--show-excluded', action='store_true',
+                        help='show each excluded folder as one tile, with '
+                             'its size estimated from a sample of it')
+    parser.add_argument('--no-follow-symlinks', action='store_false',
+                        dest='follow_symlinks',
+                        help='count symlinks as small files, instead of '
+                             'scanning what they point to')
+    parser.add_argument('-x', '--one-file-system', action='store_true',
+                        help='leave out folders on other file systems')
+    parser.add_argument('--count-links-once', action='store_true',
+                        help='count files with several hard links once')
+    parser.add_argument('--estimate', action='store_true',
+                        help='estimate the sizes in a folder from a sample '
+                             'of it, which is much faster for large folders')
+    parser.add_argument('--serve', metavar='PORT', type=int, default=None,
+                        help='serve the treemap of the data to browsers on '
+                             'this port instead')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='the address to serve the treemap at')
+    args = parser.parse_args(argv)
+
+    rules = None
+    if args.rules or args.exclude_from is not None or \
+            not args.follow_symlinks or args.one_file_system or \
+            args.count_links_once:
+        from scan_rules import ScanRules
+        patterns = list(args.rules)
+        if args.exclude_from is not None:
+            with open(args.exclude_from, encoding='utf-8') as file:
+                patterns[:0] = file.read().splitlines()
+        rules = ScanRules(patterns, args.show_excluded, args.follow_symlinks,
+                          args.one_file_system, args.count_links_once)
+    if args.estimate:
+        # Estimates sample the folders themselves, without rules.
+        if args.format not in ('auto', 'path'):
+            parser.error('--estimate only estimates folders, not '
+                         f'--format {args.format}')
+        if rules is not None:
+            parser.error('--estimate cannot leave files out of the scan or '
+                         'change how links and file systems are scanned')
+        from estimates import estimate_tree
+        tree = estimate_tree(args.path)
+    else:
+        with bulk_build(freeze=True):
+            tree = load_tree(args.path, args.format, rules)
+    try:
+        _show(tree, args)
+    finally:
+        # Snapshots keep their file open while their subtrees are read.
+        if hasattr(tree, 'close'):
+            tree.close()
+
+
+def _show(tree: TMTree, args: argparse.Namespace) -> None:
+    """Print a summary of <tree>, or show it in the treemap visualiser, as
+    asked in the parsed command-line arguments <args>.
+    """
+    if args.gui:
+        from estimates import EstimatedTree, Refiner
+        from treemap_visualiser import Visualiser
+        visualiser = Visualiser()
+        if isinstance(tree, EstimatedTree):
+            visualiser.refiner = Refiner(tree)
+            visualiser.refiner.start()
+        visualiser.run_visualisation(tree)
+        return
+    if args.serve is not None:
+        from tile_server import serve
+        tree.expand_all()
+        serve(tree, args.host, args.serve)
+        return
+
+    print(f'{tree.get_path_string()}{tree.get_suffix()}')
+    print_largest(tree, args.top, args.depth, args.pattern)
+    if args.types:
+        print_types(tree)
+    if args.compare is not None:
+        from snapshots import open_snapshot
+        with open_snapshot(args.compare) as old:
+            print_changes(old, tree)
+
+
+if __name__ == '__main__':
+    main()
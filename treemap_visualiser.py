@@ -20,14 +20,30 @@ and detecting user events like mouse clicks and key presses and responding
 to them.
 """
 import os
+import sys
+import time
+from collections import deque, OrderedDict
 from os import getcwd
 from sys import platform
-from typing import Optional
+from typing import Deque, Dict, List, Optional
 
 import pygame
 
-from papers import PaperTree
-from tm_trees import TMTree, FileSystemTree
+import instrumentation
+from duplicates import find_duplicates
+from estimates import EstimatedTree, Refiner
+from instrumentation import phase
+from tm_trees import TMTree, FileSystemTree, bulk_build, convert_size
+
+# The font size of the names drawn inside tiles, and the space left around
+# them. Tiles too small to hold a name are not labelled.
+LABEL_FONT_SIZE = 14
+LABEL_PADDING = 3
+# The number of rendered names kept, so that names are not rendered again in
+# every frame.
+LABEL_CACHE_SIZE = 4096
+# The space between the stripes drawn over tiles whose sizes are estimated.
+HATCH_SPACING = 8
 
 
 class Visualiser:
@@ -41,6 +57,18 @@ class Visualiser:
     screen: Optional[pygame.Surface]
     hover_node: Optional[TMTree]
     selected_node: Optional[TMTree]
+    colour_by_type: bool
+    duplicates: Optional[List[TMTree]]
+    show_stats: bool
+    show_labels: bool
+    refiner: Optional[Refiner]
+    _fonts: Dict[int, pygame.font.Font]
+    _labels: OrderedDict
+    _hatch: Optional[pygame.Surface]
+    _frame_times: Deque[float]
+    _last_frame: Optional[float]
+    _display_text: Optional[tuple]
+    _message: Optional[str]
 
     def __init__(self) -> None:
         # You may adjust the height and width as you'd like, depending on your screen resolution
@@ -53,6 +81,31 @@ class Visualiser:
         self.screen = None
         self.hover_node = None
         self.selected_node = None
+        self.colour_by_type = False
+        # The duplicate files to highlight, or None if they are not shown.
+        self.duplicates = None
+        # Whether the frame rate and the time of each phase are shown; the
+        # phases are only timed while they are.
+        self.show_stats = False
+        self._frame_times = deque(maxlen=60)
+        self._last_frame = None
+        # Whether names are drawn inside the tiles big enough to hold them.
+        self.show_labels = True
+        # The fonts used, by size, and the rendered names, by name and size,
+        # least recently used first.
+        self._fonts = {}
+        self._labels = OrderedDict()
+        # The refiner of the estimated sizes in the tree, if they are being
+        # refined, and the stripes drawn over the estimated tiles.
+        self.refiner = None
+        self._hatch = None
+
+        # The last display text, with the node, width, path and suffix it
+        # was computed for.
+        self._display_text = None
+        # The result of the last command, shown instead of the display text
+        # until another node is selected.
+        self._message = None
 
     def run_visualisation(self, tree: TMTree) -> None:
         """Display an interactive graphical display of the given tree's treemap.
@@ -85,32 +138,162 @@ class Visualiser:
         except ValueError:
             return
 
-        for rect, colour in self.tree.get_rectangles():
-            # Note that the arguments are in the opposite order
-            pygame.draw.rect(subscreen, colour, rect)
-
-        # add the hover rectangle
-        if self.selected_node is not None:
-            pygame.draw.rect(subscreen, (255, 255, 255), self.selected_node.rect, 4)
-        if self.hover_node is not None:
-            pygame.draw.rect(subscreen, (255, 255, 255), self.hover_node.rect, 2)
-
-        self._render_text()
+        with phase('render.rectangles'):
+            rectangles = self.tree.get_rectangles(self.colour_by_type)
+
+        with phase('render.draw'):
+            for rect, colour in rectangles:
+                # Note that the arguments are in the opposite order
+                pygame.draw.rect(subscreen, colour, rect)
+
+            # stripe the displayed rectangles whose sizes are estimated
+            if isinstance(self.tree, EstimatedTree):
+                hatch = self._get_hatch()
+                for rect in self.tree.get_estimated_rectangles():
+                    subscreen.blit(hatch, rect[:2], rect)
+
+            # outline the displayed rectangles that contain duplicate files
+            if self.duplicates is not None:
+                highlighted = {id(tree): tree for tree in
+                               (leaf.get_displayed_tree() for leaf in self.duplicates)}
+                for tree in highlighted.values():
+                    pygame.draw.rect(subscreen, (255, 0, 0), tree.rect, 2)
+
+            # add the hover rectangle
+            if self.selected_node is not None:
+                pygame.draw.rect(subscreen, (255, 255, 255), self.selected_node.rect, 4)
+            if self.hover_node is not None:
+                pygame.draw.rect(subscreen, (255, 255, 255), self.hover_node.rect, 2)
+
+        if self.show_labels:
+            with phase('render.labels'):
+                self._render_labels(subscreen)
+
+        with phase('render.text'):
+            self._render_text()
+            if self.show_stats:
+                self._render_stats()
 
         # This must be called *after* all other pygame functions have run.
-        pygame.display.flip()
+        with phase('render.flip'):
+            pygame.display.flip()
+
+    def _get_font(self, size: int) -> pygame.font.Font:
+        """Return the font used for text of the given <size>.
+        """
+        font = self._fonts.get(size)
+        if font is None:
+            font = self._fonts[size] = pygame.font.SysFont('Consolas', size)
+        return font
+
+    def _get_label(self, name: str, size: int) -> pygame.Surface:
+        """Return <name> rendered in white with a dark shadow, in the font of
+        the given <size>.
+        """
+        key = (name, size)
+        label = self._labels.get(key)
+        if label is not None:
+            self._labels.move_to_end(key)
+            return label
+
+        font = self._get_font(size)
+        text = font.render(name, True, pygame.Color('white'))
+        shadow = font.render(name, True, pygame.Color('black'))
+        label = pygame.Surface((text.get_width() + 1, text.get_height() + 1),
+                               pygame.SRCALPHA)
+        label.blit(shadow, (1, 1))
+        label.blit(text, (0, 0))
+        self._labels[key] = label
+        if len(self._labels) > LABEL_CACHE_SIZE:
+            self._labels.popitem(last=False)
+        return label
+
+    def _get_hatch(self) -> pygame.Surface:
+        """Return a transparent surface the size of the display, with
+        diagonal stripes, to draw over the tiles whose sizes are estimated.
+        """
+        if self._hatch is None or \
+                self._hatch.get_size() != (self.width, self.height):
+            self._hatch = pygame.Surface((self.width, self.height),
+                                         pygame.SRCALPHA)
+            for x in range(0, self.width + self.height, HATCH_SPACING):
+                pygame.draw.line(self._hatch, (255, 255, 255, 96), (x, 0),
+                                 (x - self.height, self.height))
+        return self._hatch
+
+    def _render_labels(self, subscreen: pygame.Surface) -> None:
+        """Render the name of each displayed tree inside its tile, if the
+        tile is big enough to hold it.
+        """
+        min_height = self._get_font(LABEL_FONT_SIZE).get_linesize() + \
+            2 * LABEL_PADDING
+        for rect, name in self.tree.get_labels(3 * LABEL_FONT_SIZE,
+                                               min_height):
+            label = self._get_label(name, LABEL_FONT_SIZE)
+            if label.get_width() + 2 * LABEL_PADDING <= rect[2]:
+                subscreen.blit(label, (rect[0] + LABEL_PADDING,
+                                       rect[1] + LABEL_PADDING))
 
     def _render_text(self) -> None:
         """Render text at the bottom of the display.
         """
         # The font we want to use
-        font = pygame.font.SysFont('Consolas', self.font_height - 8)
+        font = self._get_font(self.font_height - 8)
         text_surface = font.render(self._get_display_text(), True, pygame.Color('white'))
 
         # Where to render the text_surface
         text_pos = (0, self.height - self.font_height + 4)
         self.screen.blit(text_surface, text_pos)
 
+    def _render_stats(self) -> None:
+        """Render the frame rate, and the average time of each phase and
+        tree operation, at the top left of the display.
+        """
+        lines = []
+        if self._frame_times:
+            frame = sum(self._frame_times) / len(self._frame_times)
+            lines.append(f'{1 / frame if frame else 0:.1f} FPS '
+                         f'({frame * 1000:.1f} ms per frame)')
+        stats = instrumentation.STATS
+        for name in stats.names():
+            calls, nodes, seconds, _ = stats.get(name)
+            if calls > 0:
+                line = f'{name}: {seconds / calls * 1000:.2f} ms'
+                if nodes > 0:
+                    line += f', {nodes // calls} nodes'
+                lines.append(line)
+
+        font = self._get_font(14)
+        surfaces = [font.render(line, True, pygame.Color('white')) for line in lines]
+        width = max((surface.get_width() for surface in surfaces), default=0)
+        pygame.draw.rect(self.screen, pygame.Color('black'),
+                         (0, 0, width + 8, 16 * len(surfaces) + 8))
+        for i, surface in enumerate(surfaces):
+            self.screen.blit(surface, (4, 4 + 16 * i))
+
+    def _toggle_stats(self) -> None:
+        """Show the frame rate and the time of each phase, and start timing
+        them, or stop if they are shown.
+        """
+        self.show_stats = not self.show_stats
+        if self.show_stats:
+            instrumentation.STATS.reset()
+            instrumentation.enable()
+        else:
+            instrumentation.disable()
+        self._frame_times.clear()
+        self._last_frame = None
+
+    def _export_stats(self) -> None:
+        """Save the times collected since the stats were shown to a file in
+        the current directory.
+        """
+        filename = os.path.join(getcwd(), 'treemap_stats.json')
+        instrumentation.STATS.export(filename)
+        message = 'Stats saved to '
+        self._message = message + _truncate_path(
+            filename, os.sep, self.width // 13 - len(message))
+
     def event_loop(self) -> None:
         """Respond to events (mouse clicks, key presses) and update the display.
 
@@ -127,14 +310,27 @@ class Visualiser:
             if event.type == pygame.QUIT:
                 return
 
+            # show the sizes refined in the background since the last frame
+            if self.refiner is not None:
+                if self.refiner.apply():
+                    self.tree.update_rectangles((0, 0, self.width, self.height - self.font_height))
+                if self.refiner.is_done():
+                    self.refiner = None
+
             if event.type == pygame.VIDEORESIZE:
                 self.width = int(event.w) if event.w else self.width
                 self.height = int(event.h) if event.h else self.height
                 self.run_visualisation(self.tree)
                 return
 
+            now = time.perf_counter()
+            if self.show_stats and self._last_frame is not None:
+                self._frame_times.append(now - self._last_frame)
+            self._last_frame = now
+
             # get the hover position and the corresponding node
-            hover_node = self.tree.get_tree_at_position(pygame.mouse.get_pos())
+            with phase('event.hit_test'):
+                hover_node = self.tree.get_tree_at_position(pygame.mouse.get_pos())
 
             if event.type == pygame.MOUSEBUTTONUP:
                 selected_node = \
@@ -145,23 +341,19 @@ class Visualiser:
                 k = event.key
                 if k == pygame.K_UP:
                     selected_node.change_size(0.01)
-                    self.tree.update_data_sizes()
                     self.tree.update_rectangles((0, 0, self.width, drawable_height))
 
                 elif k == pygame.K_DOWN:
                     selected_node.change_size(-0.01)
-                    self.tree.update_data_sizes()
                     self.tree.update_rectangles((0, 0, self.width, drawable_height))
 
                 elif k == pygame.K_DELETE or platform == 'darwin' and k == pygame.K_BACKSPACE:
                     if selected_node.delete_self():
-                        self.tree.update_data_sizes()
                         self.tree.update_rectangles((0, 0, self.width, drawable_height))
                         selected_node = None
 
                 elif k == pygame.K_m:
                     selected_node.move(hover_node)
-                    self.tree.update_data_sizes()
                     self.tree.update_rectangles((0, 0, self.width, drawable_height))
                     selected_node = hover_node
 
@@ -188,16 +380,63 @@ class Visualiser:
 
             if event.type == pygame.KEYUP and event.key == pygame.K_b:
                 if self.tree.get_parent():
-                    self.tree.get_parent().collapse_all()
+                    # keep the expanded folders, so that the parent's layout
+                    # from before Q was pressed is reused
                     self.run_visualisation(self.tree.get_parent())
                     return
 
+            if event.type == pygame.KEYUP and event.key == pygame.K_t:
+                self.colour_by_type = not self.colour_by_type
+
+            if event.type == pygame.KEYUP and event.key == pygame.K_d:
+                self._toggle_duplicates()
+
+            if event.type == pygame.KEYUP and event.key == pygame.K_l:
+                self.show_labels = not self.show_labels
+
+            if event.type == pygame.KEYUP and event.key == pygame.K_s:
+                # sort from the root, so that going back with B keeps the order
+                root = self.tree
+                while root.get_parent() is not None:
+                    root = root.get_parent()
+                root.sort_subtrees_by_size()
+                self.tree.update_rectangles((0, 0, self.width, self.height - self.font_height))
+
+            if event.type == pygame.KEYUP and event.key == pygame.K_f:
+                self._toggle_stats()
+
+            if event.type == pygame.KEYUP and event.key == pygame.K_p and self.show_stats:
+                self._export_stats()
+
+            if event.type == pygame.KEYUP and event.key in (pygame.K_z, pygame.K_y):
+                changed = self.tree.undo() if event.key == pygame.K_z else self.tree.redo()
+                if changed:
+                    self.tree.update_rectangles((0, 0, self.width, self.height - self.font_height))
+
+            if selected_node is not self.selected_node:
+                self._message = None
             self.selected_node = selected_node
             self.hover_node = hover_node
 
             # Update display
             self.render_display()
 
+    def _toggle_duplicates(self) -> None:
+        """Highlight the duplicate files in the tree, or stop highlighting
+        them if they are highlighted.
+        """
+        if self.duplicates is not None or \
+                not isinstance(self.tree, FileSystemTree):
+            self.duplicates = None
+            self._message = None
+            return
+        groups = find_duplicates(self.tree)
+        self.duplicates = [leaf for group, _ in groups for leaf in group]
+        reclaimable = sum(size for _, size in groups)
+        self._message = f'{len(self.duplicates)} duplicate files in ' \
+                        f'{len(groups)} sets, {convert_size(reclaimable)} ' \
+                        f'reclaimable'
+
     def _handle_click(self, button: int, pos: tuple[int, int],
                       old_selected_leaf: Optional[TMTree]) -> Optional[TMTree]:
         """Return the new selection after handling the mouse event.
@@ -220,24 +459,51 @@ class Visualiser:
             return old_selected_leaf
 
     def _get_display_text(self) -> str:
-        """Return the display text of this leaf.
+        """Return the display text of this leaf, or the result of the last
+        command if it was not seen yet.
         """
+        if self._message is not None:
+            return self._message
 
         leaf = self.selected_node
         if leaf is None:
             return ''
-        else:
-            leaf_path = leaf.get_path_string()
 
-            while len(leaf_path + leaf.get_suffix()) > self.width // 13:
-                components = leaf_path.split(leaf.get_separator())
-                longest = max(len(s) for s in components)
-                if longest <= 3:
-                    break
-                components = [i[:-3] + '..' if len(i) == longest
-                              else i for i in components]
-                leaf_path = leaf.get_separator().join(components)
-            return leaf_path + leaf.get_suffix()
+        leaf_path = leaf.get_path_string()
+        suffix = leaf.get_suffix()
+        key = (leaf, self.width, leaf_path, suffix)
+        if self._display_text is not None and self._display_text[0] == key:
+            return self._display_text[1]
+
+        text = _truncate_path(leaf_path, leaf.get_separator(),
+                              self.width // 13 - len(suffix)) + suffix
+        self._display_text = (key, text)
+        return text
+
+
+def _truncate_path(path: str, separator: str, limit: int) -> str:
+    """Return <path> shortened to at most <limit> characters, if possible.
+
+    The longest components of the path are shortened first, all by the same
+    amount, and end with '..' when shortened. No component is shortened to
+    fewer than 3 characters.
+    """
+    components = path.split(separator)
+    lengths = sorted((len(c) for c in components), reverse=True)
+    total = len(path)
+    cap = lengths[0]
+    longer = 0
+    # Lowering <cap> by one shortens each of the <longer> components that
+    # are at least <cap> characters long by one character.
+    while total > limit and cap > 3:
+        while longer < len(lengths) and lengths[longer] >= cap:
+            longer += 1
+        cap -= 1
+        total -= longer
+    if cap == lengths[0]:
+        return path
+    return separator.join(c if len(c) <= cap else c[:cap - 2] + '..'
+                          for c in components)
 
 
 def run_treemap_file_system(path: str) -> None:
@@ -255,8 +521,16 @@ def run_treemap_file_system(path: str) -> None:
                    '"Up" and "Down" arrow keys to change the size of a file (in visualization)\n' \
                    '"M" to move a file (while selecting a file and hovering over a folder)\n' \
                    '"Del" to delete a file or folder from the visualization\n' \
+                   '"T" to colour files and folders by their largest file type\n' \
+                   '"L" to hide or show the names inside the tiles\n' \
+                   '"S" to sort every folder largest first, and keep it sorted\n' \
+                   '"D" to outline the duplicate files, and the folders containing them\n' \
+                   '"F" to show the frame rate and how long each step of drawing takes\n' \
+                   '"P" to save those timings to treemap_stats.json (while they are shown)\n' \
+                   '"Z" to undo the last delete, move or size change, and "Y" to redo it\n' \
                    '(Drag window to resize)'
-    file_tree = FileSystemTree(path)
+    with bulk_build(freeze=True):
+        file_tree = FileSystemTree(path)
     print(instructions)
     visualizer.run_visualisation(file_tree)
 
@@ -267,13 +541,19 @@ def run_treemap_papers() -> None:
     You can try changing the value of the named argument by_year, but the
     others should stay the same.
     """
-    paper_tree = PaperTree('CS1', [], all_papers=True, by_year=True)
+    from papers import PaperTree
+
+    with bulk_build():
+        paper_tree = PaperTree('CS1', [], all_papers=True, by_year=True)
     visualizer.run_visualisation(paper_tree)
 
 
 if __name__ == '__main__':
     visualizer = Visualiser()
     PATH_TO_VISUALISE = os.path.join(os.getcwd(), 'example-directory', 'workshop')
-    # enter a custom path here if you wish or getcwd()
+    # enter a custom path here if you wish or getcwd(), or pass it as the
+    # first command-line argument
+    if len(sys.argv) > 1:
+        PATH_TO_VISUALISE = sys.argv[1]
     run_treemap_file_system(PATH_TO_VISUALISE)
     # run_treemap_papers()